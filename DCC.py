@@ -2,7 +2,7 @@
 #
 # Work in progress
 #
-# This software decodes DCC model train serial communication to obtain the state of function buttons F1-F12 and throttle.
+# This software decodes DCC model train serial communication to obtain the state of function buttons F0-F68 and throttle.
 # The intent is to use this code with a Raspberry Pi Pico or WaveShare RP2040-Zero to program and actuate signals and gates on a model train layout.
 # Note: appropriate circuitry is needed between the Pico and the railroad tracks to protect the Pico from damage.
 # Note: code was developed using MicroPython version v1.23
@@ -10,123 +10,460 @@
 import uctypes
 import array
 import rp2
+import micropython
+import DCC_pio
 
 ### Definitions
-semaphore = 0	# used to control access to buffered variables for prevention of conflict
 short_address = 127	# maximum threshold of a short address
-func_btn_array = int(0)
-throttle_pos = int(0)
-throttle_dir = int(0)
-data = array.array('L',[0xffffffff,0xffffffff]) 
-
-class pin_addr: 							# retrieve GPIO pin number that connect to the railroad tracks
-    def __init__(self,dccPin,dccAddress):	# and retrieve the short DCC address for this decoder
-        global dcc_address_number			# Note: the address must be between 1 to 127
-        self.dccPin = dccPin
-        dcc_address_number = dccAddress
-        sm1_config()
-        dma_config()
-
-        ### State Machine 0 Code
-        @rp2.asm_pio(set_init=rp2.PIO.IN_HIGH, in_shiftdir=0, out_shiftdir=0, autopull=True, pull_thresh=1, autopush=True, push_thresh=1) # set the bit order direction of OSR and ISR as well as autopull threshold to allow a single bit into the state machine while storing these bits in the ISR until full (32-bits) 
-        def determine_bit():
-            wrap_target()
-
-            wait(1, pin, 0)	[31]    # wait for GPIO pin to go high
-            nop()       [31]    # stall 32 microseconds
-            nop()       [10]    # stall 10 microseconds
-            jmp(pin, "set_0")   # if GPIO is remains high after 74 microseconds, then jump to set_0
-            set(x, 1)           # if GPIO is low after 74 microseconds, then set scratch x to 1
-            jmp("write_bit")    # since scratch x has been set to 1, skip set_0 and jump to write_bit
-
-            label("set_0")
-            set(x, 0)           # if GPIO is remains high after 74 microseconds, then set scratch x to 0
-
-            label("write_bit")
-            in_(x, 1)	        # move one bit from scratch x into the ISR
-            wait(0, pin, 0)	    # wait for GPIO to go low before looping back to prevent recounting the same 0 bit
-
-            wrap()
-
-        sm0 = rp2.StateMachine(0, determine_bit, freq=1000000, jmp_pin=self.dccPin, in_base=self.dccPin)	# sample pin as input at 2MHz or every 0.5 micro second
-        sm0.active(1)   # set state machine active
-        ### End State Machine 0 Code
+instr_table = array.array('L',[0]*256)	# action for each instruction byte, the same for every decoder, see instr_table_build()
+inputs = [None]*4	# pin_addr of each track input, see track_config()
+decoders = []	# every decoder, a decoder finds itself by the _CX_ID word of its context, see func_changed()
+event_flag = None	# asyncio.ThreadSafeFlag set by the decoders when the state changes, see changed()
+state_event = None	# asyncio.Event that wakes every task waiting in changed()
 
-### State Machine 1 Code
-def sm1_config():
-    @rp2.asm_pio(in_shiftdir=0, out_shiftdir=1, autopull=True, pull_thresh=1, autopush=False, push_thresh=32) # set the bit order direction of OSR and ISR as well as autopull threshold to allow a single bit into the state machine while storing these bits in the ISR until full (32-bits) 
-    def build_bitstream():
-        wrap_target()
-
-        # Search for preamble which is more than 9 consecutive ones    
-        label("loop_1")
-        set(y, 10)              # set scratch y to 10, this will be used for searching for the preamble
-        label("pull")
-        pull(block)			    # wait (block) for a 32-bit word to be added to the TX FIFO, then move the word to the OSR
-        out(x, 1)			    # move one bit from OSR to scratch x    
-        jmp(not_y, "find_addr_start_bit")    # if y is zero, then 10 consecutive ones were found which means the preamble was found, jump to find the address start bit
-        jmp(not_x, "loop_1")    # if x is zero, then wrap to reset the y counter to 10
-        jmp(y_dec, "pull")      # if y is 1 or more, then loop back to pull to get the next bit
-
-        # Once preamble is found, then search for address start bit
-        label("find_addr_start_bit")
-        jmp(not_x, "send_bits") # if x is zero, then address start bit is found, jump to send bits to RX FIFO
-        pull(block)			    # wait (block) for a 32-bit word to be added to the TX FIFO, then move the word to the OSR
-        out(x, 1)               # move one bit from OSR to scratch x 
-        jmp("find_addr_start_bit")
-
-        # Once address start bit is found, then gather the next 32 bits into the RX FIFO
-        label("send_bits")
-        set(y, 31)			    # set scratch y to 31, this will count down for each bit to be added to ISR
-
-        label("loop_2")
-        pull(block)			    # wait (block) for a 32-bit word to be added to the TX FIFO, then move the word to the OSR
-        out(x, 1)			    # move one bit from OSR to scratch x
-        in_(x, 1)			    # move one bit from scratch x to ISR
-        jmp(y_dec, "loop_2")	# loop back until 32 bits (bit stream) have filled the ISR
-        
-        push(noblock)		    # move the 32-bits from the ISR to the RX FIFO
-
-        # Once address start bit is found, then gather the next 3 bits into the RX FIFO
-        set(y, 2)			    # set scratch y to 2, this will count down for each bit to be added to ISR
-    
-        label("loop_3")
-        pull(block)			    # wait (block) for a 3-bit word to be added to the TX FIFO, then move the word to the OSR
-        out(x, 1)			    # move one bit from OSR to scratch x
-        in_(x, 1)			    # move one bit from scratch x to ISR
-        jmp(y_dec, "loop_3")	# loop back until 3 bits (bit stream) have filled the ISR
-        
-        push(noblock)		    # move the 32-bits from the ISR to the RX FIFO
+# Index of the context of a decoder, one array('L') for each decoder that the viper functions are given instead of
+# module globals, so each track input has its own state, address matcher, callbacks and counters. The tables of
+# the decoder are passed by address, see decoder_config().
+_CX_ID = const(0)		# position of the decoder in decoders
+_CX_STATE = const(1)	# address of the state, see snapshot()
+_CX_SLOTS = const(2)	# address of the state slot + 1 of each short address, 0 if the address is not decoded
+_CX_HASH = const(3)		# address of the hash table of long addresses, each entry is address << 8 | state slot + 1, 0 is an empty entry
+_CX_HASH_MASK = const(4)	# mask of the hash table index
+_CX_CACHE = const(5)	# address of the last packet words of each address and instruction group, see packet_repeat()
+_CX_CACHE_MASK = const(6)	# mask of the repeat cache index
+_CX_TURNOUTS = const(7)	# address of one bit for each accessory address 1 to 2040, 1 is closed (straight) and 0 is thrown (diverging)
+_CX_ASPECTS = const(8)	# address of the aspect of each extended accessory address 1 to 2040
+_CX_TIMING = const(9)	# address of timing_cfg in the timing mode, 0 otherwise
+_CX_CB = const(10)		# function buttons that have a callback in each function word, then _CB_THR and _CB_EVENT
+_CX_LAST_DMA = const(15)	# 1 or 2 for the packet channel whose interrupt ran last in the soft interrupt mode, see packet_take()
+_CX_REPEATS = const(16)	# packets skipped as repeats, the counters that stats() resets start here
+_CX_DECODED = const(17)	# packets that were not repeats
+_CX_ST_ON = const(18)	# 1 while the counters below run
+_CX_FRAMED = const(19)	# packets received from State Machine 1
+_CX_MATCHED = const(20)	# packets for this decoder, including skipped repeats
+_CX_REJECTED = const(21)	# packets with a wrong length or error detection byte
+_CX_BAD_LENGTH = const(22)	# rejected packets that were too long or too short, State Machine 1 lost the packet and waited for the next preamble
+_CX_RING_OVERRUNS = const(23)	# packets overwritten in the hard_irq ring before drain() decoded them
+_CX_IRQ_LOST = const(24)	# packets of the soft interrupt mode replaced by the next packet before their interrupt ran, or whose interrupt never ran
+_CX_GLITCHES = const(25)	# high pulses rejected by the glitch filter, see DCC_pio.glitch_filter()
+_CX_SCHEDULE_FULL = const(26)	# ring interrupts that could not schedule drain() because the schedule queue was full
+_CX_HIST = const(27)	# 16 words, the number of packets decoded in under 512 << n CPU ticks, the last also counts every longer decode
+_CX_WORDS = const(43)
+
+# Actions of the instruction table
+_IGNORE = const(0)		# instruction has no effect on this decoder
+_FUNC = const(1)		# function buttons from the instruction byte
+_SPEED28 = const(2)		# 28 step speed and direction from the instruction byte
+_SPEED128 = const(3)	# 128 step speed and direction from the byte after the instruction
+_FUNC_EXP = const(4)	# 8 function buttons from the byte after the instruction, F13-F28 and F29-F68
+
+# Index of the state words, each address has _STATE_WORDS words after the sequence counter
+_SEQ = const(0)		# sequence counter, odd while func_btn_array_build() is writing the state
+_SPEED = const(0)	# throttle position
+_DIR = const(1)		# throttle direction
+_FUNCS = const(2)	# function words, each holds whole instruction groups so a packet changes one word, see func_word()
+_STATE_WORDS = const(5)	# F0-F28 in the 1st function word, F29-F60 in the 2nd and F61-F68 in the 3rd
+_CB_THR = const(3)		# word after _CX_CB, bit 0 for a speed callback and bit 1 for a direction callback
+_CB_EVENT = const(4)	# word after _CX_CB, 1 when changed() is used
+_FUNC_FIRST = (0, 29, 61)	# function button number of bit 0 of each function word
+
+# Ring of packets for the hard interrupt mode
+_RING_MASK = const(0)	# index of ring_cfg, number of packets in the ring - 1
+_RING_OFF = const(1)	# index of the first word of the ring in ring_mem
+_TIME_OFF = const(2)	# index of the first word of the ring in time_mem
+_TIME_ADDR = const(3)	# address of the first word of the time ring
+_TIME_WRITE = const(4)	# address of the write address register of the time stamp channel
+_HEAD = const(0)		# index of ring_idx, number of packets written by DMA
+_TAIL = const(1)		# number of packets decoded by drain()
+_PENDING = const(2)		# 1 while a drain() is scheduled
+_READ = const(3)		# number of packets read by ring_read()
+
+# Result of func_btn_array_build()
+_BAD = const(0)			# packet with a wrong length or error detection byte
+_OTHER = const(1)		# packet for another address
+_MATCHED = const(2)		# packet for this decoder, including accessory packets
+_TM_MASK = const(0)		# index of timing_cfg, number of words in the ring - 1
+_TM_ADDR = const(1)		# address of the first word of the ring
+_TM_WRITE = const(2)	# address of the write address register of the channel that writes the ring
+_TM_READ = const(3)		# ring index of the next word to count
+_TM_COUNT = const(4)	# address of timing_count
+_TC_ONES = const(0)		# index of timing_count, high half bits in the 1 window, 52 to 65 microseconds
+_TC_ZEROS = const(1)	# high half bits of 89 microseconds or longer
+_TC_SHORT = const(2)	# high half bits shorter than 52 microseconds, such as glitches
+_TC_BETWEEN = const(3)	# high half bits between the 1 and the 0 window
+_TC_SUM = const(4)		# sum of the widths of the high half bits in the 1 window, in microseconds
+_TC_SQUARES = const(5)	# sum of the squares of their difference from 58 microseconds
+_TC_MIN = const(6)		# narrowest and widest high half bit in the 1 window
+_TC_MAX = const(7)
+# Timing windows of measure_bit(), one byte each in microseconds, the first byte is used first. The window after the
+# one a half bit ends in is pushed with it, and only the window after the 1 window has an odd length, so the LSB of
+# the word is the bit that State Machine 1 reads. The last window has no length, every longer half bit is a 0.
+_WIN_SHORT = const(49)	# until 52 microseconds after the rising edge
+_WIN_ONE = const(12)	# until 66 microseconds, NMRA asks for 52 to 64 but the length has to be even
+_WIN_BETWEEN = const(21)	# until 89 microseconds
+_ONE_START = const(53)	# the width of a 1 half bit is _ONE_START + _WIN_ONE - the microseconds left in the window
+_SYST_CSR = const(0xE000E010)	# SysTick control register, see the Cortex-M0+ documentation
+_SYST_CVR = const(0xE000E018)	# SysTick current value, counts CPU clock cycles down from 0xFFFFFF
+
+class decoder:	# the state, address matcher, callbacks and counters of a list of addresses, without state machines
+    def __init__(self,dccAddress,on_func=None,on_speed=None,on_dir=None,stats=False):	# decoder(3).decode(data0, data1) decodes packets from any source
+        self.ctx = array.array('L',[0]*_CX_WORDS)	# see _CX_ID
+        decoder_config(self, dccAddress)
+        callback_config(self,on_func,on_speed,on_dir)
+        self.stats_enable(stats)
+        self.ctx[_CX_ID] = len(decoders)
+        if event_flag is not None:	# changed() is already used, it wakes on this decoder as well
+            self.ctx[_CX_CB + _CB_EVENT] = 1
+        decoders.append(self)
+
+    def decode(self, data0, data1):	# skip a repeat or decode the two words of a packet from State Machine 1
+        packet_decode(data0, data1, self.ctx)
+
+    def state_base(self, addr):   # first state word of an address, None is the first address of the decoder
+        if addr is None:
+            return 1
+        if addr > short_address:
+            match = addr_parser((0b11 << 14 | addr) << 16, self.ctx)  # look the address up the same way as a packet
+        else:
+            match = addr_parser(addr << 24, self.ctx)
+        if match < 0:
+            raise ValueError("DCC address %d is not decoded" % addr)
+        return 1 + (match >> 8) * _STATE_WORDS
+
+    def snapshot(self, addr=None): # return (throttle position, throttle direction, function button array) from the same moment
+        # bit n of the function button array is function button n, F0 to F68
+        state = self.state
+        base = self.state_base(addr)
+        while True:
+            seq = state[_SEQ]
+            if seq & 1:     # the state is being written, read it again
+                continue
+            speed = state[base + _SPEED]
+            direction = state[base + _DIR]
+            funcs = state[base + _FUNCS] | state[base + _FUNCS + 1] << 29 | state[base + _FUNCS + 2] << 61
+            if state[_SEQ] == seq:  # no packet was decoded while reading, so the values belong together
+                return speed, direction, funcs
+
+    # A single state word is always read whole, so these never wait and never return None
+    def f_btn(self, func_btn_number, addr=None): # return the boolean value of the x'th bit from the function button array
+        word, bit = func_word(func_btn_number)
+        return ((self.state[self.state_base(addr) + _FUNCS + word] >> bit & 1) != 0)
+
+    def thr_pos(self, addr=None):
+        return self.state[self.state_base(addr) + _SPEED]
+
+    def thr_dir(self, addr=None):
+        return self.state[self.state_base(addr) + _DIR]
+
+    def acc_state(self, acc_addr):    # return True if accessory address 1 to 2040 is closed (straight), False if it is thrown (diverging)
+        return ((self.turnouts[acc_addr >> 5] >> (acc_addr & 31) & 1) != 0)
+
+    def acc_aspect(self, acc_addr):   # return the last aspect sent to extended accessory address 1 to 2040
+        return self.aspects[acc_addr]
+
+    def repeat_stats(self):	# return (repeats skipped, packets decoded), the packets skipped saved a decode each
+        return self.ctx[_CX_REPEATS], self.ctx[_CX_DECODED]
+
+    def stats_enable(self, on=True):  # start or stop the counters, they keep their values while stopped
+        if on:
+            systick_start()
+        self.ctx[_CX_ST_ON] = 1 if on else 0
+
+    def stats(self, reset=False):	# return a dictionary of the counters, reset=True starts them again from zero
+        # parse_hist[n] is the number of packets decoded in under 512 << n CPU ticks (4 << n microseconds at 125 MHz)
+        c = self.ctx
+        result = {
+            "framed": c[_CX_FRAMED],
+            "matched": c[_CX_MATCHED],
+            "rejected": c[_CX_REJECTED],
+            "bad_length": c[_CX_BAD_LENGTH],
+            "repeats": c[_CX_REPEATS],
+            "ring_overruns": c[_CX_RING_OVERRUNS],
+            "irq_lost": c[_CX_IRQ_LOST],
+            "glitches": c[_CX_GLITCHES],
+            "schedule_full": c[_CX_SCHEDULE_FULL],
+            "parse_hist": list(c[_CX_HIST:_CX_HIST + 16]),
+        }
+        if reset:
+            for i in range(_CX_REPEATS, _CX_WORDS):
+                if i != _CX_ST_ON:
+                    c[i] = 0
+        return result
+
+class pin_addr(decoder): 							# retrieve GPIO pin number that connect to the railroad tracks
+    def __init__(self,dccPin,dccAddress,packed=False,hard_irq=False,ring=64,on_func=None,on_speed=None,on_dir=None,record=None,addr_filter=None,stats=False,timing=False,glitch=0,track=0):	# and retrieve the DCC address for this decoder, or a list of addresses
+        self.dccPin = dccPin				# packed=True sends 32 decoded bits per FIFO word instead of one bit per word
+        if track not in (0, 1, 2, 3):		# track=0 to 3 selects a track input with its own state machines, DMA channels and decoder, see track_config()
+            raise ValueError("track must be 0 to 3")
+        if inputs[track] is not None:
+            raise ValueError("track %d is already decoded" % track)
+        if timing and packed:				# timing=True measures every high half bit against the NMRA windows, see bit_timing()
+            raise ValueError("timing=True sends one word per bit and cannot be packed")
+        if glitch and (timing or not 0 < glitch <= 20):	# glitch=N ignores a high pulse unless it stays high for N samples, 2 microseconds apart
+            raise ValueError("glitch must be 1 to 20 samples and cannot be used with timing=True")
+        if not 0 < ring <= 4096:			# hard_irq=True has DMA write a ring of 'ring' packets with time stamps, which are decoded in batches with drain()
+            raise ValueError("ring must be 1 to 4096 packets")
+        addresses = address_list(dccAddress)
+        pattern, bits = filter_config(addr_filter, addresses)	# addr_filter=True drops packets for other addresses in PIO, see addr_filter_config()
+        self.programs = track_plan(track, packed, timing, glitch, bits)	# raises ValueError before any state machine or DMA channel is used
+        dmas = dma_claim(3 + (1 if timing else 0) + (1 if bits else 0))
+        try:
+            decoder.__init__(self,addresses,on_func,on_speed,on_dir,stats)	# callbacks that are called when a function button, the speed or the direction changes, stats=True counts the packets and the time to decode them, see stats()
+            self.track = track
+            self.sm = track_config(track)		# the first of the two state machines of the track
+            self.data = array.array('L',[0xffffffff,0xffffffff])	# packet words written by DMA
+            self.odd_dma = None				# dma3 in the soft interrupt mode, see packet_take()
+            self.ring_mem = array.array('L',[0,0,0,0])	# ring of packets written by DMA in the hard interrupt mode, two words per packet, see ring_dma_config()
+            self.time_mem = array.array('L',[0,0])	# ring of the time stamp of each packet, written by DMA after the packet
+            self.ring_cfg = array.array('L',[1,0,0,0,0])	# mask of the ring index, offset of the rings in ring_mem and time_mem, address of the time ring and of the write address register of the time stamp channel
+            self.ring_idx = array.array('L',[0,0,0,0])	# packets written, packets decoded, drain scheduled flag and packets read by ring_read()
+            self.timing_count = array.array('L',[0,0,0,0,0,0,255,0])	# half bits in each timing window and the widths of the one half bits, see bit_timing()
+            self.recorder = None				# called after each drain() to write the packets to a capture, see DCC_capture.py
+            self._drain = self.drain			# bound once, the hard interrupt must not allocate memory
+            if record is not None:				# record=stream writes every packet with its time stamp to a capture, which needs the ring of the hard interrupt mode
+                hard_irq = True
+                import DCC_capture
+                self.recorder = DCC_capture.writer(record, track=track).poll
+            sm1_config(self.programs[1])
+            filter_sm = None
+            if bits:
+                filter_sm = self.programs[2][0]
+                addr_filter_config(self.programs[2], pattern)
+            dma_config(self,dmas,hard_irq,ring,filter_sm,timing)
+            sm0_config(self.programs[0], dccPin, timing, glitch, self.glitch_irq)
+        except BaseException:	# release the DMA channels so the track can be started again, the next start configures the state machines again
+            for dma in dmas:
+                dma.close()
+            if decoders and decoders[-1] is self:
+                decoders.pop()
+            raise
+        inputs[track] = self
+
+    def packet_irq(self, dma):	# decode the packet words when a packet DMA channel completes
+        packet_take(self.data, self.ctx, 2 if dma is self.odd_dma else 1)   # every packet is decoded or skipped as a repeat, readers use the sequence counter instead of blocking the decoder
+
+    # A hard interrupt must not allocate memory, the DMA has already written the packet and its time stamp,
+    # so this only counts the packets and schedules one drain() for however many packets arrive before the scheduler runs it
+    def ring_irq(self, dma):
+        if ring_count(self.ring_cfg, self.ring_idx):
+            try:
+                micropython.schedule(self._drain, None)
+            except RuntimeError:	# the schedule queue is full, the packets stay in the ring and the next packet schedules the drain again
+                self.ring_idx[_PENDING] = 0
+                self.ctx[_CX_SCHEDULE_FULL] += 1
 
-        wrap()
+    def glitch_irq(self, pio):	# count a pulse rejected by the glitch filter
+        glitch_count(self.ctx)
 
-    sm1 = rp2.StateMachine(1, build_bitstream)	# build array of bit at clock speed
+    def drain(self, _=None):  # decode every packet waiting in the ring, can also be called from the main loop
+        self.ring_idx[_PENDING] = 0  # clear first, so a packet arriving during the drain schedules another drain
+        n = int(ring_drain(self.ring_cfg, self.ring_idx, self.ring_mem, self.ctx))
+        if self.recorder is not None:
+            self.recorder()
+        return n
+
+    def ring_read(self):    # return (packets, lost) in the hard interrupt mode, packets is a list of (time stamp, data0, data1)
+        # of each packet received since the last call, and lost is the number of packets overwritten before they were read
+        # The time stamp is in microseconds and can be compared with time.ticks_us() using time.ticks_diff()
+        ring_cfg = self.ring_cfg
+        ring_idx = self.ring_idx
+        mask = ring_cfg[_RING_MASK]
+        head = ring_idx[_HEAD]
+        tail = ring_idx[_READ]
+        lost = 0
+        if (head - tail) & 0xFFFFFFFF > mask:
+            lost = ((head - tail) & 0xFFFFFFFF) - mask
+            tail = (head - mask) & 0xFFFFFFFF
+        first = tail
+        packets = []
+        while tail != head:
+            i = ring_cfg[_RING_OFF] + ((tail & mask) << 1)
+            packets.append((self.time_mem[ring_cfg[_TIME_OFF] + (tail & mask)] & 0x3FFFFFFF, self.ring_mem[i], self.ring_mem[i + 1]))
+            tail = (tail + 1) & 0xFFFFFFFF
+        ring_idx[_READ] = tail
+        stale = (ring_idx[_HEAD] - mask - first) & 0xFFFFFFFF   # packets that were overwritten while this was reading them
+        if 0 < stale < 0x80000000:
+            stale = min(stale, len(packets))
+            lost += stale
+            packets = packets[stale:]
+        return packets, lost
+
+    def bit_timing(self, reset=False):    # return a dictionary of the high half bits measured in the timing mode, reset=True starts again from zero
+        # The widths are counted when a packet is decoded, so a track section without packets for longer than the
+        # ring of timing_dma_config() only counts the last bits. one_jitter is the standard deviation of the 1 half bits.
+        timing_count = self.timing_count
+        if self.ctx[_CX_TIMING]:
+            timing_fold(self.ctx[_CX_TIMING])
+        ones = timing_count[_TC_ONES]
+        mean = timing_count[_TC_SUM] / ones if ones else 0
+        result = {
+            "ones": ones,
+            "zeros": timing_count[_TC_ZEROS],
+            "short": timing_count[_TC_SHORT],
+            "between": timing_count[_TC_BETWEEN],
+            "one_min": timing_count[_TC_MIN] if ones else 0,
+            "one_max": timing_count[_TC_MAX],
+            "one_mean": mean,
+            "one_jitter": max(timing_count[_TC_SQUARES] / ones - (mean - 58) ** 2, 0) ** 0.5 if ones else 0,
+        }
+        if reset:
+            for i in range(len(timing_count)):
+                timing_count[i] = 0
+            timing_count[_TC_MIN] = 255
+        return result
+
+# Each track input uses two state machines, 3 DMA channels and its own decoder, so up to four tracks fit on one Pico:
+#   track 0: State Machine 0 and 1 of PIO0
+#   track 1: State Machine 2 and 3 of PIO0
+#   track 2: State Machine 0 and 1 of PIO1, which DCC_output.py (sm=5) would also use
+#   track 3: State Machine 2 and 3 of PIO1
+# timing=True takes one more DMA channel and addr_filter one more DMA channel and a free state machine of either PIO.
+# The two tracks of a PIO share their programs, so they need the same packed, timing and glitch settings to fit in its
+# 32 instructions, and the address filter only fits in a PIO without tracks.
+def track_config(track):	# return the number of the first state machine of a track, 0 to 7
+    return 4*(track >> 1) + 2*(track & 1)
+
+def fifo_addr(sm, rx):	# address of the RX or TX FIFO register of state machine 0 to 7, see RP2040 datasheet
+    return 0x50200000 + 0x100000*(sm >> 2) + (0x20 if rx else 0x10) + 4*(sm & 3)
+
+def fifo_dreq(sm, rx):	# DREQ of the RX or TX FIFO of state machine 0 to 7, from DREQ_PIO0_TX0 = 0 to DREQ_PIO1_RX3 = 15
+    return 8*(sm >> 2) + (4 if rx else 0) + (sm & 3)
+
+def track_plan(track, packed, timing, glitch, bits):	# return [(state machine, program)] of State Machine 0, State Machine 1 and the address filter of a track
+    # Checks that the track fits next to the other tracks, before any state machine or DMA channel is used
+    sm = track_config(track)
+    used = {}	# state machines of the other tracks and their filters, and the track that uses them
+    loaded = ([], [])	# programs in each PIO
+    for other in inputs:
+        if other is not None:
+            for n, prog in other.programs:
+                used[n] = other.track
+                loaded[n >> 2].append(prog)
+    plan = [(sm, DCC_pio.sm0_program(packed, timing, glitch)), (sm + 1, DCC_pio.sm1_program(packed))]
+    for n, prog in plan:
+        if n in used:
+            raise ValueError("state machine %d is used by the address filter of track %d" % (n, used[n]))
+        loaded[n >> 2].append(prog)
+    size = program_size(loaded[sm >> 2])
+    if size > 32:
+        raise ValueError("PIO%d needs %d of its 32 instructions for track %d, the two tracks of a PIO need the same packed, timing and glitch settings and an address filter needs a PIO without tracks" % (sm >> 2, size, track))
+    if bits:
+        prog = DCC_pio.filter_program(bits)
+        for n in (4, 5, 6, 7, 0, 1, 2, 3):	# PIO1 first, its state machines are the last ones tracks take
+            if n not in used and n >> 1 != sm >> 1 and program_size(loaded[n >> 2] + [prog]) <= 32:
+                plan.append((n, prog))
+                break
+        else:
+            raise ValueError("addr_filter needs a free state machine in a PIO without tracks")
+    return plan
+
+def program_size(programs):	# number of PIO instructions of a list of programs, a program that is there twice is loaded once
+    unique = []
+    for prog in programs:
+        if prog not in unique:
+            unique.append(prog)
+    return sum(len(prog[0]) for prog in unique)
+
+def dma_claim(n):	# return a list of n DMA channels, or close the channels claimed so far if there are not enough left
+    dmas = []
+    try:
+        for i in range(n):
+            dmas.append(rp2.DMA())
+    except OSError:
+        for dma in dmas:
+            dma.close()
+        raise
+    return dmas
+
+### State Machine 0 Code
+# The programs of the state machines are in DCC_pio.py, see DCC_pio.sm0_program(), DCC_pio.sm1_program() and DCC_pio.filter_program()
+def sm0_config(plan, dccPin, timing, glitch, handler):	# start the program of DCC_pio.sm0_program() on the state machine of plan, see track_plan()
+    sm, prog = plan
+    if timing:
+        sm0 = rp2.StateMachine(sm, prog, freq=2000000, jmp_pin=dccPin, in_base=dccPin)
+        sm0.put(_WIN_SHORT | _WIN_ONE << 8 | _WIN_BETWEEN << 16)
+        sm0.exec("pull()")
+        sm0.exec("mov(y, osr)")     # load the window lengths into scratch y, which the program never changes
+    elif glitch:
+        sm0 = rp2.StateMachine(sm, prog, freq=1000000, jmp_pin=dccPin, in_base=dccPin)
+        sm0.irq(handler=handler, hard=True)  # count each rejected pulse
+    else:
+        sm0 = rp2.StateMachine(sm, prog, freq=1000000, jmp_pin=dccPin, in_base=dccPin)	# sample pin as input at 2MHz or every 0.5 micro second
+    sm0.active(1)   # set state machine active
+### End State Machine 0 Code
+
+### State Machine 1 Code
+def sm1_config(plan):
+    sm, prog = plan
+    sm1 = rp2.StateMachine(sm, prog)	# build array of bit at clock speed
     sm1.active(1)   # set state machine active
 ### End State Machine 1 Code
 
+### Glitch Filter Code
+# DCC_pio.glitch_filter() raises IRQ 0 of State Machine 0 for each pulse that is too short to be a half bit
+@micropython.viper
+def glitch_count(ctx):	# count a pulse rejected by the glitch filter of a decoder
+    c = ptr32(ctx)
+    c[_CX_GLITCHES] = c[_CX_GLITCHES] + 1
+### End Glitch Filter Code
+
+### Address Filter Code
+# The filter runs on a free state machine, between State Machine 1 and the DMA that reads the packets, so a packet
+# for another address is dropped before it raises an interrupt. It compares the leading bits of the first byte of each
+# packet with a pattern. PIO has no AND, so the mask must be leading ones, such as 0xFF (one short address) or 0xC0.
+#   addr_filter=None or (0, 0): every packet passes, as needed for accessory packets or to record everything on the track
+#   addr_filter=True: the leading bits that are the same in the first byte of every decoder address, see filter_bits()
+#   addr_filter=(pattern, mask): the first byte passes when first byte & mask == pattern
+def filter_config(addr_filter, addresses):	# return (pattern, number of leading bits compared), 0 bits passes every packet
+    if addr_filter is True:
+        return filter_bits(addresses)
+    if not addr_filter:
+        return 0, 0
+    pattern, mask = addr_filter
+    bits = 0
+    while bits < 8 and mask & (0x80 >> bits):
+        bits += 1
+    if mask != (0xFF00 >> bits) & 0xFF:
+        raise ValueError("addr_filter mask must be leading ones, such as 0xFF or 0xC0")
+    return (pattern & mask) >> (8 - bits), bits
+
+def addr_filter_config(plan, pattern):	# start the filter on the state machine of plan, see track_plan()
+    sm, prog = plan
+    sm4 = rp2.StateMachine(sm, prog)
+    sm4.put(pattern)
+    sm4.exec("pull()")
+    sm4.exec("mov(y, osr)")     # load the pattern into scratch y, which the program never changes
+    sm4.active(1)   # set state machine active
+
+def filter_bits(addresses):	# return (pattern, number of leading bits) that the first byte of every address has in common
+    firsts = [0xC0 | addr >> 8 if addr > short_address else addr for addr in addresses]
+    bits = 8
+    while bits and any((first ^ firsts[0]) >> (8 - bits) for first in firsts):
+        bits -= 1
+    return firsts[0] >> (8 - bits), bits
+### End Address Filter Code
+
 ### DMA Code
-def dma_config():
-    dma0 = rp2.DMA()    # initialize DMA channel, note: this is listed as DMA 0, but the actual DMA channel number can be any channel from 0 to 11 
-    dma1 = rp2.DMA()    # initialize DMA channel
-    dma2 = rp2.DMA()    # initialize DMA channel
-    dma3 = rp2.DMA()    # initialize DMA channel
+# State Machine 0 and 1 are the two state machines of the track, see track_config(), and dmas are the channels of dma_claim():
+# dma0, dma2 and dma3, then dma1 in the timing mode and the channel of the address filter
+def dma_config(dec,dmas,hard_irq,ring_packets,filter_sm=None,timing=False):
+    dma0 = dmas[0]  # note: this is listed as DMA 0, but the actual DMA channel number can be any channel from 0 to 11
+    dma2 = dmas[1]
+    dma3 = dmas[2]
+    sm = dec.sm
 
-    dma0_ctrl = dma0.pack_ctrl(
-        enable = True,          # enable DMA channel
-        high_pri = True,        # set DMA bus traffic priority as high
-        size = 2,               # Transfer size: 0=byte, 1=half word, 2=word (default: 2)
-        inc_read = False,       # do not increment to read address
-        inc_write = False,      # do not increment the write address
-        ring_size = 0,          # increment size is zero
-        ring_sel = False,       # not used since ring_sel is zero
-        treq_sel = 4,           # select transfer rate of PIO0 RX FIFO, DREQ_PIO0_RX0
-        irq_quiet = True,       # do not generate an interrupt after transfer is complete
-        bswap = False,          # do not reverse the order of the word
-        sniff_en = False,       # do not allow access to debug
-        chain_to = dma1.channel # chain to dma1
-    )
+    RXF0_addr = fifo_addr(sm, True)         # address of RX FIFO register for State Machine 0, see RP2040 datasheet
+    TXF1_addr = fifo_addr(sm + 1, False)    # address of TX FIFO register for State Machine 1
+    RXF1_addr = fifo_addr(sm + 1, True)     # address of RX FIFO register for State Machine 1
+    packet_addr = RXF1_addr         # dma2 and dma3 read the packets from State Machine 1
+    packet_treq = fifo_dreq(sm + 1, True)   # DREQ_PIO0_RX1 on track 0
+    if filter_sm is not None:       # or from the address filter, which the last channel feeds from State Machine 1
+        packet_addr = filter_dma_config(dmas[-1], RXF1_addr, sm + 1, filter_sm)
+        packet_treq = fifo_dreq(filter_sm, True)
 
-    dma1_ctrl = dma1.pack_ctrl(
+    # dma0 moves every word of State Machine 0 to State Machine 1 for as long as its transfer count lasts, which is
+    # days of DCC bits, then its interrupt starts it again. One channel is enough, so four tracks fit in the 12 DMA channels.
+    dma0_ctrl = dma0.pack_ctrl(
         enable = True,          # enable DMA channel
         high_pri = True,        # set DMA bus traffic priority as high
         size = 2,               # Transfer size: 0=byte, 1=half word, 2=word (default: 2)
@@ -134,11 +471,11 @@ def dma_config():
         inc_write = False,      # do not increment the write address
         ring_size = 0,          # increment size is zero
         ring_sel = False,       # not used since ring_sel is zero
-        treq_sel = 4,           # select transfer rate of PIO0 RX FIFO, DREQ_PIO0_RX1
-        irq_quiet = True,       # do not generate an interrupt after transfer is complete
+        treq_sel = fifo_dreq(sm, True), # select transfer rate of the RX FIFO of State Machine 0, DREQ_PIO0_RX0 on track 0
+        irq_quiet = False,      # generate an interrupt after transfer is complete
         bswap = False,          # do not reverse the order of the word
         sniff_en = False,       # do not allow access to debug
-        chain_to = dma0.channel # chain to dma0
+        chain_to = dma0.channel # do not chain
     )
     
     dma2_ctrl = dma2.pack_ctrl(
@@ -149,7 +486,7 @@ def dma_config():
         inc_write = True,      	# increment the write address
         ring_size = 3,          # increment size is 8-bits (2^3)
         ring_sel = True,       	# apply to write address
-        treq_sel = 5,           # select transfer rate of PIO0 RX FIFO, DREQ_PIO0_RX1
+        treq_sel = packet_treq, # select transfer rate of the RX FIFO that holds the packets
         irq_quiet = False,      # generate an interrupt after transfer is complete
         bswap = False,          # do not reverse the order of the word
         sniff_en = False,       # do not allow access to debug
@@ -164,7 +501,7 @@ def dma_config():
         inc_write = True,      	# increment the write address
         ring_size = 3,          # increment size is 8-bits (2^3)
         ring_sel = True,       	# apply to write address
-        treq_sel = 5,           # select transfer rate of PIO0 RX FIFO, DREQ_PIO0_RX1
+        treq_sel = packet_treq, # select transfer rate of the RX FIFO that holds the packets
         irq_quiet = False,      # generate an interrupt after transfer is complete
         bswap = False,          # do not reverse the order of the word
         sniff_en = False,       # do not allow access to debug
@@ -172,118 +509,654 @@ def dma_config():
     )
 
     dma0.active(1)  # set DMA channel active
-    dma1.active(1)  # set DMA channel active
     dma2.active(1)  # set DMA channel active
     dma3.active(1)  # set DMA channel active
 
-    RXF0_addr = const(0x50200020)   # address of RX FIFO register for State Machine 0, see RP2040 datasheet
-    TXF1_addr = const(0x50200014)   # address of TX FIFO register for State Machine 1
-    RXF1_addr = const(0x50200024)   # address of RX FIFO register for State Machine 1
-    
     # configure dma channels
-    dma0_config = dma0.config(read=RXF0_addr, write=TXF1_addr, count=1, ctrl=dma0_ctrl, trigger=True)
-    dma1_config = dma1.config(read=RXF0_addr, write=TXF1_addr, count=1, ctrl=dma1_ctrl, trigger=True)
-    dma2_config = dma2.config(read=RXF1_addr, write=uctypes.addressof(data), count=2, ctrl=dma2_ctrl, trigger=True)
-    dma3_config = dma3.config(read=RXF1_addr, write=uctypes.addressof(data), count=2, ctrl=dma3_ctrl, trigger=True)
-
-    # Note: dma2 and dma3 are configured to alternate their transfer of bits from state machine 1 to the variable "data"
-    dma2.irq(handler=dma23_irq_handler, hard=False)  # call dma23_irq_handler() when dma2 completes transfer of data
-    dma3.irq(handler=dma23_irq_handler, hard=False)  # call dma23_irq_handler() when dma3 completes transfer of data
+    if timing:
+        timing_dma_config(dec, dma0, dmas[3], RXF0_addr, TXF1_addr)
+    else:
+        dma0_config = dma0.config(read=RXF0_addr, write=TXF1_addr, count=0x7FFFFFFF, ctrl=dma0_ctrl, trigger=True)
+        dma0.irq(handler=dma_restart_irq_handler, hard=True)  # start dma0 again when the count runs out
+    if hard_irq:
+        ring_dma_config(dec, dma2, dma3, packet_addr, packet_treq, ring_packets)
+        return
+    dma2_config = dma2.config(read=packet_addr, write=uctypes.addressof(dec.data), count=2, ctrl=dma2_ctrl, trigger=True)
+    dma3_config = dma3.config(read=packet_addr, write=uctypes.addressof(dec.data), count=2, ctrl=dma3_ctrl, trigger=True)
+
+    # Note: dma2 and dma3 are configured to alternate their transfer of bits from state machine 1 to the packet words of the track
+    dec.odd_dma = dma3	# packet_irq() tells the channels apart to count the interrupts that never ran, see packet_take()
+    dma2.irq(handler=dec.packet_irq, hard=False)  # call packet_irq() when dma2 completes transfer of data
+    dma3.irq(handler=dec.packet_irq, hard=False)  # call packet_irq() when dma3 completes transfer of data
+
+# In the hard interrupt mode dma2 writes every packet to a ring of packets, then chains to dma3 which writes the
+# timer to a ring of time stamps and chains back to dma2. The DMA wraps around both rings without the CPU,
+# so a burst of packets waits in the rings until drain() or ring_read() gets to them.
+def ring_dma_config(dec, dma2, dma3, packet_addr, packet_treq, packets):
+    bits = 1
+    while (1 << bits) < packets:   # the DMA ring size is a power of two, from 2 to 4096 packets
+        bits += 1
+    packets = 1 << bits
+
+    # The DMA wraps the write address at a multiple of the ring size,
+    # so twice the ring size is allocated and the ring starts at the aligned address inside it
+    ring_mem = dec.ring_mem = array.array('L',[0]*(4*packets))
+    time_mem = dec.time_mem = array.array('L',[0]*(2*packets))
+    ring_cfg = dec.ring_cfg
+    ring_addr = (uctypes.addressof(ring_mem) + 8*packets - 1) & ~(8*packets - 1)
+    time_addr = (uctypes.addressof(time_mem) + 4*packets - 1) & ~(4*packets - 1)
+    ring_cfg[_RING_MASK] = packets - 1
+    ring_cfg[_RING_OFF] = (ring_addr - uctypes.addressof(ring_mem)) >> 2
+    ring_cfg[_TIME_OFF] = (time_addr - uctypes.addressof(time_mem)) >> 2
+    ring_cfg[_TIME_ADDR] = time_addr
+    ring_cfg[_TIME_WRITE] = 0x50000004 + 0x40*dma3.channel   # WRITE_ADDR register of dma3, see RP2040 datasheet
+
+    dma2_ctrl = dma2.pack_ctrl(
+        enable = True,          # enable DMA channel
+        high_pri = True,        # set DMA bus traffic priority as high
+        size = 2,               # Transfer size: 0=byte, 1=half word, 2=word (default: 2)
+        inc_read = False,       # do not increment to read address
+        inc_write = True,      	# increment the write address
+        ring_size = bits + 3,   # wrap the write address around the ring of 8 byte packets
+        ring_sel = True,       	# apply to write address
+        treq_sel = packet_treq, # select transfer rate of the RX FIFO that holds the packets
+        irq_quiet = True,       # do not generate an interrupt, dma3 does after the time stamp
+        bswap = False,          # do not reverse the order of the word
+        sniff_en = False,       # do not allow access to debug
+        chain_to = dma3.channel # chain to dma3
+    )
+
+    dma3_ctrl = dma3.pack_ctrl(
+        enable = True,          # enable DMA channel
+        high_pri = True,        # set DMA bus traffic priority as high
+        size = 2,               # Transfer size: 0=byte, 1=half word, 2=word (default: 2)
+        inc_read = False,       # do not increment to read address
+        inc_write = True,      	# increment the write address
+        ring_size = bits + 2,   # wrap the write address around the ring of 4 byte time stamps
+        ring_sel = True,       	# apply to write address
+        treq_sel = 0x3F,        # transfer at once, there is no DREQ for the timer
+        irq_quiet = False,      # generate an interrupt after transfer is complete
+        bswap = False,          # do not reverse the order of the word
+        sniff_en = False,       # do not allow access to debug
+        chain_to = dma2.channel # chain to dma2
+    )
+
+    TIMERAWL_addr = const(0x40054028)   # address of the lower word of the microsecond timer, the same timer as time.ticks_us()
+
+    dma2_config = dma2.config(read=packet_addr, write=ring_addr, count=2, ctrl=dma2_ctrl, trigger=True)
+    dma3_config = dma3.config(read=TIMERAWL_addr, write=time_addr, count=1, ctrl=dma3_ctrl, trigger=False)
+    dma3.irq(handler=dec.ring_irq, hard=True)  # count the packet when dma3 completes the time stamp
+
+# In the timing mode dma0 writes every word of State Machine 0 to a ring, then chains to dma1 which copies the word from
+# the ring to State Machine 1 and chains back to dma0. The bits reach State Machine 1 as before, and the ring keeps
+# the measured widths of the last bits for timing_fold() without the CPU in the path.
+def timing_dma_config(dec, dma0, dma1, RXF0_addr, TXF1_addr):
+    bits = 10   # 1024 words, 120 ms of bits or more
+    words = 1 << bits
+    dec.timing_mem = array.array('L',[0]*(2*words))
+    ring_addr = (uctypes.addressof(dec.timing_mem) + 4*words - 1) & ~(4*words - 1)
+    # mask of the ring index, address of the ring, address of the dma0 write address register, words counted, address of timing_count
+    dec.timing_cfg = array.array('L',[words - 1, ring_addr, 0x50000004 + 0x40*dma0.channel, 0, uctypes.addressof(dec.timing_count)])
+
+    dma0_ctrl = dma0.pack_ctrl(
+        enable = True,          # enable DMA channel
+        high_pri = True,        # set DMA bus traffic priority as high
+        size = 2,               # Transfer size: 0=byte, 1=half word, 2=word (default: 2)
+        inc_read = False,       # do not increment to read address
+        inc_write = True,      	# increment the write address
+        ring_size = bits + 2,   # wrap the write address around the ring of 4 byte words
+        ring_sel = True,       	# apply to write address
+        treq_sel = fifo_dreq(dec.sm, True),      # select transfer rate of the RX FIFO of State Machine 0, DREQ_PIO0_RX0 on track 0
+        irq_quiet = True,       # do not generate an interrupt after transfer is complete
+        bswap = False,          # do not reverse the order of the word
+        sniff_en = False,       # do not allow access to debug
+        chain_to = dma1.channel # chain to dma1
+    )
+    dma1_ctrl = dma1.pack_ctrl(
+        enable = True,          # enable DMA channel
+        high_pri = True,        # set DMA bus traffic priority as high
+        size = 2,               # Transfer size: 0=byte, 1=half word, 2=word (default: 2)
+        inc_read = True,        # increment the read address
+        inc_write = False,      # do not increment the write address
+        ring_size = bits + 2,   # wrap the read address around the ring of 4 byte words
+        ring_sel = False,       # apply to read address
+        treq_sel = fifo_dreq(dec.sm + 1, False), # select transfer rate of the TX FIFO of State Machine 1, DREQ_PIO0_TX1 on track 0
+        irq_quiet = True,       # do not generate an interrupt after transfer is complete
+        bswap = False,          # do not reverse the order of the word
+        sniff_en = False,       # do not allow access to debug
+        chain_to = dma0.channel # chain to dma0
+    )
+    dma0.config(read=RXF0_addr, write=ring_addr, count=1, ctrl=dma0_ctrl, trigger=True)
+    dma1.config(read=ring_addr, write=TXF1_addr, count=1, ctrl=dma1_ctrl, trigger=False)
+    dec.ctx[_CX_TIMING] = uctypes.addressof(dec.timing_cfg)
+
+# One channel moves every word of State Machine 1 to the address filter without the CPU, and is started again when
+# its transfer count runs out, like dma0
+def filter_dma_config(dma, RXF1_addr, sm1, filter_sm):	# return the address of the RX FIFO register of the address filter
+    dma_ctrl = dma.pack_ctrl(
+        enable = True,          # enable DMA channel
+        high_pri = True,        # set DMA bus traffic priority as high
+        size = 2,               # Transfer size: 0=byte, 1=half word, 2=word (default: 2)
+        inc_read = False,       # do not increment to read address
+        inc_write = False,      # do not increment the write address
+        treq_sel = fifo_dreq(sm1, True),   # select transfer rate of the RX FIFO of State Machine 1, DREQ_PIO0_RX1 on track 0
+        irq_quiet = False,      # generate an interrupt after transfer is complete
+        chain_to = dma.channel  # do not chain
+    )
+    dma.config(read=RXF1_addr, write=fifo_addr(filter_sm, False), count=0x7FFFFFFF, ctrl=dma_ctrl, trigger=True)
+    dma.irq(handler=dma_restart_irq_handler, hard=True)  # start the channel again when the count runs out
+    return fifo_addr(filter_sm, True)
 ### End DMA Code
 
 ### Data Parser Code
+# data0 and data1 are the two words of a packet from State Machine 1, see build_bitstream(), and ctx is the context of
+# the decoder, see _CX_ID
+def address_list(dccAddress):	# return the addresses of a decoder as a tuple, from one address or a list
+    if isinstance(dccAddress, int):
+        dccAddress = (dccAddress,)
+    addresses = []
+    for addr in dccAddress:
+        if addr < 0 or addr > 10239:	# 11AAAAAA AAAAAAAA with a first byte of at most 0xE7
+            raise ValueError("DCC address %d is not 0 to 10239" % addr)
+        if addr not in addresses:
+            addresses.append(addr)
+    if len(addresses) > 254:	# the state slot + 1 of an address is kept in one byte
+        raise ValueError("a decoder decodes at most 254 addresses, not %d" % len(addresses))
+    return tuple(addresses)
+
+def decoder_config(dec, dccAddress):	# precompute the address matcher of a decoder, and the instruction table
+    addresses = address_list(dccAddress)
+    dec.addresses = addresses	# the position of an address in the list is its state slot
+    dec.state = array.array('L',[0]*(1 + _STATE_WORDS*len(addresses)))	# sequence counter, then throttle position, throttle direction and three words of function buttons of each address, see snapshot()
+    dec.short_slot = bytearray(128)	# state slot + 1 of each short address, 0 if the address is not decoded
+    long_addresses = [addr for addr in addresses if addr > short_address]
+    size = 2
+    while size < 2*len(long_addresses):	# keep the hash table at most half full, so a lookup ends after a few entries
+        size <<= 1
+    dec.long_hash = array.array('L',[0]*size)	# hash table of long addresses
+    for slot, addr in enumerate(addresses):
+        if addr > short_address:
+            i = long_hash_index(addr, size - 1)
+            while dec.long_hash[i] != 0:	# linear probing to the next empty entry
+                i = (i + 1) & (size - 1)
+            dec.long_hash[i] = addr << 8 | (slot + 1)
+        else:
+            dec.short_slot[addr] = slot + 1
+    cache_size = 16
+    while cache_size < 22*len(addresses):	# 11 instruction groups per address, kept at most half full
+        cache_size <<= 1
+    dec.repeat_cache = array.array('L',[0,0xffffffff]*cache_size)	# 2nd word 0xffffffff is an empty entry, State Machine 1 never sends it
+    dec.turnouts = array.array('L',[0]*64)	# see acc_state()
+    dec.aspects = bytearray(2048)	# see acc_aspect()
+    c = dec.ctx
+    c[_CX_STATE] = uctypes.addressof(dec.state)
+    c[_CX_SLOTS] = uctypes.addressof(dec.short_slot)
+    c[_CX_HASH] = uctypes.addressof(dec.long_hash)
+    c[_CX_HASH_MASK] = size - 1
+    c[_CX_CACHE] = uctypes.addressof(dec.repeat_cache)
+    c[_CX_CACHE_MASK] = cache_size - 1
+    c[_CX_TURNOUTS] = uctypes.addressof(dec.turnouts)
+    c[_CX_ASPECTS] = uctypes.addressof(dec.aspects)
+    instr_table_build()
+
 @micropython.viper
-def addr_parser(data0:uint,dcc_address_number_:uint)->bool: # parse bits from data to obtain the address
-    if uint(dcc_address_number_) > uint(short_address):
-        data0addr_MSByte = (uint(data0) >> 24) & ~(0b11000000)
-        data0addr_LSByte = (uint(data0) >> 15) & ~(0xFFFFF00)
-        data0addr = (uint(data0addr_MSByte) << 8) + uint(data0addr_LSByte)	# parse long address
-        return uint(data0addr) == uint(dcc_address_number_)
-    else:
-        data0addr = (uint(data0) >> 24) & ~(0b10000000)		# parse short address
-        return uint(data0addr) == uint(dcc_address_number_)
+def long_hash_index(addr:int,mask:int)->int:	# first hash table entry to look at for a long address
+    return (addr ^ (addr >> 7)) & mask
 
 @micropython.viper
-def func_grp_parser(data0:uint)->uint: # parse bits from data to obtain the function group number
-    if uint(dcc_address_number) > uint(short_address):
-        return (uint(data0) >> 10) & ~(0xFFFFFF0)
-    else:
-        return (uint(data0) >> 19) & ~(0xFFFFFF0)
+def addr_parser(data0:uint,ctx)->int:	# return the state slot << 8 | the position of the instruction byte in data0, or -1 if the address is not decoded
+    c = ptr32(ctx)
+    first = int(data0 >> 24)
+    if first < 0x80:	# 0AAAAAAA short address, 0 is the broadcast address
+        slot = int(ptr8(c[_CX_SLOTS])[first]) - 1
+        if slot < 0:
+            return -1
+        return slot << 8 | 16
+    if first < 0xC0 or first > 0xE7:	# accessory, reserved and idle packets
+        return -1
+    addr = int((data0 >> 16) & 0x3FFF)	# 11AAAAAA AAAAAAAA long address
+    table = ptr32(c[_CX_HASH])
+    mask = int(c[_CX_HASH_MASK])
+    i = int(long_hash_index(addr, mask))
+    while True:
+        entry = int(table[i])
+        if entry == 0:	# an empty entry ends the search, the table always has one
+            return -1
+        if (entry >> 8) == addr:
+            return ((entry & 0xFF) - 1) << 8 | 8
+        i = (i + 1) & mask
+
+def instr_table_build():	# store the action of all 256 instruction bytes, so a packet is decoded with one table lookup
+    for instr in range(256):
+        instr_table[instr] = instr_entry(instr)
+
+def instr_entry(instr):	# action for an instruction byte, see NMRA S-9.2.1 for the instruction classes
+    # Entry bits 31-28: action, bits 27-14: mask of the bits of the 1st function word changed by the instruction, bits 13-0: value
+    # _FUNC_EXP entries hold the function word << 8 | the position of the 8 function buttons in it instead
+    if instr == 0b00111111:	# 001 advanced operations, 128 speed step control with the speed in the next byte
+        return _SPEED128 << 28
+    if instr >> 6 == 0b01:	# 01DCSSSS speed and direction for 28 speed steps
+        speed = ((instr & 0b1111) << 1) | ((instr >> 4) & 1)	# the speed is SSSSC, 0 and 1 are stop, 2 and 3 are emergency stop
+        if speed > 3:
+            speed = speed - 3
+        else:
+            speed = 0
+        return _SPEED28 << 28 | ((instr >> 5) & 1) << 7 | speed
+    if instr >> 5 == 0b100:	# 100DDDDD function group one, F0 F4 F3 F2 F1
+        return _FUNC << 28 | 0b11111 << 14 | (instr & 0b1111) << 1 | (instr >> 4) & 1
+    if instr >> 4 == 0b1011:	# 1011DDDD function group two, F8 F7 F6 F5
+        return _FUNC << 28 | (0b1111 << 5) << 14 | (instr & 0b1111) << 5
+    if instr >> 4 == 0b1010:	# 1010DDDD function group two, F12 F11 F10 F9
+        return _FUNC << 28 | (0b1111 << 9) << 14 | (instr & 0b1111) << 9
+    if instr == 0b11011110 or instr == 0b11011111:	# 110 feature expansion, F20-F13 or F28-F21 in the next byte
+        return _FUNC_EXP << 28 | 13 + 8*(instr & 1)
+    if instr >= 0b11011000 and instr <= 0b11011100:	# F36-F29, F44-F37, F52-F45, F60-F53 or F68-F61 in the next byte
+        first = 29 + 8*(instr & 0b111)
+        word = 1 if first < 61 else 2
+        return _FUNC_EXP << 28 | word << 8 | first - _FUNC_FIRST[word]
+    # 000 decoder and consist control, the other 001 advanced operations,
+    # the other 110 feature expansion and 111 configuration variable access are ignored
+    return _IGNORE << 28
 
 @micropython.viper
-def func_btn_parser(data0:uint)->uint: # parse bits from data to obtain the state of the function buttons
-    if uint(dcc_address_number) > uint(short_address):
-        return (uint(data0) >> 6) & ~(0xFFFFFF0)
-    else:
-        return (uint(data0) >> 15) & ~(0xFFFFFF0)
+def packet_check(data0:uint,data1:uint)->bool: # check the packet length and the error detection byte
+    if (uint(data1) & 0xFFFF) > 3:    # a packet must have 3 to 6 bytes
+        return False
+    x = uint(data0) ^ ((uint(data1) >> 16) << 16)    # missing bytes are zero, so the XOR of all six bytes equals the XOR of the packet bytes
+    x = x ^ (x >> 16)
+    x = x ^ (x >> 8)
+    return (x & 0xFF) == 0  # the XOR of all bytes including the error detection byte is zero for a valid packet
 
 @micropython.viper
-def _28_step_throttle(data0:uint):
-    global throttle_pos
-    if uint(dcc_address_number) > uint(short_address):
-        throttle_pos = (uint(data0) >> 6) & ~(0xFFFFFF0)
-    else:
-        throttle_pos = (uint(data0) >> 10) & ~(0xFFFFFF0)
-        
+def accessory_build(data0:uint,missing:int,ctx):    # Update the turnout state or signal aspect from an accessory packet
+    # Basic accessory 10AAAAAA 1AAACDDD, extended accessory 10AAAAAA 0AAA0AA1 XXXXXXXX, see NMRA S-9.2.1
+    # The 3 address bits in the 2nd byte are the upper bits of the board address and are sent inverted
+    c = ptr32(ctx)
+    byte2 = int(data0 >> 16) & 0xFF
+    board = ((((byte2 >> 4) & 0b111) ^ 0b111) << 6) | (int(data0 >> 24) & 0b111111)
+    addr = ((board << 2) | ((byte2 >> 1) & 0b11)) - 3   # accessory address 1 is board 1 output pair 0
+    last = addr
+    if board == 511:    # broadcast, the same output pair of every board 1 to 510 takes the packet, addresses 2041 to 2044 are never set
+        last = addr - 4
+        addr = addr - 2040
+    if addr < 1:
+        return
+    if missing == 3 and (byte2 & 0x80):    # basic accessory packet has 3 bytes
+        if not (byte2 & 0b1000):    # C is 0, the output is deactivated, the turnout position is taken from the activate packet
+            return
+        state = ptr32(c[_CX_TURNOUTS])
+        while addr <= last:
+            if byte2 & 1:   # output 1 of the pair, closed
+                state[addr >> 5] = state[addr >> 5] | (1 << (addr & 31))
+            else:           # output 0 of the pair, thrown
+                state[addr >> 5] = state[addr >> 5] & ~(1 << (addr & 31))
+            addr += 4
+    elif missing == 2 and (byte2 & 0x89) == 0x01:   # extended accessory packet has 4 bytes
+        if board == 511:    # the broadcast sets the aspect of every address
+            addr = 1
+        aspects = ptr8(c[_CX_ASPECTS])
+        while addr <= last:
+            aspects[addr] = int(data0 >> 8) & 0xFF
+            addr += 1
+
+# Command stations send the same speed and function packets again every few milliseconds. The last words of each
+# address and instruction group are kept, so a packet that repeats them is skipped before func_btn_array_build().
+# Only packets that func_btn_array_build() has applied are kept, and every packet that changes a value replaces
+# the packet of its group, so a skipped repeat could not have changed anything.
 @micropython.viper
-def _126_step_throttle(data0:uint,data1:uint):
-    global throttle_pos
-    if uint(dcc_address_number) > uint(short_address):
-        x = (uint(data0) >> 0) & ~(uint(0b11111111111111111111111111110000))
-        throttle_pos = (uint(x) << 3) + uint(data1)
+def repeat_index(data0:uint,mask:int)->int:	# repeat cache entry of the address and instruction group of a packet, or -1 if it is not kept
+    first = int(data0 >> 24)
+    if first < 0x80:	# short address
+        addr = first
+        instr = int(data0 >> 16) & 0xFF
+    elif first >= 0xC0 and first <= 0xE7:	# long address
+        addr = int(data0 >> 16) & 0x3FFF
+        instr = int(data0 >> 8) & 0xFF
     else:
-        throttle_pos = (uint(data0) >> 6) & ~(uint(0b11111111111111111111111110000000))
+        return -1
+    group = instr >> 5
+    if group == 0b001 or group == 0b010 or group == 0b011:	# 128 step and 28 step speed share a group, both set the speed and direction
+        group = 0
+    elif group == 0b100:	# function group one
+        group = 1
+    elif group == 0b101:	# function group two, F5-F8 and F9-F12
+        group = 2 + ((instr >> 4) & 1)
+    elif instr >> 1 == 0b1101111:	# F13-F20 and F21-F28
+        group = 4 + (instr & 1)
+    elif instr >= 0b11011000 and instr <= 0b11011100:	# F29-F36 to F61-F68
+        group = 6 + (instr & 0b111)
+    else:
+        return -1
+    key = addr << 4 | group
+    return ((key ^ (key >> 7)) & mask) << 1
 
 @micropython.viper
-def func_btn_array_build(data0:uint,data1:uint,func_btn_array_:int):    # Update and build the function button array from data
-    global semaphore, throttle_dir, throttle_pos, func_btn_array
-    semaphore = 1   # Prevent other functions from accessing func_btn_array while manipulating this variables
-    if int(addr_parser(data0,dcc_address_number)):
-        func_grp_parser_ = int(func_grp_parser(data0))
-        if func_grp_parser_ == 0b1000: # F1-F4
-            func_btn_array_ = int(func_btn_array_) & 0b1111111100001
-            func_btn_array_ = int(func_btn_array_) | int(func_btn_parser(data0)) << 1
-        elif func_grp_parser_ == 0b1001: # F1-F4
-            func_btn_array_ = int(func_btn_array_) & 0b1111111100001
-            func_btn_array_ = int(func_btn_array_) | int(func_btn_parser(data0)) << 1
-        elif func_grp_parser_ == 0b1011: # F5-F8
-            func_btn_array_ = int(func_btn_array_) & 0b1111000011111
-            func_btn_array_ = int(func_btn_array_) | int(func_btn_parser(data0)) << 5
-        elif func_grp_parser_ == 0b1010: # F9-F12
-            func_btn_array_ = int(func_btn_array_) & 0b0000111111111
-            func_btn_array_ = int(func_btn_array_) | int(func_btn_parser(data0)) << 9
-        elif func_grp_parser_ == 0b0011: # 126 step speed
-            throttle_dir = ((int(data0) >> 4 & 1) != 0)
-            _126_step_throttle(data0,data1)
-        elif func_grp_parser_ == 0b0100: # 28 step reverse speed
-            throttle_dir = int(0)
-            _28_step_throttle(data0)
-        elif func_grp_parser_ == 0b0101: # 28 step reverse speed
-            throttle_dir = int(0)
-            _28_step_throttle(data0)
-        elif func_grp_parser_ == 0b0110: # 28 step forward speed
-            throttle_dir = int(1)
-            _28_step_throttle(data0)
-        elif func_grp_parser_ == 0b0111: # 28 step forward speed
-            throttle_dir = int(1)
-            _28_step_throttle(data0)
-        func_btn_array = int(func_btn_array_)
-    semaphore = 0 # Allow access of func_btn_array to other functions
-
-def f_btn(func_btn_number): # return the boolean value of the x'th bit from the function button array
-    if semaphore == 0:  # do not access the func_btn_array variable, if dma23_irq_handler() is manipulating the variable
-        return ((func_btn_array >> func_btn_number & 1) != 0) 
-
-def thr_pos():
-    if semaphore == 0:
-        return throttle_pos
-    
-def thr_dir():
-    if semaphore == 0:
-        return throttle_dir
+def packet_repeat(data0:uint,data1:uint,ctx)->bool:	# True if the packet is the same as the last one applied for its address and group
+    c = ptr32(ctx)
+    i = int(repeat_index(data0, c[_CX_CACHE_MASK]))
+    if i >= 0:
+        cache = ptr32(c[_CX_CACHE])
+        if uint(cache[i]) == data0 and uint(cache[i + 1]) == data1:
+            c[_CX_REPEATS] = c[_CX_REPEATS] + 1
+            return True
+    c[_CX_DECODED] = c[_CX_DECODED] + 1
+    return False
+
+@micropython.viper
+def func_btn_array_build(data0:uint,data1:uint,ctx)->int:    # Update and build the function button array from data, return _BAD, _OTHER or _MATCHED
+    c = ptr32(ctx)
+    if not int(packet_check(data0,data1)):  # drop packets with a wrong length or error detection byte
+        return _BAD
+    if (uint(data0) >> 30) == 0b10:  # 10AAAAAA is an accessory decoder packet
+        accessory_build(data0, int(data1 & 0xFFFF), ctx)
+        return _MATCHED
+    match = int(addr_parser(data0, ctx))
+    if match < 0:   # packet is for another address
+        return _OTHER
+    shift = match & 0xFF    # position of the instruction byte in data0
+    entry = uint(ptr32(instr_table)[(uint(data0) >> shift) & 0xFF])
+    action = entry >> 28
+    if action == _IGNORE:
+        return _MATCHED
+    state = ptr32(c[_CX_STATE])
+    base = 1 + (match >> 8) * _STATE_WORDS   # first state word of the address
+    word = 0    # the function word the packet changes, only extended function packets change another word than the 1st
+    if action == _FUNC_EXP:
+        word = int((entry >> 8) & 0b11)
+    funcs = base + _FUNCS + word
+    old_funcs = state[funcs]
+    old_speed = state[base + _SPEED]
+    old_dir = state[base + _DIR]
+    state[_SEQ] = state[_SEQ] + 1 # odd sequence count, readers retry while the state is being written
+    if action == _FUNC:
+        state[funcs] = (old_funcs & ~int((entry >> 14) & 0x3FFF)) | int(entry & 0x3FFF)
+    elif action == _FUNC_EXP:
+        pos = int(entry & 0b11111)
+        buttons = int((uint(data0) >> (shift - 8)) & 0xFF)   # byte after the instruction, bit 0 is the lowest function button
+        state[funcs] = (old_funcs & ~(0xFF << pos)) | (buttons << pos)
+    elif action == _SPEED28:
+        state[base + _DIR] = int((entry >> 7) & 1)
+        state[base + _SPEED] = int(entry & 0b1111111)
+    elif action == _SPEED128:
+        speed = int((uint(data0) >> (shift - 8)) & 0xFF)  # byte after the instruction is DSSSSSSS
+        state[base + _DIR] = (speed >> 7) & 1
+        speed = (speed & 0b1111111) - 1   # 0 is stop and 1 is emergency stop, 2 to 127 are speed steps 1 to 126
+        if speed < 0:
+            speed = 0
+        state[base + _SPEED] = speed
+    state[_SEQ] = state[_SEQ] + 1 # even sequence count, the state is consistent again
+    i = int(repeat_index(data0, c[_CX_CACHE_MASK]))
+    if i >= 0:  # keep the packet, so its repeats are skipped
+        cache = ptr32(c[_CX_CACHE])
+        cache[i] = data0
+        cache[i + 1] = data1
+
+    # Call the callbacks only for values that changed, most packets repeat the last state and end here
+    changed = (old_funcs ^ state[funcs]) & c[_CX_CB + word]   # function buttons that changed and have a callback
+    if changed:
+        func_changed(ctx, match >> 8, changed, state[funcs], word)
+    thr_changed_ = 0
+    if (c[_CX_CB + _CB_THR] & 1) and old_speed != state[base + _SPEED]:
+        thr_changed_ = 1
+    if (c[_CX_CB + _CB_THR] & 2) and old_dir != state[base + _DIR]:
+        thr_changed_ |= 2
+    if thr_changed_:
+        thr_changed(ctx, match >> 8, thr_changed_, state[base + _SPEED], state[base + _DIR])
+    if c[_CX_CB + _CB_EVENT] and (old_funcs != state[funcs] or old_speed != state[base + _SPEED] or old_dir != state[base + _DIR]):
+        event_flag.set()    # a ThreadSafeFlag can be set from an interrupt, the tasks run later in the asyncio loop
+    return _MATCHED
+
+### Stats Code
+# The counters are off by default, then each packet costs one extra test. The parse time is read from SysTick,
+# which counts CPU clock cycles, so the histogram shows the time spent in the decoder without printing from an interrupt.
+@micropython.viper
+def packet_decode(data0:uint,data1:uint,ctx):   # skip a repeat or decode a packet from State Machine 1, and count it while stats are on
+    c = ptr32(ctx)
+    if c[_CX_TIMING]:
+        timing_fold(c[_CX_TIMING])
+    if not c[_CX_ST_ON]:
+        if not int(packet_repeat(data0,data1,ctx)):
+            func_btn_array_build(data0,data1,ctx)
+        return
+    systick = ptr32(_SYST_CVR)
+    t0 = int(systick[0])
+    result = _MATCHED   # a repeat is always of a packet that was matched
+    if not int(packet_repeat(data0,data1,ctx)):
+        result = int(func_btn_array_build(data0,data1,ctx))
+    ticks = (t0 - int(systick[0])) & 0xFFFFFF
+    c[_CX_FRAMED] = c[_CX_FRAMED] + 1
+    if result == _MATCHED:
+        c[_CX_MATCHED] = c[_CX_MATCHED] + 1
+    elif result == _BAD:
+        c[_CX_REJECTED] = c[_CX_REJECTED] + 1
+        if int(data1 & 0xFFFF) > 3:
+            c[_CX_BAD_LENGTH] = c[_CX_BAD_LENGTH] + 1
+    bucket = 0
+    limit = 512
+    while ticks >= limit and bucket < 15:
+        bucket += 1
+        limit <<= 1
+    c[_CX_HIST + bucket] = c[_CX_HIST + bucket] + 1
+
+@micropython.viper
+def systick_start():    # run SysTick from the CPU clock without its interrupt, unless it already runs
+    syst = ptr32(_SYST_CSR)
+    if not (syst[0] & 1):
+        syst[1] = 0xFFFFFF  # reload value
+        syst[2] = 0         # clear the current value
+        syst[0] = 0b101     # processor clock, no interrupt, enabled
+
+@micropython.viper
+def timing_fold(cfg_addr:int):  # count the half bits measured since the last call, every decoded packet calls this in the timing mode
+    cfg = ptr32(cfg_addr)
+    tc = ptr32(cfg[_TM_COUNT])
+    buf = ptr32(cfg[_TM_ADDR])
+    mask = cfg[_TM_MASK]
+    head = int((uint(ptr32(cfg[_TM_WRITE])[0]) - uint(cfg[_TM_ADDR])) >> 2) & mask    # the next word dma0 writes
+    i = cfg[_TM_READ]
+    while i != head:
+        word = buf[i]
+        left = (word >> 8) & 0xFF   # microseconds left in the window
+        window = word & 0xFF        # length of the window after it
+        if window == _WIN_ONE:
+            tc[_TC_SHORT] = tc[_TC_SHORT] + 1
+        elif window == _WIN_BETWEEN:
+            width = _ONE_START + _WIN_ONE - left
+            tc[_TC_ONES] = tc[_TC_ONES] + 1
+            tc[_TC_SUM] = tc[_TC_SUM] + width
+            tc[_TC_SQUARES] = tc[_TC_SQUARES] + (width - 58) * (width - 58)
+            if width < tc[_TC_MIN]:
+                tc[_TC_MIN] = width
+            if width > tc[_TC_MAX]:
+                tc[_TC_MAX] = width
+        elif left:  # a half bit that ends in the last microsecond of the window before the 0 window has 0 left, as a 0 does
+            tc[_TC_BETWEEN] = tc[_TC_BETWEEN] + 1
+        else:
+            tc[_TC_ZEROS] = tc[_TC_ZEROS] + 1
+        i = (i + 1) & mask
+    cfg[_TM_READ] = i
+### End Stats Code
+
+def callback_config(dec,on_func,on_speed,on_dir): # store the callbacks of a decoder and the mask of the values that have callbacks
+    # on_func is a dictionary of function button number, or (first, last) range of function buttons, to callback(addr, n, state)
+    # on_speed is called as callback(addr, speed) and on_dir as callback(addr, direction)
+    # Callbacks are called in the same context as the decoder, so keep them short
+    c = dec.ctx
+    dec.func_callbacks = [[] for n in range(69)]	# callbacks of each function button
+    for key, callback in (on_func or {}).items():
+        first, last = key if isinstance(key, tuple) else (key, key)
+        for n in range(first, last + 1):
+            dec.func_callbacks[n].append(callback)
+            word, bit = func_word(n)
+            c[_CX_CB + word] |= 1 << bit
+    dec.speed_callbacks = [on_speed] if on_speed else []
+    dec.dir_callbacks = [on_dir] if on_dir else []
+    c[_CX_CB + _CB_THR] = (1 if on_speed else 0) | (2 if on_dir else 0)
+
+def func_changed(ctx, slot, changed, funcs, word): # call the callbacks of each changed function button of a function word
+    dec = decoders[ctx[_CX_ID]]
+    addr = dec.addresses[slot]
+    n = _FUNC_FIRST[word]
+    changed &= 0xFFFFFFFF   # viper passes F60 in bit 31 as a negative int
+    while changed:
+        if changed & 1:
+            for callback in dec.func_callbacks[n]:
+                callback(addr, n, (funcs & 1) != 0)
+        changed >>= 1
+        funcs >>= 1
+        n += 1
+
+def thr_changed(ctx, slot, changed, speed, direction): # call the speed callbacks if bit 0 of changed is set, and the direction callbacks if bit 1 is set
+    dec = decoders[ctx[_CX_ID]]
+    addr = dec.addresses[slot]
+    if changed & 1:
+        for callback in dec.speed_callbacks:
+            callback(addr, speed)
+    if changed & 2:
+        for callback in dec.dir_callbacks:
+            callback(addr, direction)
+
+def func_word(n):   # return (function word, bit) of function button n, see _FUNCS
+    if n < 29:
+        return 0, n
+    if n < 61:
+        return 1, n - 29
+    return 2, n - 61
+
+# The functions of the module are those of the pin_addr of a track input, track 0 when track is not given,
+# addr selects one of the addresses given to pin_addr, the first address is used when addr is not given
+def track_input(track):	# return the pin_addr of a track input
+    if track not in (0, 1, 2, 3) or inputs[track] is None:
+        raise ValueError("track %d is not decoded" % track)
+    return inputs[track]
+
+def snapshot(addr=None, track=0): # return (throttle position, throttle direction, function button array) from the same moment
+    return track_input(track).snapshot(addr)
+
+def f_btn(func_btn_number, addr=None, track=0): # return the boolean value of the x'th bit from the function button array
+    return track_input(track).f_btn(func_btn_number, addr)
+
+def thr_pos(addr=None, track=0):
+    return track_input(track).thr_pos(addr)
+
+def thr_dir(addr=None, track=0):
+    return track_input(track).thr_dir(addr)
+
+def acc_state(acc_addr, track=0):    # return True if accessory address 1 to 2040 is closed (straight), False if it is thrown (diverging)
+    return track_input(track).acc_state(acc_addr)
+
+def acc_aspect(acc_addr, track=0):   # return the last aspect sent to extended accessory address 1 to 2040
+    return track_input(track).acc_aspect(acc_addr)
+
+def repeat_stats(track=0):	# return (repeats skipped, packets decoded), the packets skipped saved a decode each
+    return track_input(track).repeat_stats()
+
+def stats_enable(on=True, track=0):  # start or stop the counters, they keep their values while stopped
+    track_input(track).stats_enable(on)
+
+def stats(reset=False, track=0):	# return a dictionary of the counters, reset=True starts them again from zero
+    return track_input(track).stats(reset)
+
+def bit_timing(reset=False, track=0):    # return a dictionary of the high half bits measured in the timing mode
+    return track_input(track).bit_timing(reset)
+
+def drain(track=0):  # decode every packet waiting in the ring, can also be called from the main loop
+    return track_input(track).drain()
+
+def ring_read(track=0):    # return (packets, lost) of the hard interrupt mode, see pin_addr.ring_read()
+    return track_input(track).ring_read()
 ### End Data Parser
 
+### asyncio Code
+async def changed():    # wait until a packet changes a function button, the speed or the direction of any decoded address
+    if event_flag is None:
+        event_start()
+    await state_event.wait()
+
+class events:   # async iterator of snapshot(addr), for example: async for speed, direction, funcs in DCC.events(): ...
+    def __init__(self, addr=None, track=0):   # the first snapshot is returned at once, then one for each change of the address
+        self.addr = addr
+        self.track = track
+        self.last = None
+    def __aiter__(self):
+        return self
+    async def __anext__(self):
+        while True:
+            now = snapshot(self.addr, self.track)
+            if now != self.last:    # a change of another address also wakes this task, so compare the snapshots
+                self.last = now
+                return now
+            await changed()
+
+def event_start():  # create the flag set by the decoders, and the task that passes it on to every waiting task
+    global event_flag, state_event
+    import asyncio
+    event_flag = asyncio.ThreadSafeFlag()
+    state_event = asyncio.Event()
+    asyncio.create_task(event_relay())
+    for dec in decoders:
+        dec.ctx[_CX_CB + _CB_EVENT] = 1
+
+async def event_relay():    # a ThreadSafeFlag wakes only one task, so the flag is passed on to an Event that wakes them all
+    while True:
+        await event_flag.wait()
+        state_event.set()
+        state_event.clear()
+### End asyncio Code
+
 ### Interrupt Handler
-def dma23_irq_handler(dma2):
-    if semaphore == 0:  # do not access the func_btn_array variable, if DCC() is manipulating the variable
-        func_btn_array_build(data[0],data[1],func_btn_array)
+def dma_restart_irq_handler(dma):
+    dma.active(1)  # the transfer count is loaded again, a few bits may be lost once every few days
+
+# In the soft interrupt mode dma2 and dma3 take turns writing the packet words, and MicroPython schedules packet_irq()
+# for each of them. A packet that arrives before the interrupt of the last one ran replaces it, and an interrupt is
+# dropped when the schedule queue is full, so the packet words are marked as taken and the channels have to alternate
+@micropython.viper
+def packet_take(data,ctx,dma:int):  # decode the packet words written by dma2 (1) or dma3 (2), and count the packets lost before
+    d = ptr32(data)
+    c = ptr32(ctx)
+    if c[_CX_LAST_DMA] == dma:  # the interrupt of the other channel never ran, its packet is lost
+        c[_CX_IRQ_LOST] = c[_CX_IRQ_LOST] + 1
+    c[_CX_LAST_DMA] = dma
+    data0 = uint(d[0])
+    data1 = uint(d[1])
+    d[1] = uint(0xFFFFFFFF)  # taken, State Machine 1 never sends it
+    if data1 == uint(0xFFFFFFFF):  # an earlier interrupt took the packet that replaced this one
+        c[_CX_IRQ_LOST] = c[_CX_IRQ_LOST] + 1
+        return
+    packet_decode(data0, data1, ctx)
+
+@micropython.viper
+def ring_count(cfg,idx)->bool:  # count the packets DMA has written to the ring, return True if a drain() has to be scheduled
+    c = ptr32(cfg)
+    i = ptr32(idx)
+    # The next time stamp slot of dma3 is the number of packets written, so a late interrupt that covers two packets still counts both
+    pos = int((uint(ptr32(c[_TIME_WRITE])[0]) - uint(c[_TIME_ADDR])) >> 2)
+    i[_HEAD] = i[_HEAD] + ((pos - i[_HEAD]) & c[_RING_MASK])
+    if i[_PENDING] == 0:
+        i[_PENDING] = 1
+        return True
+    return False
+
+@micropython.viper
+def ring_drain(cfg,idx,mem,ctx)->int:  # decode the packets from the ring in order, return the number of packets decoded
+    c = ptr32(cfg)
+    i = ptr32(idx)
+    x = ptr32(ctx)
+    buf = ptr32(mem)
+    mask = c[_RING_MASK]
+    n = 0
+    # A callback can run a scheduled drain() inside this one, so the head is read again for every packet and each slot is
+    # claimed by moving the tail before its packet is decoded, a nested drain then decodes only the packets after it
+    while i[_TAIL] != i[_HEAD]:
+        head = i[_HEAD]
+        # The slot after the newest packet may be half written by the next packet, so the ring holds mask packets
+        if head - i[_TAIL] > mask:    # packets were overwritten before they were decoded, count them and skip to the oldest packet left
+            x[_CX_RING_OVERRUNS] = x[_CX_RING_OVERRUNS] + (head - i[_TAIL] - mask)
+            i[_TAIL] = head - mask
+        tail = i[_TAIL]
+        i[_TAIL] = tail + 1
+        j = c[_RING_OFF] + ((tail & mask) << 1)
+        packet_decode(uint(buf[j]), uint(buf[j + 1]), ctx)
+        n += 1
+    return n
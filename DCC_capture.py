@@ -0,0 +1,185 @@
+# DCC capture files
+#
+# Record what the decoder receives to a file (or any stream), and replay it later through the same parser path,
+# so a decode problem or a change in speed can be reproduced with the same input every time.
+# Note: code was developed using MicroPython version v1.23
+
+import struct
+import time
+import DCC
+
+try:
+    from time import ticks_us, ticks_diff, sleep_us
+except ImportError:	# CPython has no ticks functions, a capture replayed on a computer uses the same 30 bit microsecond ticks
+    def ticks_us():
+        return (time.perf_counter_ns() // 1000) & 0x3FFFFFFF
+
+    def ticks_diff(t1, t2):
+        return ((t1 - t2 + 0x20000000) & 0x3FFFFFFF) - 0x20000000
+
+    def sleep_us(us):
+        time.sleep(us / 1000000)
+
+### Capture Format
+# A capture starts with the 8 byte header b"DCCcap" + version + flags, followed by records.
+# Every record starts with a type byte and the time in microseconds (time.ticks_us() units), all values are little endian.
+#   PACKET: type, time, data0, data1      the two packet words of State Machine 1, see build_bitstream() in DCC.py
+#   BITS:   type, time, word              32 received bits, the first bit received is the LSB (as in packed mode)
+#   PULSES: type, time, count, widths     count half bit widths in microseconds as 16 bit values, starting with a high half bit,
+#                                         count is at most 254, so longer lists are written as several records
+#   LOST:   type, time, count             number of packets lost by the recorder
+MAGIC = b"DCCcap"
+VERSION = 1
+PACKET = 1
+BITS = 2
+PULSES = 3
+LOST = 4
+_HEADER = "<6sBB"
+_PACKET = "<BLLL"
+_BITS = "<BLL"
+_PULSES = "<BLB"
+_LOST = "<BLL"
+_PULSES_MAX = 254	# an even count, so every PULSES record starts with a high half bit
+### End Capture Format
+
+### Writer Code
+class writer:   # write capture records to a stream, such as an open file or sys.stdout.buffer
+    def __init__(self, stream, packets=64, track=0):	# track is the track input of DCC.pin_addr() that poll() reads
+        self.stream = stream
+        self.track = track
+        self.buf = bytearray(struct.calcsize(_PACKET) * packets)	# records are packed here and written with one write() per buffer
+        stream.write(struct.pack(_HEADER, MAGIC, VERSION, 0))
+
+    def packet(self, t, data0, data1):
+        self.stream.write(struct.pack(_PACKET, PACKET, t, data0, data1))
+
+    def bits(self, t, word):
+        self.stream.write(struct.pack(_BITS, BITS, t, word))
+
+    def pulses(self, t, widths):	# a list of more than 254 widths is split into several records with the same time
+        for i in range(0, len(widths), _PULSES_MAX):
+            part = widths[i:i + _PULSES_MAX]
+            self.stream.write(struct.pack(_PULSES, PULSES, t, len(part)))
+            self.stream.write(struct.pack("<%dH" % len(part), *part))
+
+    def lost(self, t, count):
+        self.stream.write(struct.pack(_LOST, LOST, t, count))
+
+    def poll(self):	# write the packets received since the last poll, DCC.pin_addr(record=stream) calls this after each drain()
+        # ring_read() returns a new list of tuples, so poll() allocates memory and is only called from drain(), never from an interrupt
+        packets, lost = DCC.ring_read(self.track)
+        if lost:
+            self.lost(ticks_us(), lost)
+        size = struct.calcsize(_PACKET)
+        n = 0
+        for t, data0, data1 in packets:
+            if n + size > len(self.buf):	# the buffer is full, write it and start again
+                self.stream.write(memoryview(self.buf)[:n])
+                n = 0
+            struct.pack_into(_PACKET, self.buf, n, PACKET, t, data0, data1)
+            n += size
+        if n:
+            self.stream.write(memoryview(self.buf)[:n])
+        return len(packets)
+### End Writer Code
+
+### Reader Code
+def records(stream):	# return each record of a capture as (type, time, value), value is (data0, data1), word, widths or count
+    version = struct.unpack(_HEADER, stream.read(struct.calcsize(_HEADER)))
+    if version[0] != MAGIC:
+        raise ValueError("not a DCC capture")
+    if version[1] != VERSION:
+        raise ValueError("DCC capture version %d is not supported" % version[1])
+    while True:
+        kind = stream.read(1)
+        if not kind:
+            return
+        kind = kind[0]
+        if kind == PACKET:
+            t, data0, data1 = struct.unpack("<LLL", stream.read(12))
+            yield kind, t, (data0, data1)
+        elif kind == BITS:
+            t, word = struct.unpack("<LL", stream.read(8))
+            yield kind, t, word
+        elif kind == PULSES:
+            t, count = struct.unpack("<LB", stream.read(5))
+            yield kind, t, struct.unpack("<%dH" % count, stream.read(2 * count))
+        elif kind == LOST:
+            t, count = struct.unpack("<LL", stream.read(8))
+            yield kind, t, count
+        else:
+            raise ValueError("unknown DCC capture record %d" % kind)
+
+class framer:	# software copy of build_bitstream() in DCC.py, turns received bits into the two packet words of State Machine 1
+    def __init__(self):
+        self.step = 0		# 0 preamble, 1 start bit, 2 data bits, 3 bit after a byte
+        self.ones = 0		# ones of the preamble counted
+        self.bytes = []
+        self.byte = 0
+        self.count = 0		# bits of the byte received
+
+    def bit(self, b):	# add one received bit, return (data0, data1) when the bit completes a packet, otherwise None
+        if self.step == 0:
+            self.ones = self.ones + 1 if b else 0
+            if self.ones == 10:
+                self.step = 1
+        elif self.step == 1:
+            if not b:	# the address start bit
+                self.step = 2
+                self.bytes = []
+                self.byte = self.count = 0
+        elif self.step == 2:
+            self.byte = self.byte << 1 | b
+            self.count += 1
+            if self.count == 8:
+                self.bytes.append(self.byte)
+                self.step = 3
+        else:
+            if b or len(self.bytes) == 6:	# packet end bit, or a 7th byte which makes the packet invalid
+                return self.packet(b)
+            self.step = 2
+            self.byte = self.count = 0
+
+    def packet(self, end):
+        self.step = 0
+        self.ones = 0
+        missing = 6 - len(self.bytes) if end else 0xFFFF
+        b = self.bytes + [0] * (6 - len(self.bytes))
+        return (b[0] << 24 | b[1] << 16 | b[2] << 8 | b[3], b[4] << 24 | b[5] << 16 | missing)
+
+def replay(path, realtime=False, decode=None):	# feed a capture to the parser, return the number of packets
+    # realtime=True keeps the time between the records as it was recorded, otherwise the packets are decoded at full speed,
+    # on a computer (CPython), which has no time.sleep_us(), time.sleep() waits instead and the timing is less exact
+    # decode is called as decode(data0, data1), the decoder of track 0 is used when decode is not given,
+    # DCC.decoder(addresses).decode replays into a decoder of its own
+    if decode is None:
+        decode = DCC.track_input(0).decode
+    bits = framer()
+    n = 0
+    start = None
+    with open(path, "rb") as f:
+        for kind, t, value in records(f):
+            if realtime:
+                if start is None:
+                    start = ticks_us()
+                    t0 = t
+                wait = ticks_diff(t, t0) - ticks_diff(ticks_us(), start)
+                if wait > 0:
+                    sleep_us(wait)
+            if kind == PACKET:
+                decode(value[0], value[1])
+                n += 1
+            elif kind == BITS:
+                for i in range(32):
+                    packet = bits.bit(value >> i & 1)
+                    if packet:
+                        decode(packet[0], packet[1])
+                        n += 1
+            elif kind == PULSES:
+                for i in range(0, len(value), 2):	# State Machine 0 reads a 1 when the high half bit ends before 75 microseconds
+                    packet = bits.bit(1 if value[i] < 75 else 0)
+                    if packet:
+                        decode(packet[0], packet[1])
+                        n += 1
+    return n
+### End Reader Code
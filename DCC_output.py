@@ -0,0 +1,393 @@
+# DCC command station output
+#
+# Send DCC packets to the rails through a full H-bridge driver, see "DCC Output Demo.py" for the wiring.
+# The scheduler keeps the speed and function buttons of every locomotive and sends packets back to back, so the
+# track never waits: a changed command first, then the refresh packets of every locomotive in turn, and idle packets
+# when there is nothing else to send. The packets are serialized one after the other into a ring of 32 bit words,
+# without padding between them, and two DMA channels stream the ring to the state machine, so the signal on the
+# rails does not depend on when Python gets to run.
+# Note: code was developed using MicroPython version v1.23
+
+import array
+import micropython
+import rp2
+import uctypes
+from machine import Pin
+
+### State Machine Code
+# One bit per word bit, the most significant bit first. At 400 kHz a cycle is 2.5 microseconds:
+# a one is 23 cycles high and 23 cycles low (57.5 us), a zero is 40 cycles high and 40 cycles low (100 us)
+@rp2.asm_pio(set_init=rp2.PIO.OUT_LOW, out_shiftdir=rp2.PIO.SHIFT_LEFT, autopull=True)
+def dcc():
+    label("bitloop")
+    set(pins, 1)           [20]
+    out(x, 1)
+    jmp(not_x, "do_zero")
+    set(pins, 0)           [21]
+    jmp("bitloop")
+    label("do_zero")
+    nop()                  [16]
+    set(pins, 0)           [30]
+    nop()                  [8]
+### End State Machine Code
+
+### Packet Code
+IDLE = b"\xff\x00"	# the idle packet
+
+def serialize(packet):	# return (bits, count) of a packet of 2 to 5 bytes, the first bit sent is the MSB of bits
+    # A 0 start bit before each byte and before the error detection byte, then the packet end bit.
+    # The preamble is not included, the stream adds it in front of every packet.
+    if not 2 <= len(packet) <= 5:
+        raise ValueError("packet must have 2 to 5 bytes before the error detection byte")
+    bits = 0
+    check = 0
+    for byte in packet:
+        bits = bits << 9 | byte	# the 0 start bit is shifted in before each byte
+        check ^= byte
+    return (bits << 9 | check) << 1 | 1, 9 * len(packet) + 10
+
+def address_bytes(addr):	# the address bytes of a locomotive, short addresses 1 to 127 and long addresses 128 to 10239
+    if 1 <= addr <= 127:
+        return bytes((addr,))
+    if 128 <= addr <= 10239:
+        return bytes((0xC0 | addr >> 8, addr & 0xFF))
+    raise ValueError("address must be 1 to 10239")
+
+# A command station sends the same few packets over and over, so the bits of each packet are kept once they are built.
+# The cache has a fixed number of slots, when it is full the packet used least recently makes room for the new one.
+class packet_cache:
+    def __init__(self, size=64):
+        self.slots = {}		# packet: slot of its bits
+        self.keys = [None] * size	# packet of each slot
+        self.words = array.array('L', [0] * (3 * size))	# count, the first count - 32 bits, the last 32 bits of each slot
+        self.used = array.array('L', [0] * size)	# when each slot was used last
+        self.clock = 0
+        self.hits = 0
+        self.misses = 0
+
+    def slot(self, packet):	# return the slot of the bits of a packet, serialize the packet if it is not cached
+        self.clock += 1
+        i = self.slots.get(packet)
+        if i is not None:
+            self.hits += 1
+            self.used[i] = self.clock
+            return i
+        self.misses += 1
+        if len(self.slots) < len(self.keys):
+            i = len(self.slots)
+        else:
+            i = 0
+            for j in range(1, len(self.used)):	# the least recently used slot
+                if self.used[j] < self.used[i]:
+                    i = j
+            del self.slots[self.keys[i]]
+        bits, count = serialize(packet)
+        self.slots[packet] = i
+        self.keys[i] = packet
+        self.used[i] = self.clock
+        self.words[3 * i] = count
+        self.words[3 * i + 1] = bits >> 32
+        self.words[3 * i + 2] = bits & 0xFFFFFFFF
+        return i
+### End Packet Code
+
+### Stream Code
+# The packets are written to the ring bit by bit as one stream, a packet starts in the word where the one before ends.
+# The words after the stream are ones, up to a word that starts in a preamble, see scheduler.pump()
+# Index of the stream state array of the scheduler
+_ACC = const(0)		# bits not written to the ring yet, right aligned
+_COUNT = const(1)	# number of bits in _ACC, always less than 32
+_WORDS = const(2)	# words written to the ring since it started
+_MASK = const(3)	# number of words in the ring - 1
+_OFF = const(4)		# index of the start of the ring in ring_mem
+_PREAMBLE = const(5)	# preamble ones before every packet
+_SAFE = const(6)	# address of one byte for each ring word, 1 if the word starts in a preamble, with a start bit or with ones
+_LAST_SAFE = const(7)	# the last word written that starts in a preamble
+_STRETCH = const(8)	# ones added to the preamble of the next packet, so that a word starts in it
+
+@micropython.viper
+def stream_packet(ring:ptr32, st:ptr32, cache:ptr32, i:int):	# append the preamble and the bits of cache slot i to the stream
+    n = int(cache[3 * i])
+    acc = uint(st[_ACC])
+    k = int(st[_COUNT])
+    w = int(st[_WORDS])
+    safe = ptr8(st[_SAFE])
+    for part in range(3):
+        if part == 0:	# the packet end bit before counts as the first one of the preamble
+            bits = int(st[_PREAMBLE]) - 1 + int(st[_STRETCH])
+            word = (uint(1) << uint(bits)) - 1
+        elif part == 1:	# the bits before the last 32 bits of a long packet
+            bits = n - 32
+            word = uint(cache[3 * i + 1])
+        else:
+            bits = n
+            if bits > 32:
+                bits = 32
+            word = uint(cache[3 * i + 2])
+        if bits <= 0:
+            continue
+        if k + bits < 32:
+            acc = (acc << uint(bits)) | word
+            k += bits
+            continue
+        rest = k + bits - 32	# bits of word that do not fit in the ring word
+        if k:
+            acc = (acc << uint(32 - k)) | (word >> uint(rest))
+        else:
+            acc = word >> uint(rest)
+        ring[int(st[_OFF]) + (w & int(st[_MASK]))] = acc
+        w += 1
+        if part == 0 or (part == 2 and rest == 0):	# the next word starts in the preamble or with the start bit of a packet
+            safe[w & int(st[_MASK])] = 1
+            st[_LAST_SAFE] = w
+        else:
+            safe[w & int(st[_MASK])] = 0
+        acc = word & ((uint(1) << uint(rest)) - 1)
+        k = rest
+    st[_ACC] = acc
+    st[_COUNT] = k
+    st[_WORDS] = w
+
+@micropython.viper
+def stream_pad(ring:ptr32, st:ptr32, end:int):	# write the bits left in _ACC, then ones up to word end, after the stream
+    w = int(st[_WORDS])
+    k = int(st[_COUNT])
+    mask = int(st[_MASK])
+    off = int(st[_OFF])
+    safe = ptr8(st[_SAFE])
+    if k and w < end:	# the end of the last packet, then ones
+        ring[off + (w & mask)] = (uint(st[_ACC]) << uint(32 - k)) | ((uint(1) << uint(32 - k)) - 1)
+        w += 1
+    while w < end:
+        ring[off + (w & mask)] = uint(0xFFFFFFFF)
+        safe[w & mask] = 1
+        w += 1
+### End Stream Code
+
+### Scheduler Code
+# Instruction groups of a locomotive, each group is one packet that the scheduler refreshes
+SPEED = 0	# 0x3F DSSSSSSS 128 step speed and direction, or 01DCSSSS 28 step speed and direction
+FUNC_GRP1 = 1	# 100DDDDD F0 F4 F3 F2 F1
+FUNC_GRP2A = 2	# 1011DDDD F8 F7 F6 F5
+FUNC_GRP2B = 3	# 1010DDDD F12 F11 F10 F9
+FUNC_EXP = 4	# 0xDE F20 to F13, then 0xDF F28 to F21, 0xD8 F36 to F29 ... 0xDC F68 to F61 in the groups after it
+GROUPS = 11
+_FUNC_INSTR = (None, b"\x80", b"\xb0", b"\xa0", b"\xde\x00", b"\xdf\x00", b"\xd8\x00", b"\xd9\x00", b"\xda\x00", b"\xdb\x00", b"\xdc\x00")
+_CURSOR = GROUPS	# index of the group refreshed last, after the packets of the groups
+_ADDR = GROUPS + 1	# index of the address bytes
+
+class scheduler:	# a command station for locomotives with short addresses 1 to 127 and long addresses 128 to 10239
+    # ring is the number of words written ahead of the rails (rounded up to a power of two), about 4 ms each:
+    # a longer ring lets pump() be called less often, a shorter ring sends a changed command sooner
+    # cache is the number of packets kept by packet_cache, one for each packet that is refreshed is enough
+    # preamble is the number of ones before each packet, at least 14 for a command station
+    def __init__(self, pin, sm=5, ring=16, cache=64, preamble=14):	# State Machine 1 of PIO1 by default, so a decoder can run on the same Pico
+        if not 14 <= preamble <= 32:
+            raise ValueError("preamble must be 14 to 32 bits")
+        self.locos = {}		# address: list of the packet of each group (None while the group has not been set), the refresh cursor and the address bytes
+        self.order = []		# addresses in refresh order
+        self.pos = 0		# next address to refresh
+        self.urgent = []	# (address, group) of changed commands, sent before any refresh
+        self.last = None	# address of the last packet sent, None for the idle packet
+        self.next = None	# (address, cache slot) of the packet that did not fit in the ring yet
+        self.sent = [0, 0, 0]	# changed commands, refresh and idle packets sent
+        self.late = 0		# times pump() was too late and the DMA sent ones and packets of the previous lap again
+        self.cache = packet_cache(cache)
+        self.stream = array.array('L', [0, 0, 0, 0, 0, preamble, 0, 0, 0])	# see Stream Code
+        self.sm = rp2.StateMachine(sm, dcc, freq=400000, set_base=Pin(pin))
+        self.ring_config(sm, ring)
+        self.sm.active(1)
+        self.pump()	# the DMA filled the TX FIFO from the ring when the state machine started
+
+    def speed(self, addr, speed, forward=True, steps=128):	# speed 0 to 126 of 128 steps or 0 to 28 of 28 steps, 0 stops the locomotive
+        if steps == 128:
+            if not 0 <= speed <= 126:
+                raise ValueError("speed must be 0 to 126")
+            instr = (0x3F, (forward & 1) << 7 | (speed + 1 if speed > 0 else 0))	# 1 is the emergency stop
+        elif steps == 28:
+            if not 0 <= speed <= 28:
+                raise ValueError("speed must be 0 to 28")
+            step = speed + 3 if speed > 0 else 0	# the 5 bit speed SSSSC counts 4 to 31 for speed 1 to 28
+            instr = (0b01000000 | (forward & 1) << 5 | (step & 1) << 4 | step >> 1,)
+        else:
+            raise ValueError("steps must be 28 or 128")
+        self.set(addr, SPEED, instr)
+
+    def stop(self, addr, emergency=False):	# an emergency stop stops at once, without the deceleration of the decoder
+        state = self.loco(addr)
+        packet = state[SPEED]
+        n = len(state[_ADDR])
+        if packet is None or packet[n] == 0x3F:	# D0000000 stop, D0000001 emergency stop, in the direction of the last speed
+            instr = (0x3F, (packet[n + 1] if packet else 0x80) & 0x80 | (emergency & 1))
+        else:	# 01D00000 stop, 01D00001 emergency stop
+            instr = (packet[n] & 0b01100000 | (emergency & 1),)
+        self.set(addr, SPEED, instr)
+
+    def function(self, addr, n, on):	# function button n from 0 to 68
+        if n == 0:
+            group, bit = FUNC_GRP1, 4
+        elif n <= 4:
+            group, bit = FUNC_GRP1, n - 1
+        elif n <= 8:
+            group, bit = FUNC_GRP2A, n - 5
+        elif n <= 12:
+            group, bit = FUNC_GRP2B, n - 9
+        elif n <= 68:
+            group, bit = FUNC_EXP + (n - 13) // 8, (n - 13) % 8
+        else:
+            raise ValueError("function button must be 0 to 68")
+        state = self.loco(addr)
+        packet = state[group]
+        instr = bytearray(packet[len(state[_ADDR]):] if packet else _FUNC_INSTR[group])
+        instr[-1] = instr[-1] | (1 << bit) if on else instr[-1] & ~(1 << bit)	# the buttons are in the last byte
+        self.set(addr, group, instr)
+
+    def remove(self, addr):	# stop refreshing a locomotive
+        if addr in self.locos:
+            del self.locos[addr]
+            self.order.remove(addr)
+            self.urgent = [u for u in self.urgent if u[0] != addr]
+
+    def loco(self, addr):
+        if addr not in self.locos:
+            self.locos[addr] = [None] * GROUPS + [0, address_bytes(addr)]
+            self.order.append(addr)
+        return self.locos[addr]
+
+    def set(self, addr, group, instr):
+        state = self.loco(addr)
+        packet = state[_ADDR] + bytes(instr)
+        if state[group] == packet and (addr, group) not in self.urgent:
+            return
+        state[group] = packet
+        if (addr, group) not in self.urgent:	# a command changed again before it was sent is sent once with the new value
+            self.urgent.append((addr, group))
+
+    def next_packet(self):	# return (address, packet) of the next packet to send
+        # A decoder needs 5 ms between the end of one of its packets and the start of the next, so the same address
+        # is never sent twice in a row, a packet to another locomotive or an idle packet goes in between
+        for i in range(len(self.urgent)):
+            addr, group = self.urgent[i]
+            if addr != self.last:
+                del self.urgent[i]
+                self.sent[0] += 1
+                return addr, self.locos[addr][group]
+        for i in range(len(self.order)):	# refresh the next locomotive, each locomotive sends its groups in turn
+            addr = self.order[(self.pos + i) % len(self.order)]
+            state = self.locos[addr]
+            if addr == self.last:
+                continue
+            group = state[_CURSOR]
+            for j in range(GROUPS):
+                group = (group + 1) % GROUPS
+                if state[group]:
+                    break
+            else:
+                continue	# no group has been set yet
+            self.pos = (self.pos + i + 1) % len(self.order)
+            state[_CURSOR] = group
+            self.sent[1] += 1
+            return addr, state[group]
+        self.sent[2] += 1
+        return None, IDLE
+
+    # The stream is followed by ones up to a word that the DMA sent one lap before and that starts in a preamble.
+    # A pump() that comes too late lets the DMA send the ones and then the packets of the last lap again from that word,
+    # which are whole packets, so a decoder never gets a packet that is cut off.
+    def pump(self):	# fill the ring up to the word the DMA reads next, call it before the DMA gets there (40 ms for 16 words)
+        sent = self.position()	# words the DMA sent to the state machine
+        mask = self.words - 1
+        if self.stream[_WORDS] <= sent:	# the DMA passed the last new word, start a preamble in the next word that starts in one
+            self.late += 1
+            w = sent + 1
+            while not self.safe[w & mask] and w < sent + self.words:	# the ones after the last packet are always one
+                w += 1
+            self.stream[_WORDS] = w
+            self.stream[_LAST_SAFE] = w
+            self.stream[_ACC] = 1	# one more preamble bit
+            self.stream[_COUNT] = 1
+        w = self.stream[_WORDS]
+        for start in range(sent, max(w - self.words, sent - mask) - 1, -1):	# the last word sent that starts in a preamble
+            if self.safe[start & mask]:
+                self.fill(start + self.words)
+                break
+
+    def fill(self, end):	# write packets to the ring while the next packet and a preamble of ones after it fit before word end
+        st = self.stream
+        while True:
+            if self.next is None:
+                addr, packet = self.next_packet()
+                self.next = (addr, self.cache.slot(packet))
+            addr, i = self.next
+            # Without a word that starts in a preamble for a quarter of the ring, the preamble is made long enough to reach the next word
+            st[_STRETCH] = 0
+            if st[_COUNT] and st[_WORDS] - st[_LAST_SAFE] >= self.words >> 2:
+                st[_STRETCH] = max(0, 33 - st[_COUNT] - st[_PREAMBLE])
+            if (end - st[_WORDS]) * 32 - st[_COUNT] < 2 * st[_PREAMBLE] - 1 + st[_STRETCH] + self.cache.words[3 * i]:
+                break	# the packet is sent first by the next pump()
+            self.last = addr
+            stream_packet(self.ring_mem, st, self.cache.words, i)
+            self.next = None
+        stream_pad(self.ring_mem, st, end)
+
+    # DMA of the ring: dma_a streams one lap of the ring to the TX FIFO of the state machine, paced by its DREQ, then chains
+    # to dma_b which streams the next lap and chains back to dma_a. The read address wraps around the ring, so both channels
+    # start each lap at the beginning of the ring without the CPU, and pump() only has to write new words behind the DMA.
+    def ring_config(self, sm, words):
+        bits = 3
+        while (1 << bits) < words:	# the DMA ring size is a power of two, from 8 to 4096 words
+            bits += 1
+        if bits > 12:
+            raise ValueError("ring is larger than 4096 words")
+        self.words = 1 << bits
+
+        # The DMA wraps the read address at a multiple of the ring size,
+        # so twice the ring size is allocated and the ring starts at the aligned address inside it.
+        # Ones are a valid preamble, the DMA sends them until the first packets are written
+        self.ring_mem = array.array('L', [0xFFFFFFFF] * (2 * self.words))
+        self.ring_addr = (uctypes.addressof(self.ring_mem) + 4 * self.words - 1) & ~(4 * self.words - 1)
+        self.stream[_MASK] = self.words - 1
+        self.safe = bytearray(b"\x01" * self.words)	# the ring starts with ones, see pump()
+        self.stream[_SAFE] = uctypes.addressof(self.safe)
+        self.stream[_OFF] = (self.ring_addr - uctypes.addressof(self.ring_mem)) >> 2
+        self.laps = 0		# laps of the ring completed by dma_a and dma_b
+        self.dma_a = rp2.DMA()	# initialize DMA channel
+        self.dma_b = rp2.DMA()	# initialize DMA channel
+
+        TXF_addr = (0x50200010 if sm < 4 else 0x50300010) + 4 * (sm & 3)	# address of the TX FIFO register of the state machine
+        treq = sm if sm < 4 else sm + 4		# DREQ_PIO0_TX0 to DREQ_PIO0_TX3 and DREQ_PIO1_TX0 to DREQ_PIO1_TX3
+        for dma, other in ((self.dma_a, self.dma_b), (self.dma_b, self.dma_a)):
+            ctrl = dma.pack_ctrl(
+                enable = True,          # enable DMA channel
+                high_pri = True,        # set DMA bus traffic priority as high
+                size = 2,               # Transfer size: 0=byte, 1=half word, 2=word (default: 2)
+                inc_read = True,        # increment the read address
+                inc_write = False,      # do not increment the write address
+                ring_size = bits + 2,   # wrap the read address around the ring of 4 byte words
+                ring_sel = False,       # apply to read address
+                treq_sel = treq,        # select transfer rate of the TX FIFO of the state machine
+                irq_quiet = False,      # generate an interrupt after each lap, see lap()
+                bswap = False,          # do not reverse the order of the word
+                sniff_en = False,       # do not allow access to debug
+                chain_to = other.channel # chain to the other channel
+            )
+            dma.config(read=self.ring_addr, write=TXF_addr, count=self.words, ctrl=ctrl, trigger=False)
+            dma.irq(handler=self.lap, hard=True)
+        self.fill(self.words)	# the first lap is idle packets
+        self.dma_a.active(1)	# set DMA channel active, it waits for the state machine to start
+
+    def lap(self, dma):	# hard interrupt handler, called when dma_a or dma_b completes a lap
+        self.laps += 1
+
+    def position(self):	# return the number of words the DMA has sent to the state machine
+        while True:
+            laps = self.laps
+            odd = self.dma_b.active()	# dma_b sends the odd laps
+            # the channel that waits for its next lap has wrapped back to the start of the ring, so only the busy one counts
+            offset = (self.dma_a.read + self.dma_b.read - 2 * self.ring_addr) & (4 * self.words - 1)
+            if laps == self.laps:	# lap() did not run while reading
+                break
+        if (laps ^ odd) & 1:	# the lap is complete but lap() has not run yet
+            laps += 1
+        return laps * self.words + (offset >> 2)
+### End Scheduler Code
@@ -0,0 +1,199 @@
+# RP2040 DCC train decoder
+#
+# PIO programs of DCC.py. rp2.asm_pio replaces the globals of the module that defines a program while it assembles it,
+# so the programs are assembled here and not in DCC.py, whose interrupt handlers may run during the assembly of the
+# programs of another track. Upload this file together with DCC.py.
+# Note: code was developed using MicroPython version v1.23
+
+import rp2
+
+_programs = {}	# PIO programs by kind and settings, so the two tracks of a PIO load each program once
+
+### State Machine 0 Code
+def sm0_program(packed, timing, glitch):	# return determine_bit(), or the program of the timing mode or the glitch filter
+    # Unpacked: every bit is pushed on its own as the LSB of a word (shift left, push threshold of 1)
+    # Packed: 32 bits are shifted right into the ISR before the push, so the first bit received is the LSB of the word
+    # In both cases State Machine 1 takes the LSB first, so it sees the bits in the order they were received
+    in_shiftdir = 1 if packed else 0
+    push_thresh = 32 if packed else 1
+    key = "timing" if timing else ("glitch", glitch, packed) if glitch else ("bit", packed)
+    if key in _programs:    # the inputs of one PIO share their programs, a program is only loaded if it is not there yet
+        return _programs[key]
+
+    @rp2.asm_pio(set_init=rp2.PIO.IN_HIGH, in_shiftdir=in_shiftdir, out_shiftdir=0, autopull=True, pull_thresh=1, autopush=True, push_thresh=push_thresh) # set the bit order direction of the ISR and the autopush threshold for unpacked or packed bits
+    def determine_bit():
+        wrap_target()
+
+        wait(1, pin, 0)	[31]    # wait for GPIO pin to go high
+        nop()       [31]    # stall 32 microseconds
+        nop()       [10]    # stall 10 microseconds
+        jmp(pin, "set_0")   # if GPIO is remains high after 74 microseconds, then jump to set_0
+        set(x, 1)           # if GPIO is low after 74 microseconds, then set scratch x to 1
+        jmp("write_bit")    # since scratch x has been set to 1, skip set_0 and jump to write_bit
+
+        label("set_0")
+        set(x, 0)           # if GPIO is remains high after 74 microseconds, then set scratch x to 0
+
+        label("write_bit")
+        in_(x, 1)	        # move one bit from scratch x into the ISR
+        wait(0, pin, 0)	    # wait for GPIO to go low before looping back to prevent recounting the same 0 bit
+
+        wrap()
+
+    # The timing mode measures the high half of each bit in steps of 1 microsecond instead of sampling it once,
+    # and pushes one word per bit: the microseconds left in the window it ended in << 8 | the length of the next window.
+    # A half bit that ends outside the 1 and 0 windows of NMRA S-9.2 is read as a 0, so the error detection byte
+    # rejects its packet, and bit_timing() counts it.
+    @rp2.asm_pio(in_shiftdir=0, out_shiftdir=1, autopush=True, push_thresh=16)
+    def measure_bit():
+        wrap_target()
+
+        wait(1, pin, 0)     # wait for GPIO pin to go high
+        mov(osr, y)         # scratch y holds the lengths of the timing windows
+        label("window")
+        out(x, 8)           # move the length of the next window to scratch x
+        jmp(not_x, "zero")  # the last window has no length, the half bit is a 0
+        label("count")
+        jmp(pin, "high")    # one loop takes 2 cycles or 1 microsecond
+        jmp("edge")         # GPIO went low inside the window
+        label("high")
+        jmp(x_dec, "count") # count down the window while GPIO remains high
+        jmp("window")       # the window is over, go on to the next one
+        label("zero")
+        wait(0, pin, 0)     # wait for GPIO to go low
+        label("edge")
+        in_(x, 8)           # the microseconds left in the window
+        in_(osr, 8)         # the length of the next window, autopush sends the word to the RX FIFO
+
+        wrap()
+
+    if timing:
+        prog = measure_bit
+    elif glitch:
+        prog = glitch_filter(glitch, in_shiftdir, push_thresh)
+    else:
+        prog = determine_bit
+    _programs[key] = prog
+    return prog
+### End State Machine 0 Code
+
+### State Machine 1 Code
+def sm1_program(packed):
+    key = ("packet", packed)
+    if key in _programs:
+        return _programs[key]
+    # Autopull refills the OSR from the TX FIFO whenever it is empty, so each out(x, 1) takes the next bit
+    # whether the words carry one bit (unpacked) or 32 bits (packed)
+    pull_thresh = 32 if packed else 1
+
+    # Each packet is sent to the RX FIFO as two words, no matter if the packet has 3, 4, 5 or 6 bytes:
+    #   1st word = packet bytes 1 to 4, the first byte is the most significant byte
+    #   2nd word = packet bytes 5 and 6 in the upper half word, and the number of missing bytes (6 - packet length) in the lower half word
+    # Missing bytes are filled with zeros. A packet longer than 6 bytes is sent with 0xFFFF as the number of missing bytes.
+    @rp2.asm_pio(in_shiftdir=0, out_shiftdir=1, autopull=True, pull_thresh=pull_thresh, autopush=True, push_thresh=32) # set the bit order direction of OSR and ISR, the autopull threshold to match the number of bits in each word from State Machine 0, and autopush of every 32 bits to the RX FIFO
+    def build_bitstream():
+        wrap_target()
+
+        # Search for preamble which is 10 or more consecutive ones
+        label("preamble")
+        set(y, 9)               # set scratch y to 9, this will count down the 10 ones of the preamble
+        label("count_ones")
+        out(x, 1)			    # move one bit from OSR to scratch x, autopull waits (blocks) for the next word from the TX FIFO when the OSR is empty
+        jmp(not_x, "preamble")  # if x is zero, then jump back to reset the y counter
+        jmp(y_dec, "count_ones")    # if y is 1 or more, then loop back to get the next bit
+
+        # Once preamble is found, then search for address start bit
+        label("find_start_bit")
+        out(x, 1)               # move one bit from OSR to scratch x
+        jmp(x_dec, "find_start_bit")    # if x is one, then the preamble continues, loop back to get the next bit
+
+        # Once address start bit is found, then gather the data bytes until the packet end bit
+        set(x, 5)               # set scratch x to 5, this will count down the bytes allowed after the first byte
+        label("byte")
+        set(y, 7)               # set scratch y to 7, this will count down for each bit of the byte to be added to ISR
+        label("bit")
+        pull(ifempty, block)    # make sure the OSR holds the next bit, since in_() from the OSR does not trigger an autopull
+        in_(osr, 1)             # move one bit from OSR to ISR, autopush sends the ISR to the RX FIFO after 32 bits
+        out(null, 1)            # remove the bit from the OSR
+        jmp(y_dec, "bit")       # loop back until the 8 bits of the byte have been added to ISR
+        out(y, 1)               # move the bit after the byte to scratch y, 0 is a data byte start bit and 1 is the packet end bit
+        jmp(y_dec, "end")       # if y is one, then the packet is complete, jump to end
+        jmp(x_dec, "byte")      # if x is 1 or more, then loop back to get the next byte
+        jmp("length")           # the packet is longer than 6 bytes, x is now 0xFFFFFFFF which marks the packet as invalid
+
+        label("end")
+        mov(y, x)               # copy the number of missing bytes to scratch y
+        label("pad")
+        jmp(not_y, "length")    # if y is zero, then all 6 bytes are in place
+        in_(null, 8)            # add a zero byte in place of a missing byte
+        jmp(y_dec, "pad")       # loop back until the missing bytes have been added
+
+        label("length")
+        in_(x, 16)              # add the number of missing bytes, this fills the 2nd word which autopush sends to the RX FIFO
+
+        wrap()
+
+    _programs[key] = build_bitstream
+    return build_bitstream
+### End State Machine 1 Code
+
+### Glitch Filter Code
+# determine_bit() with a debounce stage: after the rising edge the pin is sampled every 2 microseconds, and the bit
+# is only sampled at 74 microseconds if the pin stayed high for all of them. A shorter pulse, such as a spike from
+# a long run of track, raises IRQ 0 and State Machine 0 waits for the next rising edge, so State Machine 1 never sees
+# the phantom bit that would make it search for the preamble again. The bit is read with one mov instead of the jumps
+# of determine_bit(), so the program fits in the 11 instructions PIO0 has left for State Machine 0.
+def glitch_filter(samples, in_shiftdir, push_thresh):	# return the program for samples of 1 to 20
+    rest = 71 - 2 * samples		# cycles to stall after the samples, so the bit is read 75 cycles after the edge as in determine_bit()
+    delay1 = min(rest, 31)
+    delay2 = min(rest - delay1, 31)
+    delay0 = rest - delay1 - delay2	# only needed below 5 samples, it delays the first sample
+
+    @rp2.asm_pio(set_init=rp2.PIO.IN_HIGH, in_shiftdir=in_shiftdir, out_shiftdir=0, autopull=True, pull_thresh=1, autopush=True, push_thresh=push_thresh)
+    def filter_bit():
+        wrap_target()
+
+        label("edge")
+        wait(1, pin, 0)             # wait for GPIO pin to go high
+        set(x, samples - 1)	[delay0]    # count the samples in scratch x
+        label("sample")
+        jmp(pin, "stable")          # GPIO is still high
+        irq(rel(0))                 # GPIO went low too soon, count the glitch
+        jmp("edge")                 # and wait for the next rising edge
+        label("stable")
+        jmp(x_dec, "sample")        # one sample takes 2 cycles or 2 microseconds
+        nop()       [delay1]        # stall until 74 microseconds after the edge
+        nop()       [delay2]
+        mov(x, invert(pins))        # bit 0 of scratch x is 1 if GPIO is low after 74 microseconds, as in determine_bit()
+        in_(x, 1)	                # move one bit from scratch x into the ISR
+        wait(0, pin, 0)	            # wait for GPIO to go low before looping back to prevent recounting the same 0 bit
+
+        wrap()
+
+    return filter_bit
+### End Glitch Filter Code
+
+### Address Filter Code
+def filter_program(bits):	# return the filter program that compares the leading bits of the first byte
+    key = ("filter", bits)
+    if key in _programs:
+        return _programs[key]
+
+    # Each packet arrives as the two words of State Machine 1, the first byte is the most significant byte of the 1st word
+    @rp2.asm_pio(out_shiftdir=0, autopull=False, autopush=False)	# shift out the most significant bits first
+    def addr_filter():
+        wrap_target()
+        label("packet")
+        pull(block)             # 1st word of the packet
+        mov(isr, osr)           # keep the 1st word in the ISR
+        out(x, bits)            # move the leading bits of the first byte to scratch x
+        pull(block)             # 2nd word of the packet
+        jmp(x_not_y, "packet")  # scratch y holds the pattern, a packet for another address is dropped by going back for the next packet
+        push(block)             # send the 1st word to the RX FIFO
+        mov(isr, osr)
+        push(block)             # send the 2nd word to the RX FIFO
+        wrap()
+
+    _programs[key] = addr_filter
+    return addr_filter
+### End Address Filter Code
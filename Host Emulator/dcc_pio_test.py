@@ -0,0 +1,207 @@
+# Host-side test of the PIO programs of DCC.py
+#
+# Loads determine_bit (State Machine 0) and build_bitstream (State Machine 1) from DCC_pio.py exactly as
+# pin_addr() of DCC.py assembles them, runs them on pio_emu with synthetic DCC waveforms, and checks the packet
+# words against the packets that were sent. It also sweeps the half bit widths to show the timing
+# margins of the 74 microsecond sampling window, and reports how many bits per minute are emulated.
+# build_bitstream is also fed synthetic bit words on its own, one bit per word and 32 bits per word, which
+# must give the same packets.
+#
+# Usage: python3 dcc_pio_test.py [path to DCC.py]
+# Note: code was developed using CPython 3.11, no packages outside the standard library are needed.
+
+import builtins
+import os
+import random
+import sys
+import time
+import types
+
+import pio_emu
+
+DCC_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "DCC.py")
+DCC_PIN = 16
+
+### Program Loader Code
+class _CaptureSM:   # records the program and the settings given to rp2.StateMachine
+    programs = {}
+    def __init__(self, id, prog=None, **kw):
+        _CaptureSM.programs[id] = (prog, kw)
+    def active(self, *args):
+        return 1
+
+class _CaptureDMA:  # DMA is not needed to capture the programs
+    count = 0
+    def __init__(self):
+        self.channel = _CaptureDMA.count
+        _CaptureDMA.count += 1
+    def pack_ctrl(self, **kw):
+        return 0
+    def config(self, **kw):
+        pass
+    def active(self, *args):
+        return 1
+    def irq(self, *args, **kw):
+        pass
+
+def load_programs(packed=False, path=DCC_PATH):    # return {state machine number: (program, StateMachine settings)} of DCC.py
+    rp2 = types.ModuleType("rp2")
+    rp2.asm_pio = pio_emu.asm_pio
+    rp2.StateMachine = _CaptureSM
+    rp2.DMA = _CaptureDMA
+    rp2.PIO = types.SimpleNamespace(IN_LOW=pio_emu.IN_LOW, IN_HIGH=pio_emu.IN_HIGH, OUT_LOW=pio_emu.OUT_LOW,
+                                    OUT_HIGH=pio_emu.OUT_HIGH, SHIFT_LEFT=pio_emu.SHIFT_LEFT, SHIFT_RIGHT=pio_emu.SHIFT_RIGHT)
+    uctypes = types.ModuleType("uctypes")
+    uctypes.addressof = id
+    micropython = types.ModuleType("micropython")
+    micropython.viper = micropython.native = micropython.const = lambda f: f
+    saved = {name: sys.modules.get(name) for name in ("rp2", "uctypes", "micropython", "DCC_pio")}
+    sys.modules.update(rp2=rp2, uctypes=uctypes, micropython=micropython)
+    sys.modules.pop("DCC_pio", None)    # DCC.py imports the programs from DCC_pio.py next to it, assembled with this rp2
+    sys.path.insert(0, os.path.dirname(os.path.abspath(path)))
+    extra = {"const": lambda x: x, "uint": int, "ptr8": lambda x: x, "ptr32": lambda x: x, "micropython": micropython}
+    for name, value in extra.items():
+        setattr(builtins, name, value)
+    try:
+        ns = {"__name__": "DCC"}
+        with open(path) as f:
+            exec(compile(f.read(), path, "exec"), ns)
+        _CaptureSM.programs = {}
+        ns["pin_addr"](DCC_PIN, 3, packed=packed)
+        return dict(_CaptureSM.programs)
+    finally:
+        sys.path.pop(0)
+        for name, module in saved.items():
+            if module is None:
+                sys.modules.pop(name, None)
+            else:
+                sys.modules[name] = module
+        for name in extra:
+            delattr(builtins, name)
+### End Program Loader Code
+
+### Pipeline Code
+def packet_words(packet):   # the two words State Machine 1 sends for a packet, see build_bitstream() in DCC.py
+    b = list(packet) + [0] * (6 - len(packet))
+    missing = 6 - len(packet) if len(packet) <= 6 else 0xFFFF
+    return (b[0] << 24 | b[1] << 16 | b[2] << 8 | b[3], b[4] << 24 | b[5] << 16 | missing)
+
+def run_pipeline(programs, waveform, t_end):   # run both state machines over a waveform, return the RX words of State Machine 1
+    gpio = pio_emu.GPIO()
+    gpio.drive(DCC_PIN, waveform)
+    pio = pio_emu.PIO(0, gpio)
+    (prog0, kw0), (prog1, kw1) = programs[0], programs[1]
+    sm0 = pio.state_machine(0, prog0, freq=kw0.get("freq", 125_000_000), in_base=kw0.get("in_base"), jmp_pin=kw0.get("jmp_pin"))
+    sm1 = pio.state_machine(1, prog1, freq=kw1.get("freq", 125_000_000))
+    words = []
+
+    def dma01(sm):  # dma0 and dma1 move each word to State Machine 1 as soon as it is in the RX FIFO
+        sm1.run_until(sm0.time)
+        sm1.put(sm0.get())
+
+    def dma23(sm):  # dma2 and dma3 read the packet words
+        words.append(sm1.get())
+
+    sm0.on_push = dma01
+    sm1.on_push = dma23
+    sm0.active(1)
+    sm1.active(1)
+    sm0.run_until(t_end)
+    sm1.run_until(t_end)
+    return words, sm0, sm1
+
+def run_packets(programs, packets, one_us=58, zero_us=100, jitter=None, preamble=14):
+    bits = []
+    for packet in packets:
+        bits += pio_emu.packet_bits(packet, preamble)
+    bits += [1] * 40    # the next preamble ends the last packet
+    waveform, t_end = pio_emu.dcc_waveform(bits, 10_000, one_us, zero_us, jitter=jitter)
+    words, sm0, sm1 = run_pipeline(programs, waveform, t_end + 100_000)
+    return [(words[i], words[i + 1]) for i in range(0, len(words) - 1, 2)], sm0, sm1, len(bits)
+
+def frame_words(programs, words):   # feed words to State Machine 1 alone, as dma0 does, return its packet words
+    pio = pio_emu.PIO(0, pio_emu.GPIO())
+    sm1 = pio.state_machine(1, programs[1][0])
+    got = []
+    sm1.on_push = lambda sm: got.append(sm.get())
+    sm1.active(1)
+    for word in words:
+        while sm1.tx_full():
+            sm1.run_until(sm1.time + 1000)
+        sm1.put(word)
+    sm1.run_until(sm1.time + 1_000_000)
+    return [(got[i], got[i + 1]) for i in range(0, len(got) - 1, 2)]
+### End Pipeline Code
+
+### Test Code
+SAMPLE_PACKETS = [
+    [3, 0x83],                          # 28 step speed
+    [3, 0x91],                          # function group one
+    [3, 0x3F, 0x85],                    # 128 step speed
+    [0xC5, 0x12, 0xB3],                 # long address, function group two
+    [0xC5, 0x12, 0xDE, 0xAA],           # long address, F13-F20
+    [0x81, 0xF9],                       # basic accessory
+    [0xFF, 0x00],                       # idle
+    [1, 2, 3, 4, 5],                    # 6 bytes with the error detection byte
+    [1, 2, 3, 4, 5, 6],                 # 7 bytes, too long
+]
+
+def check(programs, name, **kw):
+    packets = [pio_emu.with_checksum(p) for p in SAMPLE_PACKETS] * 3
+    got, sm0, sm1, nbits = run_packets(programs, packets, **kw)
+    expected = [packet_words(p) for p in packets]
+    ok = got == expected
+    print("{:40s} {} ({} of {} packets)".format(name, "ok" if ok else "FAILED", sum(a == b for a, b in zip(got, expected)), len(expected)))
+    return ok
+
+def framing(unpacked, packed):  # build_bitstream frames the same packets from one bit per word and from 32 bits per word
+    random.seed(6)
+    packets = [pio_emu.with_checksum(p) for p in SAMPLE_PACKETS] * 3
+    bits = [0] * 5  # a cut off packet before the first preamble
+    for packet in packets:
+        bits += pio_emu.packet_bits(packet, random.randint(10, 20))
+    bits += [1] * (40 + -(len(bits) + 40) % 32)    # the next preamble ends the last packet and fills the last packed word
+    words = [sum(bits[i + j] << j for j in range(32)) for i in range(0, len(bits), 32)]    # the first bit received is the LSB
+    expected = [packet_words(p) for p in packets]
+    one = frame_words(unpacked, bits)
+    many = frame_words(packed, words)
+    ok = one == many == expected
+    print("{:40s} {} ({} bit words and {} packed words, {} of {} packets the same)".format(
+        "framing of unpacked and packed words", "ok" if ok else "FAILED", len(bits), len(words),
+        sum(a == b == c for a, b, c in zip(one, many, expected)), len(expected)))
+    return ok
+
+def margins(programs):  # widest and narrowest half bits that are still read correctly
+    packets = [pio_emu.with_checksum(p) for p in SAMPLE_PACKETS[:4]]
+    expected = [packet_words(p) for p in packets]
+    ones = [us for us in range(30, 101) if run_packets(programs, packets, one_us=us)[0] == expected]
+    zeros = [us for us in range(60, 201, 2) if run_packets(programs, packets, zero_us=us)[0] == expected]
+    print("one half bit read correctly from {} to {} us (NMRA receive range 52 to 64 us)".format(ones[0], ones[-1]))
+    print("zero half bit read correctly from {} to {} us (NMRA receive range 90 to 10000 us)".format(zeros[0], zeros[-1]))
+
+def throughput(programs, name):
+    packets = [pio_emu.with_checksum([3, 0x80 | i % 32]) for i in range(300)]
+    t = time.time()
+    got, sm0, sm1, nbits = run_packets(programs, packets)
+    dt = time.time() - t
+    print("{:40s} {:,} bits per minute, {} + {} PIO instructions".format(name, int(nbits / dt * 60), sm0.instructions, sm1.instructions))
+
+def main(path=DCC_PATH):
+    ok = True
+    for packed in (False, True):
+        programs = load_programs(packed, path)
+        mode = "packed" if packed else "unpacked"
+        print("{}: State Machine 0 {} instructions, State Machine 1 {} instructions".format(mode, len(programs[0][0][0]), len(programs[1][0][0])))
+        ok &= check(programs, mode + " nominal timing")
+        random.seed(1)
+        ok &= check(programs, mode + " +-6 us jitter", jitter=lambda: random.randint(-6000, 6000))
+        ok &= check(programs, mode + " NMRA limits 52 us / 90 us", one_us=52, zero_us=90)
+        ok &= check(programs, mode + " NMRA limits 64 us / 10000 us", one_us=64, zero_us=10000)
+        throughput(programs, mode + " emulation speed")
+    ok &= framing(load_programs(False, path), load_programs(True, path))
+    margins(load_programs(False, path))
+    return ok
+
+if __name__ == "__main__":
+    sys.exit(0 if main(*sys.argv[1:]) else 1)
+### End Test Code
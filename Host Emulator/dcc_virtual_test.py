@@ -0,0 +1,516 @@
+# Throughput and latency regression test of DCC.py on the virtual Pico
+#
+# Imports the unmodified DCC.py with virtual_pico.py standing in for the Pico, sends synthetic DCC waveforms
+# to the decoder pin, and checks what the decoder reports. Each scenario runs State Machine 0, State Machine 1,
+# the DMA chains and the interrupt handlers of DCC.py together, as pin_addr() sets them up.
+# Reported per scenario: packets decoded per second of host time, how much slower than real time the
+# emulation runs, and the interrupt counts and the longest scheduler latency of the virtual board.
+#
+# Usage: python3 dcc_virtual_test.py
+# Note: code was developed using CPython 3.11, no packages outside the standard library are needed.
+
+import bisect
+import importlib
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+
+import virtual_pico
+
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+DCC_PIN = 16
+
+def start(*args, **kw):    # a new board and a freshly imported DCC.py and DCC_pio.py, then pin_addr(*args, **kw)
+    board = virtual_pico.reset()
+    virtual_pico.install()
+    import DCC_pio
+    importlib.reload(DCC_pio)   # no programs assembled yet
+    import DCC
+    importlib.reload(DCC)
+    DCC.pin_addr(*args, **kw)
+    return board, DCC
+
+def report(name, ok, board, packets, host_s):
+    virtual_s = board.time_ns / 1e9
+    print("{:28s} {:6s} {:6,.0f} packets/s, {:4.1f}x real time, {} hard + {} soft IRQs, {} lost, max latency {} us".format(
+        name, "ok" if ok else "FAILED", packets / host_s, virtual_s / host_s, board.stats["hard_irqs"],
+        board.stats["soft_irqs"], board.stats["soft_irqs_lost"], board.stats["max_latency_us"]))
+    return ok
+
+def throttle_packets(n):    # 128 step speed and function group one packets for short address 3 and long address 1000
+    packets = []
+    for i in range(n):
+        packets.append([3, 0x3F, 0x80 | i % 128])
+        packets.append([0xC3, 0xE8, 0x80 | i % 32])
+    return packets
+
+def add_spikes(board, pin, n, width_ns):   # n high spikes at random times in the low halves of the waveform of a pin
+    w = board.gpio.inputs[pin]
+    while n:
+        t = random.randint(w.edges[0], w.edges[-1])
+        i = bisect.bisect_right(w.edges, t)
+        if w.level(t) or i != bisect.bisect_right(w.edges, t + width_ns):
+            continue    # only where the pin stays low for the whole spike
+        w.edges[i:i] = [t, t + width_ns]
+        n -= 1
+
+### Scenario Code
+def decode(name, **kw):     # the last packet of each address is what snapshot() reports
+    board, DCC = start(DCC_PIN, [3, 1000], **kw)
+    packets = throttle_packets(100)
+    board.send_dcc(DCC_PIN, packets + [[0xFF, 0]] * 3)   # idle packets push the last bits through in packed mode
+    t = time.perf_counter()
+    board.run_until(board.packet_ends[-1] + 1_000_000)
+    if "hard_irq" in kw:
+        DCC.drain()
+    host_s = time.perf_counter() - t
+    ok = DCC.snapshot(3) == (98, 1, 0) and DCC.snapshot(1000) == (0, 0, 0b110) and DCC.thr_pos(3) == 98
+    return report(name, ok, board, len(packets), host_s)
+
+def speed_steps():          # 128 step speed 0 is stop and 1 is emergency stop, 2 to 127 are speed steps 1 to 126
+    board, DCC = start(DCC_PIN, [3, 4, 5, 6])
+    board.send_dcc(DCC_PIN, [[3, 0x3F, 0x81], [4, 0x3F, 0x02], [5, 0x3F, 0xFF], [6, 0x3F, 0x80]])
+    t = time.perf_counter()
+    board.run_until(board.packet_ends[-1] + 1_000_000)
+    ok = (DCC.snapshot(3) == (0, 1, 0) and DCC.snapshot(4) == (1, 0, 0) and DCC.snapshot(5) == (126, 1, 0)
+          and DCC.snapshot(6) == (0, 1, 0))
+    return report("128 speed steps", ok, board, 4, time.perf_counter() - t)
+
+def checksum():             # a packet with a wrong error detection byte must not change the state
+    board, DCC = start(DCC_PIN, 3)
+    board.send_dcc(DCC_PIN, [[3, 0x90]])
+    board.send_dcc(DCC_PIN, [[3, 0x9F, 0x00]], checksum=False)
+    t = time.perf_counter()
+    board.run_until(board.packet_ends[-1] + 1_000_000)
+    ok = DCC.snapshot()[2] == 1
+    return report("bad error detection byte", ok, board, 2, time.perf_counter() - t)
+
+def callbacks():            # latency from the end bit of a packet to the callback, in virtual time
+    latency = []
+    def on_func(addr, n, state):
+        latency.append(board.now - board.packet_ends[len(latency)])
+    board, DCC = start(DCC_PIN, 3, on_func={1: on_func})
+    board.send_dcc(DCC_PIN, [[3, 0x80 if i % 2 else 0x81] for i in range(40)])
+    t = time.perf_counter()
+    board.run_until(board.packet_ends[-1] + 1_000_000)
+    host_s = time.perf_counter() - t
+    ok = len(latency) == 40 and max(latency) < 1_000_000
+    report("callbacks", ok, board, 40, host_s)
+    if latency:
+        print("{:28s} callback {:.0f} to {:.0f} us after the end bit".format("", min(latency) / 1000, max(latency) / 1000))
+    return ok
+
+def ring(packets=16):       # hard_irq=True with the main loop busy: packets wait in the ring, the oldest are lost on overrun
+    board, DCC = start(DCC_PIN, 3, hard_irq=True, ring=packets)
+    board.sched_ns = 200_000_000    # the scheduler runs every 200 ms, as if the main loop were busy
+    sent = throttle_packets(40)[::2]
+    board.send_dcc(DCC_PIN, sent)
+    t = time.perf_counter()
+    board.run_until(board.packet_ends[-1] + 1_000_000)
+    got, lost = DCC.ring_read()
+    host_s = time.perf_counter() - t
+    stamps = [p[0] for p in got]
+    ends = [e // 1000 for e in board.packet_ends[-len(got):]]
+    ok = (len(got) + lost == len(sent) and len(got) == packets - 1
+          and sum(DCC.repeat_stats()) + DCC.stats()["ring_overruns"] == len(sent)
+          and all(abs(s - e) < 100 for s, e in zip(stamps, ends)))
+    return report("hard_irq ring of {} packets".format(packets), ok, board, len(sent), host_s)
+
+def irq_lost():             # soft interrupts with the main loop busy: a packet replaced before its interrupt ran is counted
+    board, DCC = start(DCC_PIN, 3)
+    board.sched_ns = 15_000_000     # the scheduler runs every 15 ms, two or three packets arrive in between
+    sent = throttle_packets(40)[::2]
+    board.send_dcc(DCC_PIN, sent)
+    t = time.perf_counter()
+    board.run_until(board.packet_ends[-1] + 1_000_000)
+    host_s = time.perf_counter() - t
+    lost = DCC.stats()["irq_lost"]
+    ok = lost > 0 and sum(DCC.repeat_stats()) + lost == len(sent) and DCC.thr_pos() == 38
+    report("soft interrupts lost", ok, board, len(sent), host_s)
+    print("{:28s} {} of {} packets replaced before their interrupt ran".format("", lost, len(sent)))
+    return ok
+
+def nested_drain():         # a callback that runs long enough for the next drain() to run inside it, each packet is decoded once
+    calls = []
+    def on_func(addr, n, state):
+        calls.append(state)
+        if len(calls) == 1:    # the other packets arrive and their scheduled drain() runs before this callback returns
+            board.run_until(board.packet_ends[-1] + 1_000_000)
+    board, DCC = start(DCC_PIN, 3, hard_irq=True, on_func={1: on_func})
+    board.send_dcc(DCC_PIN, [[3, 0x80 if i % 2 else 0x81] for i in range(10)])
+    t = time.perf_counter()
+    board.run_until(board.packet_ends[0] + 1_000_000)
+    host_s = time.perf_counter() - t
+    ok = calls == [True] + [False, True] * 4 + [False] and not DCC.f_btn(1, 3) and DCC.drain() == 0
+    return report("drain inside drain", ok, board, 10, host_s)
+
+def schedule_full():        # the schedule queue is full when the first ring interrupts run, a later packet schedules the drain
+    board, DCC = start(DCC_PIN, 3, hard_irq=True, stats=True)
+    t0 = DCC.inputs[0]
+    ch = [ch for ch in board.dma.channels if ch.handler == t0.ring_irq][0]
+    calls = []
+    def busy(dma):
+        calls.append(dma)
+        if len(calls) <= 3:    # other interrupts have scheduled as many callbacks as the queue holds
+            board.queue.extend([(lambda arg: None, None, board.now)] * virtual_pico.SCHED_DEPTH)
+        t0.ring_irq(dma)
+    ch.handler = busy
+    board.send_dcc(DCC_PIN, [[3, 0x80 | i] for i in range(10)])
+    t = time.perf_counter()
+    try:
+        board.run_until(board.packet_ends[-1] + 1_000_000)
+    except RuntimeError as e:
+        print("{:28s} RuntimeError: {}".format("", e))
+    host_s = time.perf_counter() - t
+    ok = DCC.stats()["schedule_full"] == 3 and DCC.repeat_stats()[1] == 10 and DCC.f_btn(1, 3) and DCC.drain() == 0
+    return report("schedule queue full", ok, board, 10, host_s)
+
+def accessory():            # basic accessory packets switch turnouts, board 511 is the broadcast to every board
+    board, DCC = start(DCC_PIN, 3)
+    board.send_dcc(DCC_PIN, [[0x81, 0xF9], [0x82, 0xFB], [0x82, 0xFA]])  # turnout 1 closed, turnout 6 closed then thrown
+    board.send_dcc(DCC_PIN, [[0xBF, 0x8F], [0xBF, 0x07, 0x05]])  # output pair 3 of every board closed, aspect 5 at every address
+    t = time.perf_counter()
+    board.run_until(board.packet_ends[-1] + 1_000_000)
+    ok = (DCC.acc_state(1) == 1 and DCC.acc_state(6) == 0 and DCC.acc_state(2) == 0
+          and all(DCC.acc_state(a) == (a % 4 == 0 and a <= 2040 or a == 1) for a in range(1, 2045))
+          and all(DCC.acc_aspect(a) == (5 if a <= 2040 else 0) for a in range(1, 2045)))
+    return report("accessory", ok, board, 5, time.perf_counter() - t)
+
+def jitter():               # +-6 us jitter on every half bit
+    random.seed(2)
+    board, DCC = start(DCC_PIN, 3)
+    board.send_dcc(DCC_PIN, throttle_packets(50)[::2], jitter=lambda: random.randint(-6000, 6000))
+    t = time.perf_counter()
+    board.run_until(board.packet_ends[-1] + 1_000_000)
+    ok = DCC.snapshot()[0] == 48
+    return report("+-6 us jitter", ok, board, 50, time.perf_counter() - t)
+
+def addr_filter():         # the PIO address filter drops the packets of other addresses before they raise an interrupt
+    board, DCC = start(DCC_PIN, 3, addr_filter=True)
+    traffic = [[3, 0x63], [5, 0x92], [0xC3, 0xE8, 0x82], [0xFF, 0], [3, 0x91]] * 10
+    board.send_dcc(DCC_PIN, traffic)
+    t = time.perf_counter()
+    board.run_until(board.packet_ends[-1] + 1_000_000)
+    ok = DCC.snapshot() == (3, 1, 0b11) and board.stats["soft_irqs"] == 20
+    return report("address filter", ok, board, len(traffic), time.perf_counter() - t)
+
+def repeats():             # repeated packets are skipped, a packet of the same group in between is not
+    board, DCC = start(DCC_PIN, [3, 1000])
+    traffic = [[3, 0x63], [3, 0x91], [0xC3, 0xE8, 0x82], [3, 0x3F, 0x85], [3, 0x3F, 0x85], [3, 0x63]] * 5
+    board.send_dcc(DCC_PIN, traffic)
+    t = time.perf_counter()
+    board.run_until(board.packet_ends[-1] + 1_000_000)
+    ok = DCC.snapshot(3) == (3, 1, 0b11) and DCC.snapshot(1000) == (0, 0, 0b100) and DCC.repeat_stats() == (17, 13)
+    report("repeated packets", ok, board, len(traffic), time.perf_counter() - t)
+    print("{:28s} {} repeats skipped, {} packets decoded".format("", *DCC.repeat_stats()))
+    return ok
+
+def counters():            # stats() counts the packets and the time each decode takes, on the host clock
+    board, DCC = start(DCC_PIN, 3, stats=True)
+    board.send_dcc(DCC_PIN, [[3, 0x63], [3, 0x63], [5, 0x63], [0xFF, 0]])
+    board.send_dcc(DCC_PIN, [[3, 0x63, 0x00]], checksum=False)
+    board.send_dcc(DCC_PIN, [[1, 2, 3, 4, 5, 6]])
+    t = time.perf_counter()
+    board.run_until(board.packet_ends[-1] + 1_000_000)
+    st = DCC.stats(reset=True)
+    ok = ((st["framed"], st["matched"], st["rejected"], st["bad_length"], st["repeats"]) == (6, 2, 2, 1, 1)
+          and sum(st["parse_hist"]) == 6 and DCC.stats()["framed"] == 0)
+    report("stats", ok, board, 6, time.perf_counter() - t)
+    print("{:28s} parse time histogram {}".format("", st["parse_hist"]))
+    return ok
+
+def events():               # one change wakes every changed() task, events(addr) only returns the snapshots of its address
+    import asyncio
+    board, DCC = start(DCC_PIN, [3, 4])
+    woke = []
+    snaps = []
+    async def waiter(i):
+        await DCC.changed()
+        woke.append(i)
+    async def follow():
+        async for snap in DCC.events(3):
+            snaps.append(snap)
+    async def run(packet):  # send one packet, then let the tasks run
+        board.send_dcc(DCC_PIN, [packet])
+        board.run_until(board.packet_ends[-1] + 1_000_000)
+        for i in range(5):
+            await asyncio.sleep(0)
+    async def scenario():
+        tasks = [asyncio.create_task(waiter(i)) for i in range(3)] + [asyncio.create_task(follow())]
+        await asyncio.sleep(0)
+        await run([4, 0x90])    # F0 of address 4
+        first = (sorted(woke), list(snaps))
+        await run([3, 0x81])    # F1 of address 3
+        for task in tasks:
+            task.cancel()
+        return first
+    t = time.perf_counter()
+    first = asyncio.run(scenario())
+    ok = first == ([0, 1, 2], [(0, 0, 0)]) and snaps == [(0, 0, 0), (0, 0, 0b10)]
+    return report("asyncio events", ok, board, 2, time.perf_counter() - t)
+
+def capture():              # record=stream writes every packet, replay() decodes the capture again into the same state
+    stream = io.BytesIO()
+    board, DCC = start(DCC_PIN, [3, 1000], record=stream)
+    board.send_dcc(DCC_PIN, throttle_packets(20))
+    t = time.perf_counter()
+    board.run_until(board.packet_ends[-1] + 1_000_000)
+    import DCC_capture
+    stream.seek(0)
+    ok = sum(1 for kind, t_, v in DCC_capture.records(stream) if kind == DCC_capture.PACKET) == 40
+    pulses = io.BytesIO()   # the half bit widths of 7 packets, more than the 255 widths a count byte can hold
+    widths = []
+    for packet in [[3, 0x80 | i] for i in range(1, 8)]:
+        for b in virtual_pico.pio_emu.packet_bits(virtual_pico.pio_emu.with_checksum(packet)):
+            widths += [58, 58] if b else [100, 100]
+    DCC_capture.writer(pulses).pulses(0, widths)
+    pulses.seek(0)
+    ok = ok and [len(v) for kind, t_, v in DCC_capture.records(pulses)] == [254, 254, len(widths) - 508]
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "capture.bin")
+        with open(path, "wb") as f:
+            f.write(stream.getvalue())
+        copy = DCC.decoder([3, 1000])   # a decoder of its own, the state of track 0 is not changed by the replay
+        ok = (ok and DCC_capture.replay(path, decode=copy.decode) == 40
+              and copy.snapshot(3) == DCC.snapshot(3) and copy.snapshot(1000) == DCC.snapshot(1000))
+        with open(path, "wb") as f:
+            f.write(pulses.getvalue())
+        copy = DCC.decoder(3)
+        ok = ok and DCC_capture.replay(path, realtime=True, decode=copy.decode) == 7 and copy.snapshot() == (0, 0, 0b1110)
+    return report("capture and replay", ok, board, 40, time.perf_counter() - t)
+
+def command_station():      # the scheduler of DCC_output.py drives the rails, the decoder reads them back
+    board = virtual_pico.reset()
+    virtual_pico.install()
+    import DCC_output
+    station = DCC_output.scheduler(2)
+    for addr in range(1, 21):
+        station.speed(addr, addr, addr % 2, steps=28)
+        station.function(addr, 0, True)
+    station.function(3, 9, True)
+    station.function(3, 30, True)
+    station.function(4, 60, True)
+    station.speed(1000, 100, False)     # long address, 128 steps
+    station.function(1000, 2, True)
+    station.function(1000, 20, True)
+    station.function(1000, 68, True)
+    t = time.perf_counter()
+    while board.time_ns < 1_000_000_000:
+        station.pump()
+        board.run_ms(40)        # the DMA keeps the rails fed between the calls
+    waveform = board.gpio.outputs[2]
+    calls = set()
+    board, DCC = start(DCC_PIN, [3, 4, 20, 1000], on_func={(13, 68): lambda addr, n, state: calls.add((addr, n, state))})
+    board.gpio.drive(DCC_PIN, waveform)
+    board.run_ms(1000)
+    ok = (DCC.snapshot(3) == (3, 1, 1 << 30 | 0b1000000001) and DCC.snapshot(4) == (4, 0, 1 << 60 | 1)
+          and DCC.snapshot(20) == (20, 0, 1) and DCC.snapshot(1000) == (100, 0, 1 << 68 | 1 << 20 | 0b100)
+          and DCC.f_btn(68, 1000) and not DCC.f_btn(67, 1000) and DCC.f_btn(60, 4)
+          and calls == {(3, 30, True), (4, 60, True), (1000, 20, True), (1000, 68, True)}
+          and station.sent[0] == 47 and station.late == 0)
+    report("command station", ok, board, sum(station.sent), time.perf_counter() - t)
+    print("{:28s} {} changed, {} refresh and {} idle packets sent, {} frames built and {} copied from the cache".format(
+        "", *station.sent, station.cache.misses, station.cache.hits))
+    return ok
+
+def late_pump():            # pump() is sometimes too late, the DMA sends old words again but never a cut packet
+    random.seed(7)
+    board = virtual_pico.reset()
+    virtual_pico.install()
+    import DCC_output
+    station = DCC_output.scheduler(2)
+    for addr in range(1, 11):
+        station.speed(addr, addr, addr % 2, steps=28)
+    t = time.perf_counter()
+    while board.time_ns < 3_000_000_000:
+        station.pump()
+        station.function(3, 1, board.time_ns // 200_000_000 % 2 == 1)   # changed commands keep coming
+        board.run_ms(random.choice((10, 40, 40, 60, 90, 150, 300)))
+    waveform = board.gpio.outputs[2]
+    board, DCC = start(DCC_PIN, [3, 10], stats=True)
+    board.gpio.drive(DCC_PIN, waveform)
+    board.run_ms(3000)
+    stats = DCC.stats()
+    ok = (station.late > 5 and stats["rejected"] == 0 and stats["bad_length"] == 0
+          and DCC.snapshot(10) == (10, 0, 0) and DCC.thr_pos(3) == 3)
+    report("late pump", ok, board, sum(station.sent), time.perf_counter() - t)
+    print("{:28s} pump() late {} times, {} packets framed, {} rejected".format("", station.late, stats["framed"], stats["rejected"]))
+    return ok
+
+def timing():               # timing=True measures every 1 half bit, a packet with 75 us half bits is rejected
+    random.seed(3)
+    board, DCC = start(DCC_PIN, 3, timing=True)
+    board.send_dcc(DCC_PIN, throttle_packets(20)[::2], jitter=lambda: random.randint(-3000, 3000))
+    board.send_dcc(DCC_PIN, [[3, 0x3F, 0x80]], one_us=75)
+    t = time.perf_counter()
+    board.run_until(board.packet_ends[-1] + 1_000_000)
+    host_s = time.perf_counter() - t
+    bits = DCC.bit_timing()
+    ok = (DCC.snapshot()[0] == 18 and bits["short"] == 0 and bits["between"] > 14 and 55 <= bits["one_min"]
+          and bits["one_max"] <= 61 and abs(bits["one_mean"] - 58) < 1 and 1 < bits["one_jitter"] < 3)
+    report("bit timing", ok, board, 21, host_s)
+    print("{:28s} {ones} ones from {one_min} to {one_max} us, mean {one_mean:.1f} us, jitter {one_jitter:.1f} us, {between} out of spec".format("", **bits))
+    return ok
+
+def glitches():             # 3 us spikes between the bits: glitch=3 ignores them, without it packets are lost
+    decoded = []
+    for glitch in (0, 3):
+        random.seed(4)
+        board, DCC = start(DCC_PIN, 3, stats=True, glitch=glitch)
+        board.send_dcc(DCC_PIN, throttle_packets(30)[::2])
+        add_spikes(board, DCC_PIN, 30, 3000)
+        t = time.perf_counter()
+        board.run_until(board.packet_ends[-1] + 1_000_000)
+        decoded.append(DCC.stats())
+    host_s = time.perf_counter() - t
+    ok = DCC.snapshot()[0] == 28 and decoded[1]["matched"] == 30 and decoded[1]["glitches"] > 0 and decoded[0]["matched"] < 30
+    report("glitch filter", ok, board, 30, host_s)
+    print("{:28s} {} of 30 packets decoded without the filter, 30 with it, {} glitches rejected".format(
+        "", decoded[0]["matched"], decoded[1]["glitches"]))
+    return ok
+
+def tracks():               # four track inputs on one board, each with its own state, callbacks and ring
+    calls = []
+    board, DCC = start(DCC_PIN, [3, 1000])
+    t1 = DCC.pin_addr(DCC_PIN + 1, [4, 3], track=1, hard_irq=True, on_func={1: lambda addr, n, state: calls.append(addr)})
+    t2 = DCC.pin_addr(DCC_PIN + 2, [5, 3], packed=True, track=2)
+    t3 = DCC.pin_addr(DCC_PIN + 3, 2000, packed=True, track=3, stats=True)
+    idle = [[0xFF, 0]] * 3  # idle packets push the last bits through in packed mode
+    board.send_dcc(DCC_PIN, throttle_packets(10) + [[3, 0x91]])
+    board.send_dcc(DCC_PIN + 1, [[4, 0x3F, 0x80 | i] for i in range(20)])
+    board.send_dcc(DCC_PIN + 2, [[5, 0x3F, i] for i in range(20)] + [[3, 0x3F, 0x80 | 50]] + idle)
+    board.send_dcc(DCC_PIN + 3, [[0xC7, 0xD0, 0x3F, 0x80 | i] for i in range(20)] + idle)
+    t = time.perf_counter()
+    board.run_until(max(board.packet_ends) + 1_000_000)
+    host_s = time.perf_counter() - t
+    channels = sum(ch.claimed for ch in board.dma.channels)
+    ok = (DCC.snapshot(3) == (8, 1, 0b11) and DCC.snapshot(1000) == (0, 0, 0b10010) and t2.snapshot(3) == (49, 1, 0)
+          and t1.snapshot() == (18, 1, 0) and t1.snapshot(3) == (0, 0, 0) and DCC.thr_pos(5, track=2) == 18
+          and t2.thr_dir() == 0 and DCC.snapshot(track=3) == (18, 1, 0) and t3.stats()["matched"] == 20
+          and DCC.stats()["framed"] == 0 and calls == [] and DCC.ring_read(1)[0][-1][1] >> 8 == 0x043F93
+          and channels == 12)
+    report("four tracks", ok, board, 92, host_s)
+    print("{:28s} {} DMA channels for 4 tracks".format("", channels))
+    return ok
+
+def assembly_irq():         # the interrupts of track 0 run while track 2 assembles its programs
+    irqs = []
+    def wrap_target(emit):
+        t0.packet_irq(None)
+        t0.ring_irq(None)
+        irqs.append(emit)
+        return assemble(emit)
+    board, DCC = start(DCC_PIN, 3, hard_irq=True)
+    t0 = DCC.inputs[0]
+    board.send_dcc(DCC_PIN, throttle_packets(10)[::2])
+    board.send_dcc(DCC_PIN + 2, throttle_packets(10)[::2] + [[0xFF, 0]] * 3)
+    assemble = virtual_pico.pio_emu.PIOASMEmit.wrap_target
+    virtual_pico.pio_emu.PIOASMEmit.wrap_target = wrap_target
+    t = time.perf_counter()
+    try:
+        DCC.pin_addr(DCC_PIN + 2, 3, packed=True, track=2)
+        ok = True
+    except NameError as e:  # asm_pio replaced the globals the handlers of track 0 use
+        print("{:28s} NameError: {}".format("", e))
+        ok = False
+    finally:
+        virtual_pico.pio_emu.PIOASMEmit.wrap_target = assemble
+    board.run_until(board.packet_ends[-1] + 1_000_000)
+    DCC.drain()
+    ok = ok and len(irqs) > 0 and DCC.thr_pos() == 8 and DCC.thr_pos(track=2) == 8
+    return report("interrupts during assembly", ok, board, 20, time.perf_counter() - t)
+
+def track_options():        # timing, addr_filter and the ring on other tracks than track 0, and settings that do not fit
+    random.seed(5)
+    board, DCC = start(DCC_PIN + 1, 3, track=1, timing=True)
+    board.send_dcc(DCC_PIN + 1, throttle_packets(10)[::2], jitter=lambda: random.randint(-3000, 3000))
+    t = time.perf_counter()
+    board.run_until(board.packet_ends[-1] + 1_000_000)
+    bits = DCC.bit_timing(track=1)
+    ok = DCC.thr_pos(track=1) == 8 and bits["ones"] > 0 and 55 <= bits["one_min"] and bits["one_max"] <= 61
+    board, DCC = start(DCC_PIN + 3, 4, track=3, addr_filter=True, hard_irq=True)
+    board.send_dcc(DCC_PIN + 3, [[4, 0x3F, 0x80 | i] if i % 2 else [5, 0x91] for i in range(20)])
+    board.run_until(board.packet_ends[-1] + 1_000_000)
+    host_s = time.perf_counter() - t
+    t3 = DCC.inputs[3]
+    ok = ok and t3.thr_pos() == 18 and t3.repeat_stats() == (0, 10) and t3.programs[2][0] == 0
+    errors = []
+    claimed = sum(ch.claimed for ch in board.dma.channels)
+    decoders = len(DCC.decoders)
+    closed = io.BytesIO()
+    closed.close()
+    for kw in ({"track": 0},                # State Machine 0 runs the address filter of track 3
+               {"track": 2, "glitch": 3},   # the two tracks of PIO1 need the same settings
+               {"track": 1, "timing": True},    # PIO0 has no room for the timing program next to the filter
+               {"track": 2, "record": closed}):    # fails after the DMA channels are claimed, which are released again
+        try:
+            DCC.pin_addr(DCC_PIN, 3, **kw)
+        except ValueError as e:
+            errors.append(str(e))
+    ok = (ok and len(errors) == 4 and sum(ch.claimed for ch in board.dma.channels) == claimed
+          and DCC.inputs[:3] == [None] * 3 and len(DCC.decoders) == decoders)
+    DCC.pin_addr(DCC_PIN + 2, 6, track=2, record=io.BytesIO())     # the track starts after the failed attempt
+    board.send_dcc(DCC_PIN + 2, [[6, 0x3F, 0x85]])
+    board.run_until(board.packet_ends[-1] + 1_000_000)
+    ok = ok and DCC.inputs[2].thr_pos() == 4
+    report("track options", ok, board, 30, host_s)
+    for e in errors:
+        print("{:28s} ValueError: {}".format("", e))
+    return ok
+
+def address_range():        # 254 addresses fill the state slots, addresses outside 0 to 10239 and a 255th address raise ValueError
+    addresses = list(range(1, 128)) + list(range(10239, 10112, -1))
+    board, DCC = start(DCC_PIN, addresses)
+    board.send_dcc(DCC_PIN, [[127, 0x3F, 0x85], [0xE7, 0xFF, 0x3F, 0x86]])
+    t = time.perf_counter()
+    board.run_until(board.packet_ends[-1] + 1_000_000)
+    host_s = time.perf_counter() - t
+    ok = DCC.thr_pos(127) == 4 and DCC.thr_pos(10239) == 5
+    errors = []
+    claimed = sum(ch.claimed for ch in board.dma.channels)
+    for bad in (-1, [3, 10240], addresses + [128]):
+        try:
+            DCC.pin_addr(DCC_PIN + 1, bad, track=1)
+        except ValueError as e:
+            errors.append(str(e))
+    ok = ok and len(errors) == 3 and sum(ch.claimed for ch in board.dma.channels) == claimed and DCC.inputs[1] is None
+    report("address range", ok, board, 2, host_s)
+    for e in errors:
+        print("{:28s} ValueError: {}".format("", e))
+    return ok
+### End Scenario Code
+
+def main():
+    ok = True
+    ok &= decode("soft interrupt")
+    ok &= decode("packed", packed=True)
+    ok &= decode("hard_irq", hard_irq=True)
+    ok &= speed_steps()
+    ok &= checksum()
+    ok &= callbacks()
+    ok &= ring()
+    ok &= irq_lost()
+    ok &= nested_drain()
+    ok &= schedule_full()
+    ok &= accessory()
+    ok &= jitter()
+    ok &= addr_filter()
+    ok &= repeats()
+    ok &= counters()
+    ok &= events()
+    ok &= capture()
+    ok &= command_station()
+    ok &= late_pump()
+    ok &= timing()
+    ok &= glitches()
+    ok &= tracks()
+    ok &= assembly_irq()
+    ok &= track_options()
+    ok &= address_range()
+    return ok
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
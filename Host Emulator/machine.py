@@ -0,0 +1,70 @@
+# machine module of MicroPython for the virtual Pico, see virtual_pico.py
+# Pin outputs are recorded on the GPIO bank of the board, inputs read the waveform that drives the pin.
+
+import virtual_pico
+
+class Pin:
+    IN = 0
+    OUT = 1
+    OPEN_DRAIN = 2
+    PULL_UP = 1
+    PULL_DOWN = 2
+    IRQ_FALLING = 4
+    IRQ_RISING = 8
+
+    def __init__(self, id, mode=-1, pull=-1, value=None):
+        self.id = id
+        if value is not None:
+            self.value(value)
+
+    def init(self, mode=-1, pull=-1, value=None):
+        if value is not None:
+            self.value(value)
+
+    def value(self, value=None):
+        board = virtual_pico.board
+        if value is None:
+            return board.gpio.level(self.id, board.now)
+        board.gpio.write(self.id, board.now, 1 if value else 0)
+
+    def __call__(self, value=None):
+        return self.value(value)
+
+    def on(self):
+        self.value(1)
+
+    def off(self):
+        self.value(0)
+
+    def high(self):
+        self.value(1)
+
+    def low(self):
+        self.value(0)
+
+    def toggle(self):
+        self.value(not self.value())
+
+class _Mem:
+    def __init__(self, size):
+        self.size = size
+    def __getitem__(self, addr):
+        return virtual_pico.board.mem.read(addr, self.size)
+    def __setitem__(self, addr, value):
+        virtual_pico.board.mem.write(addr, value, self.size)
+
+mem8 = _Mem(1)
+mem16 = _Mem(2)
+mem32 = _Mem(4)
+
+def freq(hz=None):
+    return 125_000_000
+
+def idle():
+    virtual_pico.board.run_us(1)
+
+def unique_id():
+    return b"\xe6\x61\x00\x00\x00\x00\x00\x01"
+
+def reset():
+    pass
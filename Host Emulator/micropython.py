@@ -0,0 +1,32 @@
+# micropython module of MicroPython for the virtual Pico, see virtual_pico.py
+# The code emitters run the functions as ordinary Python, the built-ins used by viper code are added by virtual_pico.install().
+
+import virtual_pico
+
+def viper(f):
+    return f
+
+def native(f):
+    return f
+
+def const(x):
+    return x
+
+def schedule(func, arg):
+    if not virtual_pico.board.schedule(func, arg):
+        raise RuntimeError("schedule queue full")
+
+def alloc_emergency_exception_buf(size):
+    pass
+
+def opt_level(level=None):
+    return 0 if level is None else None
+
+def mem_info(verbose=False):
+    pass
+
+def heap_lock():
+    return 0
+
+def heap_unlock():
+    return 0
@@ -0,0 +1,785 @@
+# Host-side RP2040 PIO emulator
+#
+# Runs the exact @rp2.asm_pio programs from DCC.py under CPython, instruction by instruction,
+# including delays, stalls, wrap, FIFOs and autopush/autopull, so the bit sampling and packet
+# framing can be tested and timed without a Pico.
+#
+# The assembler below mirrors MicroPython's rp2.asm_pio (v1.23) and emits the same 16-bit
+# machine code, so a program that assembles here assembles on the Pico, and the emulator
+# executes the machine code rather than the Python source.
+#
+# Time is kept in nanoseconds. A state machine only executes instructions when it can make
+# progress: "wait" on a pin and long delays are skipped straight to the next pin edge or to the
+# end of the delay, which is what makes millions of DCC bits per minute practical.
+#
+# Note: code was developed using CPython 3.11, no packages outside the standard library are needed.
+
+import bisect
+
+### Assembler
+_PROG_DATA = 0
+_PROG_OFFSET_PIO0 = 1
+_PROG_OFFSET_PIO1 = 2
+_PROG_EXECCTRL = 3
+_PROG_SHIFTCTRL = 4
+_PROG_OUT_PINS = 5
+_PROG_SET_PINS = 6
+_PROG_SIDESET_PINS = 7
+
+IN_LOW = 0
+IN_HIGH = 1
+OUT_LOW = 2
+OUT_HIGH = 3
+SHIFT_LEFT = 0
+SHIFT_RIGHT = 1
+JOIN_NONE = 0
+JOIN_TX = 1
+JOIN_RX = 2
+
+class PIOASMError(Exception):
+    pass
+
+class PIOASMEmit:
+    def __init__(self, *, out_init=None, set_init=None, sideset_init=None, side_pindir=False,
+                 in_shiftdir=0, out_shiftdir=0, autopush=False, autopull=False,
+                 push_thresh=32, pull_thresh=32, fifo_join=0):
+        self.labels = {}
+        execctrl = side_pindir << 29
+        shiftctrl = (
+            fifo_join << 30
+            | (pull_thresh & 0x1F) << 25
+            | (push_thresh & 0x1F) << 20
+            | out_shiftdir << 19
+            | in_shiftdir << 18
+            | autopull << 17
+            | autopush << 16
+        )
+        self.prog = [[], -1, -1, execctrl, shiftctrl, out_init, set_init, sideset_init]
+        self.wrap_used = False
+        if sideset_init is None:
+            self.sideset_count = 0
+        elif isinstance(sideset_init, int):
+            self.sideset_count = 1
+        else:
+            self.sideset_count = len(sideset_init)
+
+    def start_pass(self, pass_):
+        if pass_ == 1:
+            if not self.wrap_used and self.num_instr:
+                self.wrap()
+            self.delay_max = 31
+            if self.sideset_count:
+                self.sideset_opt = self.num_sideset != self.num_instr
+                if self.sideset_opt:
+                    self.prog[_PROG_EXECCTRL] |= 1 << 30
+                    self.sideset_count += 1
+                self.delay_max >>= self.sideset_count
+        self.pass_ = pass_
+        self.num_instr = 0
+        self.num_sideset = 0
+
+    def __getitem__(self, key):
+        return self.delay(key)
+
+    def delay(self, delay):
+        if self.pass_ > 0:
+            if delay > self.delay_max:
+                raise PIOASMError("delay too large")
+            self.prog[_PROG_DATA][-1] |= delay << 8
+        return self
+
+    def side(self, value):
+        self.num_sideset += 1
+        if self.pass_ > 0:
+            if self.sideset_count == 0:
+                raise PIOASMError("no sideset")
+            elif value >= (1 << self.sideset_count):
+                raise PIOASMError("sideset too large")
+            set_bit = 13 - self.sideset_count
+            self.prog[_PROG_DATA][-1] |= self.sideset_opt << 12 | value << set_bit
+        return self
+
+    def wrap_target(self):
+        self.prog[_PROG_EXECCTRL] |= self.num_instr << 7
+
+    def wrap(self):
+        assert self.num_instr
+        self.prog[_PROG_EXECCTRL] |= (self.num_instr - 1) << 12
+        self.wrap_used = True
+
+    def label(self, label):
+        if self.pass_ == 0:
+            if label in self.labels:
+                raise PIOASMError("duplicate label {}".format(label))
+            self.labels[label] = self.num_instr
+
+    def word(self, instr, label=None):
+        if self.pass_ > 0:
+            if label is None:
+                label = 0
+            else:
+                if label not in self.labels:
+                    raise PIOASMError("unknown label {}".format(label))
+                label = self.labels[label]
+            self.prog[_PROG_DATA].append(instr | label)
+        self.num_instr += 1
+        return self
+
+    def nop(self):
+        return self.word(0xA042)
+
+    def jmp(self, cond, label=None):
+        if label is None:
+            label = cond
+            cond = 0
+        return self.word(0x0000 | cond << 5, label)
+
+    def wait(self, polarity, src, index):
+        if src == 6:
+            src = 1     # "pin"
+        elif src != 2:
+            src = 0     # "gpio"
+        return self.word(0x2000 | polarity << 7 | src << 5 | index)
+
+    def in_(self, src, data):
+        if not 0 < data <= 32:
+            raise PIOASMError("invalid bit count {}".format(data))
+        return self.word(0x4000 | src << 5 | data & 0x1F)
+
+    def out(self, dest, data):
+        if dest == 8:
+            dest = 7    # exec
+        if not 0 < data <= 32:
+            raise PIOASMError("invalid bit count {}".format(data))
+        return self.word(0x6000 | dest << 5 | data & 0x1F)
+
+    def push(self, value=0, value2=0):
+        value |= value2
+        if not value & 1:
+            value |= 0x20
+        return self.word(0x8000 | (value & 0x60))
+
+    def pull(self, value=0, value2=0):
+        value |= value2
+        if not value & 1:
+            value |= 0x20
+        return self.word(0x8080 | (value & 0x60))
+
+    def mov(self, dest, src):
+        if dest == 8:
+            dest = 4    # exec
+        return self.word(0xA000 | dest << 5 | src)
+
+    def irq(self, mod, index=None):
+        if index is None:
+            index = mod
+            mod = 0
+        return self.word(0xC000 | (mod & 0x60) | index)
+
+    def set(self, dest, data):
+        return self.word(0xE000 | dest << 5 | data)
+
+_pio_funcs = {
+    "gpio": 0,
+    "pins": 0,
+    "x": 1,
+    "y": 2,
+    "null": 3,
+    "pindirs": 4,
+    "pc": 5,
+    "status": 5,
+    "isr": 6,
+    "osr": 7,
+    "exec": 8,
+    "invert": lambda x: x | 0x08,
+    "reverse": lambda x: x | 0x10,
+    "not_x": 1,
+    "x_dec": 2,
+    "not_y": 3,
+    "y_dec": 4,
+    "x_not_y": 5,
+    "pin": 6,
+    "not_osre": 7,
+    "noblock": 0x01,
+    "block": 0x21,
+    "iffull": 0x40,
+    "ifempty": 0x40,
+    "clear": 0x40,
+    "rel": lambda x: x | 0x10,
+}
+
+def asm_pio(**kw):
+    emit = PIOASMEmit(**kw)
+
+    def dec(f):
+        gl = dict(_pio_funcs)
+        gl["wrap_target"] = emit.wrap_target
+        gl["wrap"] = emit.wrap
+        gl["label"] = emit.label
+        gl["word"] = emit.word
+        gl["nop"] = emit.nop
+        gl["jmp"] = emit.jmp
+        gl["wait"] = emit.wait
+        gl["in_"] = emit.in_
+        gl["out"] = emit.out
+        gl["push"] = emit.push
+        gl["pull"] = emit.pull
+        gl["mov"] = emit.mov
+        gl["irq"] = emit.irq
+        gl["set"] = emit.set
+
+        old_gl = f.__globals__.copy()
+        f.__globals__.clear()
+        f.__globals__.update(gl)
+        try:
+            emit.start_pass(0)
+            f()
+            emit.start_pass(1)
+            f()
+        finally:
+            f.__globals__.clear()
+            f.__globals__.update(old_gl)
+        return emit.prog
+
+    return dec
+
+def assemble_exec(text):
+    # assemble one instruction given as text, as rp2.StateMachine.exec() does
+    emit = PIOASMEmit()
+    gl = dict(_pio_funcs)
+    for name in ("nop", "jmp", "wait", "in_", "out", "push", "pull", "mov", "irq", "set", "word"):
+        gl[name] = getattr(emit, name)
+    emit.start_pass(0)
+    emit.start_pass(1)
+    exec(text, gl)
+    return emit.prog[_PROG_DATA][0]
+### End Assembler
+
+### GPIO Code
+class Waveform:
+    # Input waveform of one GPIO pin, stored as the times (ns) at which the level toggles
+    def __init__(self, level=0):
+        self.level0 = level
+        self.edges = []
+
+    def append(self, t_ns, level):  # add a level change at time t_ns (must be in time order)
+        if self.level(t_ns) != level:
+            self.edges.append(t_ns)
+
+    def level(self, t_ns):
+        return (self.level0 + bisect.bisect_right(self.edges, t_ns)) & 1
+
+    def next_edge(self, t_ns, level):
+        # first time after t_ns at which the pin reads 'level', or None
+        i = bisect.bisect_right(self.edges, t_ns)
+        if (self.level0 + i) & 1 == level:
+            return t_ns
+        if i < len(self.edges):
+            return self.edges[i]
+        return None
+
+    def end(self):
+        return self.edges[-1] if self.edges else 0
+
+class GPIO:
+    # Bank of 30 GPIO pins. Inputs are driven by Waveforms, outputs are recorded as Waveforms.
+    def __init__(self):
+        self.inputs = {}
+        self.outputs = {}
+
+    def drive(self, pin, waveform):
+        self.inputs[pin] = waveform
+
+    def level(self, pin, t_ns):
+        w = self.inputs.get(pin)
+        if w is not None:
+            return w.level(t_ns)
+        w = self.outputs.get(pin)
+        return w.level(t_ns) if w is not None else 0
+
+    def next_edge(self, pin, t_ns, level):
+        w = self.inputs.get(pin)
+        if w is None:
+            return t_ns if self.level(pin, t_ns) == level else None
+        return w.next_edge(t_ns, level)
+
+    def write(self, pin, t_ns, level):
+        w = self.outputs.get(pin)
+        if w is None:
+            w = self.outputs[pin] = Waveform(0)
+        w.append(t_ns, level)
+
+def dcc_waveform(bits, t0_ns=0, one_us=58, zero_us=100, waveform=None, jitter=None):
+    # Build the waveform of a DCC bit sequence as seen by the Pico: each bit is a high half
+    # followed by a low half. 'jitter' is an optional function returning ns to add to a half-bit.
+    w = waveform if waveform is not None else Waveform(0)
+    t = t0_ns
+    for bit in bits:
+        half = (one_us if bit else zero_us) * 1000
+        high = half + (jitter() if jitter else 0)
+        low = half + (jitter() if jitter else 0)
+        w.append(t, 1)
+        t += high
+        w.append(t, 0)
+        t += low
+    return w, t
+
+def packet_bits(packet, preamble=14):
+    # DCC bit sequence of one packet: preamble ones, then each byte preceded by a 0 start bit,
+    # then the packet end bit. The packet bytes must already include the error detection byte.
+    bits = [1] * preamble
+    for byte in packet:
+        bits.append(0)
+        for i in range(7, -1, -1):
+            bits.append((byte >> i) & 1)
+    bits.append(1)
+    return bits
+
+def with_checksum(packet):
+    x = 0
+    for byte in packet:
+        x ^= byte
+    return bytes(packet) + bytes([x])
+### End GPIO Code
+
+### State Machine Code
+_MASK32 = 0xFFFFFFFF
+
+class PIOStall(Exception):
+    pass
+
+class StateMachine:
+    # One PIO state machine. 'pio' is the owning PIO block (shared IRQ flags and GPIO bank).
+    def __init__(self, pio, index, prog, freq=125_000_000, in_base=None, out_base=None,
+                 set_base=None, jmp_pin=None, sideset_base=None):
+        self.pio = pio
+        self.index = index
+        self.gpio = pio.gpio
+        self.freq = freq
+        self.cycle_ns = 1_000_000_000 // freq
+        self.code = list(prog[_PROG_DATA])
+        if len(self.code) > 32:
+            raise PIOASMError("program too large ({} instructions)".format(len(self.code)))
+        execctrl = prog[_PROG_EXECCTRL]
+        shiftctrl = prog[_PROG_SHIFTCTRL]
+        self.wrap_target = (execctrl >> 7) & 0x1F
+        self.wrap = (execctrl >> 12) & 0x1F
+        self.side_en = (execctrl >> 30) & 1
+        self.side_pindir = (execctrl >> 29) & 1
+        sideset_init = prog[_PROG_SIDESET_PINS]
+        if sideset_init is None:
+            self.sideset_count = 0
+        elif isinstance(sideset_init, int):
+            self.sideset_count = 1
+        else:
+            self.sideset_count = len(sideset_init)
+        self.sideset_count += self.side_en
+        self.fifo_join = (shiftctrl >> 30) & 3
+        self.pull_thresh = ((shiftctrl >> 25) & 0x1F) or 32
+        self.push_thresh = ((shiftctrl >> 20) & 0x1F) or 32
+        self.out_shiftdir = (shiftctrl >> 19) & 1
+        self.in_shiftdir = (shiftctrl >> 18) & 1
+        self.autopull = (shiftctrl >> 17) & 1
+        self.autopush = (shiftctrl >> 16) & 1
+        self.in_base = in_base
+        self.out_base = out_base
+        self.set_base = set_base
+        self.jmp_pin = jmp_pin
+        self.sideset_base = sideset_base
+        self.tx_depth = 8 if self.fifo_join == JOIN_TX else (0 if self.fifo_join == JOIN_RX else 4)
+        self.rx_depth = 8 if self.fifo_join == JOIN_RX else (0 if self.fifo_join == JOIN_TX else 4)
+        self.decoded = [self._decode(w) for w in self.code]
+        self.time = 0       # ns
+        self.running = False
+        self.on_push = None     # called with the SM when a word enters the RX FIFO
+        self.on_pull = None     # called with the SM when a word leaves the TX FIFO
+        self.restart()
+
+    def restart(self):
+        self.pc = 0
+        self.x = 0
+        self.y = 0
+        self.isr = 0
+        self.isr_count = 0
+        self.osr = 0
+        self.osr_count = 32     # OSR starts empty
+        self.tx = []
+        self.rx = []
+        self.delay_left = 0
+        self.exec_instr = None
+        self.irq_waiting = False
+        self.instructions = 0   # executed instruction count (stalls excluded)
+        self.stall_cycles = 0
+
+    def active(self, value=None):
+        if value is not None:
+            self.running = bool(value)
+        return self.running
+
+    # FIFO access from the system side
+    def put(self, value):
+        if len(self.tx) >= self.tx_depth:
+            raise PIOStall("TX FIFO full")
+        self.tx.append(value & _MASK32)
+
+    def tx_full(self):
+        return len(self.tx) >= self.tx_depth
+
+    def get(self):
+        return self.rx.pop(0)
+
+    def rx_fifo(self):
+        return len(self.rx)
+
+    def tx_fifo(self):
+        return len(self.tx)
+
+    def exec(self, instr):
+        if isinstance(instr, str):
+            instr = assemble_exec(instr)
+        self.exec_instr = self._decode(instr)
+        self._step()
+
+    def _decode(self, w):
+        opcode = (w >> 13) & 7
+        delay_side = (w >> 8) & 0x1F
+        side = None
+        delay = delay_side
+        if self.sideset_count:
+            delay = delay_side & ((1 << (5 - self.sideset_count)) - 1)
+            side_bits = delay_side >> (5 - self.sideset_count)
+            if self.side_en:
+                if side_bits & (1 << (self.sideset_count - 1)):
+                    side = side_bits & ((1 << (self.sideset_count - 1)) - 1)
+            else:
+                side = side_bits
+        return (opcode, (w >> 5) & 7, w & 0x1F, delay, side, w)
+
+    def _pin(self, pin):
+        return self.gpio.level(pin, self.time)
+
+    def _pins_in(self):
+        v = 0
+        base = self.in_base or 0
+        for i in range(32):
+            v |= self.gpio.level((base + i) % 32, self.time) << i
+        return v
+
+    def _write_pins(self, base, count, value):
+        for i in range(count):
+            self.gpio.write(base + i, self.time, (value >> i) & 1)
+
+    def _push(self, value):
+        self.rx.append(value & _MASK32)
+        if self.on_push:
+            self.on_push(self)
+
+    def _pop(self):
+        value = self.tx.pop(0)
+        if self.on_pull:
+            self.on_pull(self)
+        return value
+
+    def _shift_in(self, value, n):
+        mask = _MASK32 if n == 32 else (1 << n) - 1
+        value &= mask
+        if self.in_shiftdir:
+            self.isr = ((self.isr >> n) | (value << (32 - n))) & _MASK32 if n < 32 else value
+        else:
+            self.isr = ((self.isr << n) | value) & _MASK32 if n < 32 else value
+        self.isr_count = min(32, self.isr_count + n)
+
+    def _shift_out(self, n):
+        if n == 32:
+            value = self.osr
+            self.osr = 0
+        elif self.out_shiftdir:
+            value = self.osr & ((1 << n) - 1)
+            self.osr = self.osr >> n
+        else:
+            value = self.osr >> (32 - n)
+            self.osr = (self.osr << n) & _MASK32
+        self.osr_count = min(32, self.osr_count + n)
+        return value
+
+    def _autopull_refill(self):
+        # the OSR refills in the background as soon as it is empty and the TX FIFO has data
+        if self.autopull and self.osr_count >= self.pull_thresh and self.tx:
+            self.osr = self._pop()
+            self.osr_count = 0
+
+    def _step(self):
+        # execute (or stall on) one instruction; returns False if stalled
+        if self.exec_instr is not None:
+            ins = self.exec_instr
+            from_exec = True
+        else:
+            ins = self.decoded[self.pc]
+            from_exec = False
+        opcode, a, b, delay, side, w = ins
+        next_pc = self.pc if from_exec else (self.wrap_target if self.pc == self.wrap else (self.pc + 1) & 0x1F)
+        t = self.time
+
+        if opcode == 0:     # JMP
+            cond = a
+            if cond == 0:
+                take = True
+            elif cond == 1:
+                take = self.x == 0
+            elif cond == 2:
+                take = self.x != 0
+                self.x = (self.x - 1) & _MASK32
+            elif cond == 3:
+                take = self.y == 0
+            elif cond == 4:
+                take = self.y != 0
+                self.y = (self.y - 1) & _MASK32
+            elif cond == 5:
+                take = self.x != self.y
+            elif cond == 6:
+                take = self._pin(self.jmp_pin) == 1
+            else:
+                take = self.osr_count < self.pull_thresh
+            if take:
+                next_pc = b
+
+        elif opcode == 1:   # WAIT
+            polarity = (w >> 7) & 1
+            src = a & 3
+            index = b
+            if src == 0:
+                ok = self._pin(index) == polarity
+            elif src == 1:
+                ok = self._pin((self.in_base + index) % 32) == polarity
+            else:
+                flag = self._irq_index(index)
+                ok = self.pio.irq_flags[flag] == polarity
+                if ok and polarity:
+                    self.pio.irq_flags[flag] = 0
+            if not ok:
+                return False
+
+        elif opcode == 2:   # IN
+            n = b or 32
+            if self.autopush and self.isr_count + n >= self.push_thresh and len(self.rx) >= self.rx_depth:
+                return False
+            src = a
+            if src == 0:
+                value = self._pins_in()
+            elif src == 1:
+                value = self.x
+            elif src == 2:
+                value = self.y
+            elif src == 3:
+                value = 0
+            elif src == 6:
+                value = self.isr
+            elif src == 7:
+                value = self.osr
+            else:
+                raise PIOASMError("reserved IN source")
+            self._shift_in(value, n)
+            if self.autopush and self.isr_count >= self.push_thresh:
+                self._push(self.isr)
+                self.isr = 0
+                self.isr_count = 0
+
+        elif opcode == 3:   # OUT
+            n = b or 32
+            if self.autopull and self.osr_count >= self.pull_thresh:
+                if not self.tx:
+                    return False
+                self.osr = self._pop()
+                self.osr_count = 0
+            value = self._shift_out(n)
+            dest = a
+            if dest == 0:
+                self._write_pins(self.out_base, n, value)
+            elif dest == 1:
+                self.x = value
+            elif dest == 2:
+                self.y = value
+            elif dest == 3:
+                pass
+            elif dest == 4:
+                pass    # pindirs are not modelled
+            elif dest == 5:
+                next_pc = value & 0x1F
+            elif dest == 6:
+                self.isr = value
+                self.isr_count = n
+            else:
+                self.exec_instr = self._decode(value)
+            self._autopull_refill()
+
+        elif opcode == 4:   # PUSH / PULL
+            is_pull = (w >> 7) & 1
+            if_flag = (w >> 6) & 1
+            block = (w >> 5) & 1
+            if not is_pull:
+                if if_flag and self.isr_count < self.push_thresh:
+                    pass
+                elif len(self.rx) >= self.rx_depth:
+                    if block:
+                        return False
+                    self.isr = 0
+                    self.isr_count = 0
+                else:
+                    self._push(self.isr)
+                    self.isr = 0
+                    self.isr_count = 0
+            else:
+                if (if_flag or self.autopull) and self.osr_count < self.pull_thresh:
+                    pass
+                elif not self.tx:
+                    if block:
+                        return False
+                    self.osr = self.x
+                    self.osr_count = 0
+                else:
+                    self.osr = self._pop()
+                    self.osr_count = 0
+
+        elif opcode == 5:   # MOV
+            dest = a
+            op = (b >> 3) & 3
+            src = b & 7
+            if src == 0:
+                value = self._pins_in()
+            elif src == 1:
+                value = self.x
+            elif src == 2:
+                value = self.y
+            elif src == 3:
+                value = 0
+            elif src == 5:
+                value = _MASK32 if len(self.tx) < 1 else 0    # STATUS, default config: TX level < 1
+            elif src == 6:
+                value = self.isr
+            elif src == 7:
+                value = self.osr
+            else:
+                raise PIOASMError("reserved MOV source")
+            if op == 1:
+                value = ~value & _MASK32
+            elif op == 2:
+                value = int("{:032b}".format(value)[::-1], 2)
+            if dest == 0:
+                self._write_pins(self.out_base, 32, value)
+            elif dest == 1:
+                self.x = value
+            elif dest == 2:
+                self.y = value
+            elif dest == 4:
+                self.exec_instr = self._decode(value)
+            elif dest == 5:
+                next_pc = value & 0x1F
+            elif dest == 6:
+                self.isr = value
+                self.isr_count = 0
+            elif dest == 7:
+                self.osr = value
+                self.osr_count = 0
+
+        elif opcode == 6:   # IRQ
+            clear = (w >> 6) & 1
+            wait_ = (w >> 5) & 1
+            flag = self._irq_index(b)
+            if clear:
+                self.pio.irq_flags[flag] = 0
+            elif not wait_:
+                self.pio.raise_irq(flag, self)
+            else:
+                if not self.irq_waiting:
+                    self.pio.raise_irq(flag, self)
+                    self.irq_waiting = True
+                if self.pio.irq_flags[flag]:
+                    return False
+                self.irq_waiting = False
+
+        else:               # SET
+            dest = a
+            if dest == 0:
+                self._write_pins(self.set_base, 5, b)
+            elif dest == 1:
+                self.x = b
+            elif dest == 2:
+                self.y = b
+            # pindirs are not modelled
+
+        if side is not None and self.sideset_base is not None:
+            self._write_pins(self.sideset_base, self.sideset_count - self.side_en, side)
+
+        if from_exec and self.exec_instr is ins:
+            self.exec_instr = None
+        elif not from_exec:
+            self.pc = next_pc
+        self.delay_left = delay
+        self.instructions += 1
+        return True
+
+    def _irq_index(self, index):
+        if index & 0x10:
+            return (index & 4) | ((index + self.index) & 3)
+        return index & 7
+
+    def _stall_until(self, limit):
+        # fast-forward a stalled WAIT to the pin edge it is waiting for
+        ins = self.exec_instr or self.decoded[self.pc]
+        opcode, a, b, delay, side, w = ins
+        if opcode == 1 and (a & 3) != 2:
+            polarity = (w >> 7) & 1
+            pin = b if (a & 3) == 0 else (self.in_base + b) % 32
+            t = self.gpio.next_edge(pin, self.time, polarity)
+            if t is None or t > limit:
+                return limit
+            # PIO samples on clock edges: round up to the next cycle of this state machine
+            return max(self.time + self.cycle_ns, t + (-(t - self.time)) % self.cycle_ns)
+        return limit
+
+    def run_until(self, t_ns):
+        # execute until time t_ns, or until stalled on a FIFO (time then jumps to t_ns)
+        cycle = self.cycle_ns
+        while self.running and self.time < t_ns:
+            if self.delay_left:
+                skip = min(self.delay_left, -(-(t_ns - self.time) // cycle))
+                self.delay_left -= skip
+                self.time += skip * cycle
+                continue
+            if self._step():
+                self.time += cycle
+            else:
+                t = self._stall_until(t_ns)
+                stalled = max(cycle, t - self.time)
+                self.stall_cycles += stalled // cycle
+                self.time += stalled
+        if self.time < t_ns:
+            self.time = t_ns
+        return self.time
+
+class PIO:
+    # One PIO block: four state machines sharing 32 instruction slots and 8 IRQ flags
+    def __init__(self, index=0, gpio=None):
+        self.index = index
+        self.gpio = gpio if gpio is not None else GPIO()
+        self.irq_flags = [0] * 8
+        self.irq_handlers = {}
+        self.sms = {}
+        self.programs = []      # programs loaded into instruction memory
+
+    def state_machine(self, index, prog, **kw):
+        if prog not in self.programs:
+            used = sum(len(p[_PROG_DATA]) for p in self.programs)
+            if used + len(prog[_PROG_DATA]) > 32:
+                raise OSError("PIO{} instruction memory full".format(self.index))
+            self.programs.append(prog)
+        sm = StateMachine(self, index, prog, **kw)
+        self.sms[index] = sm
+        return sm
+
+    def raise_irq(self, flag, sm):
+        self.irq_flags[flag] = 1
+        handler = self.irq_handlers.get(flag)
+        if handler is not None:
+            handler(flag, sm)
+### End State Machine Code
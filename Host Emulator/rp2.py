@@ -0,0 +1,211 @@
+# rp2 module of MicroPython for the virtual Pico, see virtual_pico.py
+# StateMachine and PIO run on pio_emu.py, DMA on the DMA channels of the virtual board.
+
+import pio_emu
+import virtual_pico
+
+asm_pio = pio_emu.asm_pio
+PIOASMError = pio_emu.PIOASMError
+
+def _pin(pin):  # accept a machine.Pin or a GPIO number
+    return pin if pin is None or isinstance(pin, int) else pin.id
+
+### PIO Code
+class PIO:
+    IN_LOW = pio_emu.IN_LOW
+    IN_HIGH = pio_emu.IN_HIGH
+    OUT_LOW = pio_emu.OUT_LOW
+    OUT_HIGH = pio_emu.OUT_HIGH
+    SHIFT_LEFT = pio_emu.SHIFT_LEFT
+    SHIFT_RIGHT = pio_emu.SHIFT_RIGHT
+    JOIN_NONE = pio_emu.JOIN_NONE
+    JOIN_TX = pio_emu.JOIN_TX
+    JOIN_RX = pio_emu.JOIN_RX
+    IRQ_SM0 = 0x100
+    IRQ_SM1 = 0x200
+    IRQ_SM2 = 0x400
+    IRQ_SM3 = 0x800
+
+    def __init__(self, id):
+        self.id = id
+
+    def state_machine(self, id, prog=None, **kw):
+        return StateMachine(self.id * 4 + id, prog, **kw)
+
+    def add_program(self, prog):
+        pass
+
+    def remove_program(self, prog=None):
+        pio = virtual_pico.board.pio[self.id]
+        if prog is None:
+            pio.programs.clear()
+        elif prog in pio.programs:
+            pio.programs.remove(prog)
+
+    def irq(self, handler=None, trigger=0xF00, hard=False):
+        pio = virtual_pico.board.pio[self.id]
+        for flag in range(4):
+            if trigger & (0x100 << flag):
+                if handler is None:
+                    pio.irq_handlers.pop(flag, None)
+                else:
+                    pio.irq_handlers[flag] = lambda flag, sm, h=handler: virtual_pico.board.interrupt(h, self, hard)
+### End PIO Code
+
+### State Machine Code
+class StateMachine:
+    _sms = {}   # the same id gives the same state machine, as on the Pico
+
+    def __new__(cls, id, prog=None, **kw):
+        sm = cls._sms.get((id, virtual_pico.board))
+        if sm is None:
+            sm = object.__new__(cls)
+            sm.id = id
+            sm.sm = None
+            cls._sms[(id, virtual_pico.board)] = sm
+        return sm
+
+    def __init__(self, id, prog=None, **kw):
+        if prog is not None:
+            self.init(prog, **kw)
+
+    def init(self, prog, freq=125_000_000, *, in_base=None, out_base=None, set_base=None, jmp_pin=None,
+             sideset_base=None, **kw):
+        pins = dict(in_base=_pin(in_base), out_base=_pin(out_base), set_base=_pin(set_base),
+                    jmp_pin=_pin(jmp_pin), sideset_base=_pin(sideset_base))
+        self.sm = virtual_pico.board.state_machine(self.id, prog, freq=freq, **pins)
+
+    def active(self, value=None):
+        running = self.sm.active(value)
+        if value:   # a DMA channel waiting on the DREQ of this state machine fills the TX FIFO at once, as on the Pico
+            virtual_pico.board.dma.service()
+        return int(running)
+
+    def restart(self):
+        self.sm.restart()
+
+    def exec(self, instr):
+        self.sm.exec(instr)
+
+    def put(self, value, shift=0):  # blocks while the TX FIFO is full, the board runs until there is space
+        board = virtual_pico.board
+        values = value if isinstance(value, (list, tuple, bytes, bytearray)) or hasattr(value, "typecode") else [value]
+        for v in values:
+            while self.sm.tx_full():
+                board.run_us(1)
+            self.sm.put(v << shift)
+
+    def get(self, buf=None, shift=0):   # blocks while the RX FIFO is empty, the board runs until there is a word
+        board = virtual_pico.board
+        n = 1 if buf is None else len(buf)
+        for i in range(n):
+            while not self.sm.rx:
+                board.run_us(1)
+            value = self.sm.get() >> shift
+            if buf is None:
+                return value
+            buf[i] = value
+
+    def rx_fifo(self):
+        return self.sm.rx_fifo()
+
+    def tx_fifo(self):
+        return self.sm.tx_fifo()
+
+    def irq(self, handler=None, trigger=0, hard=False):
+        PIO(self.id >> 2).irq(handler, 0x100 << (self.id & 3), hard)
+### End State Machine Code
+
+### DMA Code
+class DMA:
+    def __init__(self):
+        self._ch = virtual_pico.board.dma.claim()
+        self._ch.owner = self
+
+    @property
+    def channel(self):
+        return self._ch.index
+
+    @property
+    def registers(self):
+        return virtual_pico.ptr32(virtual_pico.DMA_BASE + 0x40 * self.channel)
+
+    def _address(self, value):  # buffers and state machines are accepted as addresses, as on the Pico
+        if value is None or isinstance(value, int):
+            return value
+        return virtual_pico.board.mem.addressof(value)
+
+    @property
+    def read(self):
+        return self._ch.read_addr
+
+    @read.setter
+    def read(self, value):
+        self._ch.read_addr = self._address(value)
+
+    @property
+    def write(self):
+        return self._ch.write_addr
+
+    @write.setter
+    def write(self, value):
+        self._ch.write_addr = self._address(value)
+
+    @property
+    def count(self):
+        return virtual_pico.board.dma.read_register(0x40 * self.channel + 0x08)
+
+    @count.setter
+    def count(self, value):
+        self._ch.reload = value
+
+    @property
+    def ctrl(self):
+        return virtual_pico.board.dma.read_register(0x40 * self.channel + 0x0C)
+
+    @ctrl.setter
+    def ctrl(self, value):
+        self._ch.ctrl = value & ~(1 << 24)
+
+    def config(self, read=None, write=None, count=None, ctrl=None, trigger=False):
+        for name, value in (("read", read), ("write", write)):
+            if isinstance(value, StateMachine):
+                pio = value.id >> 2
+                offset = (0x20 if name == "read" else 0x10) + 4 * (value.id & 3)
+                value = virtual_pico.PIO_BASE[pio] + offset
+            if value is not None:
+                setattr(self, name, value)
+        if count is not None:
+            self._ch.reload = count
+        if ctrl is not None:
+            self._ch.ctrl = ctrl & ~(1 << 24)
+        if trigger:
+            virtual_pico.board.dma.trigger(self._ch)
+
+    def active(self, value=None):
+        if value is not None:
+            if value:
+                virtual_pico.board.dma.trigger(self._ch)
+            else:
+                self._ch.busy = False
+        return int(self._ch.busy)
+
+    def irq(self, handler=None, hard=False):
+        self._ch.handler = handler
+        self._ch.hard = hard
+
+    def close(self):
+        self._ch.handler = None
+        self._ch.busy = False
+        self._ch.claimed = False
+
+    def pack_ctrl(self, default=None, **kw):
+        if default is None:     # enable, 32 bit transfers, increment both addresses, chain to itself, permanent DREQ, quiet
+            default = virtual_pico.pack_ctrl(0, dict(enable=1, size=2, inc_read=1, inc_write=1, chain_to=self.channel,
+                                                     treq_sel=virtual_pico.DREQ_PERMANENT, irq_quiet=1))
+        return virtual_pico.pack_ctrl(default, kw)
+
+    @staticmethod
+    def unpack_ctrl(value):
+        return virtual_pico.unpack_ctrl(value)
+### End DMA Code
@@ -0,0 +1,9 @@
+# uctypes module of MicroPython for the virtual Pico, see virtual_pico.py
+
+import virtual_pico
+
+def addressof(obj):
+    return virtual_pico.board.mem.addressof(obj)
+
+def bytearray_at(addr, size):
+    return virtual_pico.board.mem.bytearray_at(addr, size)
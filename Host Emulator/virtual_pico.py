@@ -0,0 +1,527 @@
+# Virtual Pico
+#
+# A CPython stand-in for the parts of an RP2040 running MicroPython that DCC.py uses, so DCC.py runs
+# unmodified on a computer. rp2.py, uctypes.py, micropython.py and machine.py in this folder are the
+# module stand-ins, and this file is the board behind them:
+#   - PIO0 and PIO1 from pio_emu.py, sharing one GPIO bank that is driven by synthetic waveforms
+#   - 12 DMA channels with DREQ pacing, chaining, ring wrap and completion interrupts
+#   - memory addresses for buffers (uctypes.addressof), DMA registers, PIO FIFOs and the microsecond timer
+#   - the MicroPython scheduler (8 entries), which runs soft interrupts and micropython.schedule() callbacks
+#   - virtual time, which also drives time.ticks_us() and time.sleep() after install()
+#
+# Usage:
+#   import virtual_pico
+#   board = virtual_pico.install()
+#   import DCC
+#   DCC.pin_addr(16, 3)
+#   board.send_dcc(16, [[3, 0x91]])   # packets without the error detection byte
+#   board.run_ms(20)
+#
+# Note: code was developed using CPython 3.11, no packages outside the standard library are needed.
+
+import builtins
+import os
+import sys
+import time as _time
+import types
+
+import pio_emu
+
+_MASK32 = 0xFFFFFFFF
+RAM_BASE = 0x20000000
+DMA_BASE = 0x50000000
+PIO_BASE = (0x50200000, 0x50300000)
+TIMER_BASE = 0x40054000
+SYST_CSR = 0xE000E010   # SysTick control, reload and current value registers of the Cortex-M0+
+DREQ_PERMANENT = 0x3F
+SCHED_DEPTH = 8         # MICROPY_SCHEDULER_DEPTH of the rp2 port
+TICKS_PERIOD = 1 << 30  # time.ticks_us() and time.ticks_ms() wrap at 2**30 on the rp2 port
+
+### Memory Code
+class Memory:
+    # Buffers get an address when uctypes.addressof() first sees them, peripheral registers are forwarded to the board
+    def __init__(self, board):
+        self.board = board
+        self.regions = []   # (address, size, byte view, buffer)
+        self.by_id = {}
+        self.next = RAM_BASE
+
+    def addressof(self, obj):
+        region = self.by_id.get(id(obj))
+        if region is None:
+            view = memoryview(obj).cast("B")
+            region = (self.next, view.nbytes, view, obj)   # the buffer is kept, so its id() stays unique
+            self.by_id[id(obj)] = region
+            self.regions.append(region)
+            self.next = (self.next + view.nbytes + 64 + 7) & ~7  # leave a gap, so a buffer overrun does not land in the next buffer
+        return region[0]
+
+    def _ram(self, addr, size):
+        for base, length, view, obj in self.regions:
+            if base <= addr and addr + size <= base + length:
+                return view, addr - base
+        raise MemoryError("no buffer at address 0x{:08x}".format(addr))
+
+    def read(self, addr, size=4):
+        addr &= _MASK32
+        if addr >= 0x40000000:
+            return self.board.read_register(addr)
+        view, offset = self._ram(addr, size)
+        return int.from_bytes(view[offset:offset + size], "little")
+
+    def write(self, addr, value, size=4):
+        addr &= _MASK32
+        if addr >= 0x40000000:
+            self.board.write_register(addr, value & _MASK32)
+            return
+        view, offset = self._ram(addr, size)
+        view[offset:offset + size] = (value & ((1 << (8 * size)) - 1)).to_bytes(size, "little")
+
+    def view_at(self, addr, size):  # the bytes of a buffer from addr to its end, in whole items of size bytes
+        view, offset = self._ram(addr & _MASK32, size)
+        return view[offset:offset + (len(view) - offset) // size * size]
+
+    def bytearray_at(self, addr, size):
+        view, offset = self._ram(addr, size)
+        return view[offset:offset + size]
+
+class Ptr:
+    # viper ptr8/ptr16/ptr32 of a buffer, values wrap to the pointer size as they do in viper
+    __slots__ = ("view", "mask")
+    def __init__(self, obj, code, mask):
+        self.view = memoryview(obj).cast("B").cast(code)
+        self.mask = mask
+    def __getitem__(self, i):
+        return self.view[i]
+    def __setitem__(self, i, value):
+        self.view[i] = value & self.mask
+
+class MemPtr:
+    # viper ptr32 of an integer address of a peripheral, such as a DMA register
+    __slots__ = ("addr", "size")
+    def __init__(self, addr, size):
+        self.addr = addr & _MASK32
+        self.size = size
+    def __getitem__(self, i):
+        return board.mem.read(self.addr + i * self.size, self.size)
+    def __setitem__(self, i, value):
+        board.mem.write(self.addr + i * self.size, value, self.size)
+
+def _ptr(code, size, mask):
+    def ptr(obj):
+        if isinstance(obj, int):
+            if (obj & _MASK32) < 0x40000000:    # a buffer is read directly, as the Pico reads RAM
+                return Ptr(board.mem.view_at(obj, size), code, mask)
+            return MemPtr(obj, size)
+        return Ptr(obj, code, mask)
+    return ptr
+
+ptr8 = _ptr("B", 1, 0xFF)
+ptr16 = _ptr("H", 2, 0xFFFF)
+ptr32 = _ptr("I", 4, _MASK32)
+
+def uint(value):
+    return int(value) & _MASK32
+### End Memory Code
+
+### DMA Code
+def pack_ctrl(default, kw):
+    fields = {
+        "enable": (0, 1), "high_pri": (1, 1), "size": (2, 2), "inc_read": (4, 1), "inc_write": (5, 1),
+        "ring_size": (6, 4), "ring_sel": (10, 1), "chain_to": (11, 4), "treq_sel": (15, 6), "irq_quiet": (21, 1),
+        "bswap": (22, 1), "sniff_en": (23, 1), "busy": (24, 1), "write_err": (29, 1), "read_err": (30, 1), "ahb_err": (31, 1),
+    }
+    value = default
+    for name, v in kw.items():
+        if name not in fields:
+            raise TypeError("unknown DMA control field '{}'".format(name))
+        shift, width = fields[name]
+        mask = ((1 << width) - 1) << shift
+        value = (value & ~mask) | ((int(v) << shift) & mask)
+    return value
+
+def unpack_ctrl(value):
+    return {
+        "enable": value & 1, "high_pri": value >> 1 & 1, "size": value >> 2 & 3, "inc_read": value >> 4 & 1,
+        "inc_write": value >> 5 & 1, "ring_size": value >> 6 & 15, "ring_sel": value >> 10 & 1, "chain_to": value >> 11 & 15,
+        "treq_sel": value >> 15 & 0x3F, "irq_quiet": value >> 21 & 1, "bswap": value >> 22 & 1, "sniff_en": value >> 23 & 1,
+        "busy": value >> 24 & 1, "write_err": value >> 29 & 1, "read_err": value >> 30 & 1, "ahb_err": value >> 31 & 1,
+    }
+
+class DMAChannel:
+    def __init__(self, index):
+        self.index = index
+        self.claimed = False
+        self.read_addr = 0
+        self.write_addr = 0
+        self.reload = 0     # TRANS_COUNT as written
+        self.remaining = 0  # TRANS_COUNT as read while the channel runs
+        self.ctrl = 0
+        self.busy = False
+        self.order = 0      # when the channel was triggered, see DMA.service()
+        self.handler = None
+        self.hard = False
+        self.owner = None   # the rp2.DMA object, passed to the interrupt handler
+        self.transfers = 0
+
+class DMA:
+    # When several busy channels wait on the same DREQ, the channel triggered first is served first.
+    # This keeps the ping-pong pairs of DCC.py (dma0/dma1 and dma2/dma3) in order.
+    def __init__(self, board):
+        self.board = board
+        self.channels = [DMAChannel(i) for i in range(12)]
+        self.triggers = 0
+        self.servicing = False
+        self.again = False
+
+    def claim(self):
+        for ch in self.channels:
+            if not ch.claimed:
+                ch.claimed = True
+                return ch
+        raise OSError("no free DMA channel")
+
+    def trigger(self, ch):
+        if ch.busy or not ch.ctrl & 1:     # a busy or disabled channel ignores the trigger
+            return
+        ch.remaining = ch.reload
+        if ch.remaining == 0:
+            return
+        ch.busy = True
+        self.triggers += 1
+        ch.order = self.triggers
+        self.service()
+
+    def ready(self, ch):
+        treq = ch.ctrl >> 15 & 0x3F
+        if treq == DREQ_PERMANENT:
+            return True
+        if treq < 16:
+            sm = self.board.pio[treq >> 3].sms.get(treq & 3)
+            if sm is None or not sm.running:
+                return False
+            if treq & 4:
+                return len(sm.rx) > 0
+            return len(sm.tx) < sm.tx_depth
+        return False    # DREQs of other peripherals are not modelled
+
+    def service(self):
+        if self.servicing:  # called again from a transfer, the loop below picks up the change
+            self.again = True
+            return
+        self.servicing = True
+        try:
+            while True:
+                self.again = False
+                busy = sorted((ch for ch in self.channels if ch.busy), key=lambda ch: ch.order)
+                ch = next((ch for ch in busy if self.ready(ch)), None)
+                if ch is None:
+                    if not self.again:
+                        return
+                    continue
+                self.transfer(ch)
+        finally:
+            self.servicing = False
+
+    def transfer(self, ch):
+        ctrl = ch.ctrl
+        size = 1 << (ctrl >> 2 & 3)
+        value = self.board.mem.read(ch.read_addr, size)
+        if ctrl >> 22 & 1 and size > 1:     # bswap
+            value = int.from_bytes(value.to_bytes(size, "little"), "big")
+        self.board.mem.write(ch.write_addr, value, size)
+        ring = ctrl >> 6 & 15
+        ring_mask = (1 << ring) - 1 if ring else 0
+        if ctrl >> 4 & 1:
+            ch.read_addr = self._step(ch.read_addr, size, ring_mask if not ctrl >> 10 & 1 else 0)
+        if ctrl >> 5 & 1:
+            ch.write_addr = self._step(ch.write_addr, size, ring_mask if ctrl >> 10 & 1 else 0)
+        ch.remaining -= 1
+        ch.transfers += 1
+        if ch.remaining == 0:
+            self.complete(ch)
+
+    def _step(self, addr, size, ring_mask):
+        if ring_mask:   # the address wraps inside an aligned block of 2**ring_size bytes
+            return (addr & ~ring_mask) | ((addr + size) & ring_mask)
+        return (addr + size) & _MASK32
+
+    def complete(self, ch):
+        ch.busy = False
+        if not ch.ctrl >> 21 & 1 and ch.handler is not None:
+            self.board.interrupt(ch.handler, ch.owner, ch.hard)
+        chain = ch.ctrl >> 11 & 15
+        if chain != ch.index:
+            self.trigger(self.channels[chain])
+
+    def read_register(self, offset):
+        ch = self.channels[offset >> 6]
+        reg = offset & 0x3F
+        if reg == 0x00:
+            return ch.read_addr
+        if reg == 0x04:
+            return ch.write_addr
+        if reg == 0x08:
+            return ch.remaining if ch.busy else ch.reload
+        if reg == 0x0C:
+            return ch.ctrl | (ch.busy << 24)
+        return 0
+
+    def write_register(self, offset, value):
+        ch = self.channels[offset >> 6]
+        reg = offset & 0x3F
+        if reg == 0x00:
+            ch.read_addr = value
+        elif reg == 0x04:
+            ch.write_addr = value
+        elif reg == 0x08:
+            ch.reload = value
+        elif reg == 0x0C:   # CTRL_TRIG, writing it triggers the channel
+            ch.ctrl = value & ~(1 << 24)
+            self.trigger(ch)
+        elif reg == 0x10:   # AL1_CTRL, no trigger
+            ch.ctrl = value & ~(1 << 24)
+### End DMA Code
+
+### Board Code
+class Board:
+    def __init__(self, sched_us=100):
+        self.gpio = pio_emu.GPIO()
+        self.pio = [pio_emu.PIO(0, self.gpio), pio_emu.PIO(1, self.gpio)]
+        self.mem = Memory(self)
+        self.dma = DMA(self)
+        self.time_ns = 0        # the board has run up to this time
+        self.now = 0            # time of the event being handled, used by the timer and the interrupts
+        self.sched_ns = sched_us * 1000     # the scheduler runs at least this often
+        self.queue = []
+        self.stats = {"hard_irqs": 0, "soft_irqs": 0, "soft_irqs_lost": 0, "scheduled": 0,
+                      "max_queue": 0, "max_latency_us": 0, "handler_s": 0.0}
+        self.packet_ends = []   # time the end bit of each packet from send_dcc() is complete
+        self.systick = [0, 0xFFFFFF, 0]     # control, reload value, host time in ns when the current value was cleared
+
+    # State machines
+    def state_machine(self, id, prog, **kw):
+        pio = self.pio[id >> 2]
+        old = pio.sms.get(id & 3)
+        if old is not None and old.prog is not prog and all(sm.prog is not old.prog for i, sm in pio.sms.items() if i != id & 3):
+            pio.programs.remove(old.prog)   # the program is no longer used by any state machine
+        sm = pio.state_machine(id & 3, prog, **kw)
+        sm.prog = prog
+        sm.time = self.time_ns
+        sm.on_push = self._fifo_event
+        sm.on_pull = self._fifo_event
+        return sm
+
+    def _fifo_event(self, sm):
+        self.now = sm.time
+        self.dma.service()
+
+    def _catch_up(self, sm):     # run a state machine up to the current event before the system touches its FIFOs
+        if sm.running and sm.time < self.now:
+            sm.run_until(self.now)
+
+    # Registers
+    def read_register(self, addr):
+        for p, base in enumerate(PIO_BASE):
+            if base <= addr < base + 0x144:
+                return self._pio_read(self.pio[p], addr - base)
+        if DMA_BASE <= addr < DMA_BASE + 0x300:
+            return self.dma.read_register(addr - DMA_BASE)
+        if addr == TIMER_BASE + 0x28:   # TIMERAWL
+            return (self.now // 1000) & _MASK32
+        if addr == TIMER_BASE + 0x24:   # TIMERAWH
+            return (self.now // 1000) >> 32
+        if addr == SYST_CSR:
+            return self.systick[0]
+        if addr == SYST_CSR + 4:
+            return self.systick[1]
+        if addr == SYST_CSR + 8:        # SysTick counts down at 125 MHz of host time, so it measures the host cost of Python code
+            if not self.systick[0] & 1:
+                return 0
+            cycles = (_time.perf_counter_ns() - self.systick[2]) * 125 // 1000
+            return self.systick[1] - cycles % (self.systick[1] + 1)
+        return 0
+
+    def write_register(self, addr, value):
+        for p, base in enumerate(PIO_BASE):
+            if base <= addr < base + 0x144:
+                return self._pio_write(self.pio[p], addr - base, value)
+        if DMA_BASE <= addr < DMA_BASE + 0x300:
+            return self.dma.write_register(addr - DMA_BASE, value)
+        if addr == SYST_CSR:
+            self.systick[0] = value
+        elif addr == SYST_CSR + 4:
+            self.systick[1] = value & 0xFFFFFF
+        elif addr == SYST_CSR + 8:      # any write clears the current value
+            self.systick[2] = _time.perf_counter_ns()
+
+    def _pio_read(self, pio, offset):
+        if 0x20 <= offset < 0x30:   # RXF0 to RXF3
+            sm = pio.sms.get((offset - 0x20) >> 2)
+            if sm is None:
+                return 0
+            self._catch_up(sm)
+            return sm.get() if sm.rx else 0
+        if offset == 0x04:          # FSTAT
+            value = 0
+            for i in range(4):
+                sm = pio.sms.get(i)
+                rx = len(sm.rx) if sm else 0
+                tx = len(sm.tx) if sm else 0
+                value |= (rx == 0) << (8 + i) | (sm is not None and rx >= sm.rx_depth) << i
+                value |= (tx == 0) << (24 + i) | (sm is not None and tx >= sm.tx_depth) << (16 + i)
+            return value
+        if offset == 0x30:          # IRQ
+            return sum(f << i for i, f in enumerate(pio.irq_flags))
+        return 0
+
+    def _pio_write(self, pio, offset, value):
+        if 0x10 <= offset < 0x20:   # TXF0 to TXF3
+            sm = pio.sms.get((offset - 0x10) >> 2)
+            if sm is not None:
+                self._catch_up(sm)
+                if not sm.tx_full():
+                    sm.put(value)
+        elif offset == 0x30:        # IRQ, write 1 to clear
+            for i in range(8):
+                if value >> i & 1:
+                    pio.irq_flags[i] = 0
+
+    # Interrupts and the scheduler
+    def interrupt(self, handler, arg, hard):
+        if hard:
+            self.stats["hard_irqs"] += 1
+            self._call(handler, arg)
+        elif self.schedule(handler, arg):
+            self.stats["soft_irqs"] += 1
+        else:
+            self.stats["soft_irqs_lost"] += 1  # a soft interrupt is dropped when the scheduler queue is full
+
+    def schedule(self, func, arg):
+        if len(self.queue) >= SCHED_DEPTH:
+            return False
+        self.queue.append((func, arg, self.now))
+        self.stats["scheduled"] += 1
+        self.stats["max_queue"] = max(self.stats["max_queue"], len(self.queue))
+        return True
+
+    def run_scheduled(self):
+        while self.queue:
+            func, arg, t = self.queue.pop(0)
+            self.stats["max_latency_us"] = max(self.stats["max_latency_us"], (self.now - t) // 1000)
+            self._call(func, arg)
+
+    def _call(self, func, arg):
+        t = _time.perf_counter()
+        try:
+            func(arg)
+        finally:
+            self.stats["handler_s"] += _time.perf_counter() - t
+
+    # Time
+    def run_until(self, t_ns):
+        while self.time_ns < t_ns:
+            step = min(t_ns, self.time_ns + self.sched_ns)
+            for pio in self.pio:
+                for i in sorted(pio.sms):
+                    sm = pio.sms[i]
+                    if sm.running:
+                        sm.run_until(step)
+            self.time_ns = self.now = step
+            self.dma.service()
+            self.run_scheduled()
+
+    def run_us(self, us):
+        self.run_until(self.time_ns + int(us * 1000))
+
+    def run_ms(self, ms):
+        self.run_until(self.time_ns + int(ms * 1_000_000))
+
+    def ticks_us(self):
+        return (self.now // 1000) % TICKS_PERIOD
+
+    # Waveforms
+    def send_dcc(self, pin, packets, preamble=14, one_us=58, zero_us=100, jitter=None, checksum=True):
+        # Append DCC packets to the waveform of a pin, starting when the pin is idle, return the time after the last packet
+        # checksum=True adds the error detection byte, the time each end bit is complete is added to packet_ends
+        w = self.gpio.inputs.get(pin)
+        if w is None:
+            w = pio_emu.Waveform(0)
+            self.gpio.drive(pin, w)
+        t = max(w.end() + zero_us * 1000, self.time_ns + 10_000)
+        for packet in packets:
+            if checksum:
+                packet = pio_emu.with_checksum(packet)
+            bits = pio_emu.packet_bits(packet, preamble)
+            _, t_end = pio_emu.dcc_waveform(bits[:-1], t, one_us, zero_us, w, jitter)
+            _, t = pio_emu.dcc_waveform(bits[-1:], t_end, one_us, zero_us, w, jitter)
+            self.packet_ends.append(t_end + 75_000)    # State Machine 0 reads the end bit 75 us after its rising edge
+        return t
+### End Board Code
+
+### Install Code
+board = Board()
+
+def reset(sched_us=100):    # start again with a new board, modules already imported keep their state
+    global board
+    board = Board(sched_us)
+    return board
+
+class _ThreadSafeFlag:  # asyncio.ThreadSafeFlag of MicroPython
+    def __init__(self):
+        self._flag = False
+        self._event = None
+    def set(self):
+        self._flag = True
+        if self._event is not None:
+            self._event.set()
+    def clear(self):
+        self._flag = False
+    async def wait(self):
+        import asyncio
+        if self._event is None:
+            self._event = asyncio.Event()
+        if not self._flag:
+            self._event.clear()
+            await self._event.wait()
+        self._flag = False
+
+def _array_module():
+    # array('L') is 32 bits on the Pico and 64 bits on most computers, so 'L' and 'l' are mapped to 'I' and 'i'
+    import array as real
+    module = types.ModuleType("array")
+    module.__dict__.update(real.__dict__)
+
+    class array(real.array):
+        def __new__(cls, typecode, *args):
+            return real.array.__new__(cls, {"L": "I", "l": "i"}.get(typecode, typecode), *args)
+    module.array = array
+    module.virtual_pico = True
+    return module
+
+def install(virtual_time=True):
+    # Make rp2, uctypes, micropython and machine importable, add the viper built-ins, and return the board
+    here = os.path.dirname(os.path.abspath(__file__))
+    if here not in sys.path:
+        sys.path.insert(0, here)
+    if not getattr(sys.modules.get("array"), "virtual_pico", False):
+        sys.modules["array"] = _array_module()
+    builtins.const = lambda x: x
+    builtins.uint = uint
+    builtins.ptr8 = ptr8
+    builtins.ptr16 = ptr16
+    builtins.ptr32 = ptr32
+    import asyncio
+    if not hasattr(asyncio, "ThreadSafeFlag"):
+        asyncio.ThreadSafeFlag = _ThreadSafeFlag
+    if virtual_time:
+        _time.ticks_us = lambda: board.ticks_us()
+        _time.ticks_ms = lambda: (board.now // 1_000_000) % TICKS_PERIOD
+        _time.ticks_cpu = _time.ticks_us
+        _time.ticks_add = lambda t, delta: (t + delta) % TICKS_PERIOD
+        _time.ticks_diff = lambda t1, t2: ((t1 - t2 + TICKS_PERIOD // 2) % TICKS_PERIOD) - TICKS_PERIOD // 2
+        _time.sleep_us = lambda us: board.run_us(us)
+        _time.sleep_ms = lambda ms: board.run_ms(ms)
+        _time.sleep = lambda s: board.run_us(s * 1_000_000)
+    return board
+### End Install Code
@@ -0,0 +1,46 @@
+# RP2040 DCC train decoder
+# Benchmark of the packet decoder in DCC.py, which uses a table of 256 precomputed instruction actions (one lookup per packet),
+# against the previous decoder, which checks the address, then walks an if/elif chain of instruction groups with separate parsers.
+# MicroPython code of the parser functions is slow (700us), Viper code with one long parser function is faster (55us).
+# The packets are synthetic, so this runs on a Pico without a track signal, upload DCC.py, DCC_pio.py and reference_parsers.py first,
+# reference_parsers.py holds the previous decoder as chain_build_26().
+# Note: code was developed using MicroPython version v1.23
+
+import time
+import DCC
+import reference_parsers as ref
+
+### Adjustable Variables
+loops = 200
+
+### Definitions
+dcc_address_number = ref.dcc_address_number	# the address chain_build_26() decodes, set in reference_parsers.py
+# one packet of each instruction class for the decoder address, and one packet for another address
+packets = [
+    ref.packet(dcc_address_number, 0b10010101),             # F0-F4
+    ref.packet(dcc_address_number, 0b10110011),             # F5-F8
+    ref.packet(dcc_address_number, 0b10101001),             # F9-F12
+    ref.packet(dcc_address_number, 0b01110110),             # 28 step forward speed
+    ref.packet(dcc_address_number, 0b01010110),             # 28 step reverse speed
+    ref.packet(dcc_address_number, 0b00111111, 0b10010000), # 128 step speed
+    ref.packet(dcc_address_number, 0b11011110, 0b00000001), # F13-F20
+    ref.packet(dcc_address_number, 0b11101100, 0, 0),       # configuration variable access
+    ref.packet(dcc_address_number + 1, 0b10010101),         # another address
+]
+### End Definitions
+
+### Benchmark Code
+def bench(name, build):
+    t0 = time.ticks_us()
+    for i in range(loops):
+        for data0, data1 in packets:
+            build(data0, data1)
+    t1 = time.ticks_us()
+    print(name, time.ticks_diff(t1, t0) / (loops * len(packets)), "us per packet")
+
+ctx = DCC.decoder(dcc_address_number).ctx	# build the instruction table without starting the state machines
+def table_build(data0, data1):
+    DCC.func_btn_array_build(data0, data1, ctx)
+bench("if/elif chain:", ref.chain_build_26)
+bench("dispatch table:", table_build)
+### End Benchmark Code
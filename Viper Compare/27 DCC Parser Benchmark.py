@@ -0,0 +1,171 @@
+# RP2040 DCC train decoder
+# Benchmark suite of the packet parsers: every parser runs the same synthetic packet corpus, which covers short and long addresses,
+# all function groups, 28 and 128 step speed, accessory, idle, configuration variable and corrupted packets.
+# It reports the time and the memory allocated per packet, and compares the parsers of DCC.py with a stored baseline.
+# The parsers of the earlier experiments are the reference copies in reference_parsers.py:
+#   20 MicroPython code (700us per packet as measured in the IRQ handler), 24 viper one function (55us), 25 viper four functions (85us),
+#   26 if/elif chain, and the dispatch table and repeat cache of DCC.py.
+# On a Pico: upload DCC.py, DCC_pio.py and reference_parsers.py, then run this file, for example with mpremote run. The baseline file is
+# written next to it on the Pico.
+# On a computer: python3 "27 DCC Parser Benchmark.py" runs DCC.py on the virtual Pico in the Host Emulator folder.
+#   --save stores the results as the baseline of the platform (rp2 or host), main(save=True) does the same on a Pico.
+#   Later runs flag a DCC.py parser that is more than 25% slower than its baseline, and exit with 1 on a computer.
+#   The baseline depends on the machine, so "27 DCC Parser Benchmark baseline.json" is listed in .gitignore and each
+#   machine saves its own. A baseline saved before the corpus changed measured other packets, so save it again.
+# Note: code was developed using MicroPython version v1.23
+
+import sys
+import gc
+import json
+
+HOST = sys.implementation.name != "micropython"
+if HOST:
+    import os
+    here = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, os.path.join(here, "..", "Host Emulator"))
+    sys.path.insert(0, os.path.join(here, ".."))
+    import virtual_pico
+    virtual_pico.install(virtual_time=False)
+    BASELINE = os.path.join(here, "27 DCC Parser Benchmark baseline.json")
+else:
+    BASELINE = "27 DCC Parser Benchmark baseline.json"
+
+import time
+import DCC
+import reference_parsers as ref
+
+### Adjustable Variables
+long_address_number = 1000	# the short address is ref.dcc_address_number, the address of the earlier experiments
+loops = 200
+tolerance = 0.25			# a DCC.py parser more than 25% slower than its baseline is a regression
+
+### Definitions
+def corpus():   # the shared packet corpus as (data0, data1)
+    s = ref.dcc_address_number
+    hi = 0xC0 | (long_address_number >> 8)
+    lo = long_address_number & 0xFF
+    packets = []
+    for addr in ([s], [hi, lo]):
+        packets += [
+            ref.packet(*addr, 0b10010101),              # F0-F4
+            ref.packet(*addr, 0b10110011),              # F5-F8
+            ref.packet(*addr, 0b10101001),              # F9-F12
+            ref.packet(*addr, 0b11011110, 0b00000001),  # F13-F20
+            ref.packet(*addr, 0b11011111, 0b10000000),  # F21-F28
+            ref.packet(*addr, 0b11011000, 0b00000010),  # F29-F36
+            ref.packet(*addr, 0b11011001, 0b00010000),  # F37-F44
+            ref.packet(*addr, 0b11011010, 0b01000001),  # F45-F52
+            ref.packet(*addr, 0b11011011, 0b00001000),  # F53-F60
+            ref.packet(*addr, 0b11011100, 0b10000000),  # F61-F68
+            ref.packet(*addr, 0b01110110),              # 28 step forward speed
+            ref.packet(*addr, 0b01010110),              # 28 step reverse speed
+            ref.packet(*addr, 0b00111111, 0b10010000),  # 128 step speed
+            ref.packet(*addr, 0b11101100, 0, 0),        # configuration variable access
+        ]
+    packets += [
+        ref.packet(s + 1, 0b10010101),              # another short address
+        ref.packet(hi, lo + 1, 0b01110110),         # another long address
+        ref.packet(0x81, 0xF9),                     # basic accessory
+        ref.packet(0xFF, 0x00),                     # idle
+    ]
+    data0, data1 = ref.packet(s, 0b10010101)
+    packets.append((data0 ^ 0x100, data1))  # wrong error detection byte
+    return packets
+### End Definitions
+
+### Benchmark Code
+# name, parser, packet format ("word" is the bitstream word of the earlier experiments), True for the parsers of DCC.py
+parsers = [
+    ("20 MicroPython", ref.func_btn_array_build_20, "word", False),
+    ("24 viper one function", ref.parser_24, "word", False),
+    ("25 viper four functions", ref.func_btn_array_build_25, "word", False),
+    ("26 if/elif chain", ref.chain_build_26, "packet", False),
+    ("DCC.func_btn_array_build", DCC.func_btn_array_build, "packet", True),
+    ("DCC.packet_decode", DCC.packet_decode, "packet", True),
+]
+
+def ticks_us():  # a running clock, the virtual Pico keeps time.ticks_us() still while no PIO time passes
+    return time.perf_counter_ns() // 1000 if HOST else time.ticks_us()
+
+def ticks_diff(t1, t0):
+    return t1 - t0 if HOST else time.ticks_diff(t1, t0)
+
+def alloc_start():
+    gc.collect()
+    if HOST:
+        import tracemalloc
+        tracemalloc.start()
+        return tracemalloc.get_traced_memory()[0]
+    gc.disable()    # nothing is freed during the run, so the change of mem_alloc() is the memory allocated
+    return gc.mem_alloc()
+
+def alloc_end(start):
+    if HOST:
+        import tracemalloc
+        used = tracemalloc.get_traced_memory()[1] - start   # peak memory, CPython frees most objects at once
+        tracemalloc.stop()
+        return used
+    used = gc.mem_alloc() - start
+    gc.enable()
+    return used
+
+def bench(parse, args, ctx=None):  # return (microseconds, bytes allocated) per packet, the parsers of DCC.py are given ctx as well
+    n = loops * len(args)
+    t0 = ticks_us()
+    for i in range(loops):
+        if ctx is None:
+            for a, b in args:
+                parse(a, b)
+        else:
+            for a, b in args:
+                parse(a, b, ctx)
+    t1 = ticks_us()
+    start = alloc_start()
+    for a, b in args:
+        if ctx is None:
+            parse(a, b)
+        else:
+            parse(a, b, ctx)
+    used = alloc_end(start)
+    return ticks_diff(t1, t0) / n, used / len(args)
+
+def load_baseline():
+    try:
+        with open(BASELINE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def main(save=False):
+    ctx = DCC.decoder([ref.dcc_address_number, long_address_number]).ctx	# build the address matcher and the instruction table without starting the state machines
+    packets = corpus()
+    formats = {"packet": packets, "word": [(ref.bitstream_word(d0), 0) for d0, d1 in packets]}
+    platform = "host" if HOST else "rp2"
+    baseline = load_baseline()
+    base = baseline.get(platform, {})
+    results = {}
+    regressions = 0
+    print("{} packets x {} loops on {}".format(len(packets), loops, platform))
+    print("{:26s} {:>10s} {:>12s} {:>10s}".format("parser", "us/packet", "alloc B/pkt", "baseline"))
+    for name, parse, fmt, own in parsers:
+        us, alloc = bench(parse, formats[fmt], ctx if own else None)
+        results[name] = us
+        note = ""
+        if name in base:
+            note = "{:10.2f}".format(base[name])
+            if own and us > base[name] * (1 + tolerance):
+                note += "  REGRESSION"
+                regressions += 1
+        print("{:26s} {:10.2f} {:12.1f} {}".format(name, us, alloc, note))
+    if save:
+        baseline[platform] = results
+        with open(BASELINE, "w") as f:
+            json.dump(baseline, f)
+        print("baseline saved to", BASELINE)
+    return regressions == 0
+
+if __name__ == "__main__":
+    ok = main("--save" in sys.argv[1:])
+    if HOST:
+        sys.exit(0 if ok else 1)
+### End Benchmark Code
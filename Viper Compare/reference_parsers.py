@@ -0,0 +1,241 @@
+# RP2040 DCC train decoder
+# Reference copies of the packet parsers of the earlier experiments, shared by the parser benchmarks 26 and 27:
+#   20 MicroPython code, 24 viper one function and 25 viper four functions take the bitstream word of those experiments,
+#   26 is the if/elif chain that DCC.py used before the dispatch table, and takes the two packet words of State Machine 1.
+# The parsers keep their state in the globals of this module, as the experiments did. Upload this file, DCC.py and DCC_pio.py to run
+# the benchmarks on a Pico.
+# Note: code was developed using MicroPython version v1.23
+
+import array
+import uctypes
+import micropython
+import DCC
+
+### Adjustable Variables
+dcc_address_number = 3		# the earlier experiments decode one short address
+
+### Definitions
+short_address = 127
+semaphore = 0
+func_btn_array = 0
+throttle_pos = 0
+throttle_dir = 0
+func_btn_array_24 = array.array('L',[0])
+func_btn_array_24_addr = uctypes.addressof(func_btn_array_24)
+
+def packet(*data):  # two words of a packet as sent by State Machine 1 of DCC.py, including the error detection byte
+    data = list(data)
+    x = 0
+    for byte in data:
+        x ^= byte
+    data.append(x)
+    missing = 6 - len(data)
+    data += [0] * missing
+    return ((data[0] << 24) | (data[1] << 16) | (data[2] << 8) | data[3], (data[4] << 24) | (data[5] << 16) | missing)
+
+def bitstream_word(data0):  # the word the earlier experiments decoded: the first 32 bits after the start bit, with the start bits between the bytes
+    b = [(data0 >> 24) & 0xFF, (data0 >> 16) & 0xFF, (data0 >> 8) & 0xFF, data0 & 0xFF]
+    return b[0] << 24 | b[1] << 15 | b[2] << 6 | b[3] >> 3
+### End Definitions
+
+### 20 MicroPython Parser Code
+def addr_parser_20(data_): # parse bits from data to obtain the address
+    bit0 = ((data_ >> 24 & 1) != 0)
+    bit1 = ((data_ >> 25 & 1) != 0)
+    bit2 = ((data_ >> 26 & 1) != 0)
+    bit3 = ((data_ >> 27 & 1) != 0)
+    bit4 = ((data_ >> 28 & 1) != 0)
+    bit5 = ((data_ >> 29 & 1) != 0)
+    bit6 = ((data_ >> 30 & 1) != 0)
+    return bit6 << 6 | bit5 << 5 | bit4 << 4 | bit3 << 3 | bit2 << 2 | bit1 << 1 | bit0 << 0
+
+def func_grp_parser_20(data_): # parse bits from data to obtain the function group number
+    bit0 = ((data_ >> 19 & 1) != 0)
+    bit1 = ((data_ >> 20 & 1) != 0)
+    bit2 = ((data_ >> 21 & 1) != 0)
+    bit3 = ((data_ >> 22 & 1) != 0)
+    return bit3 << 3 | bit2 << 2 | bit1 << 1 | bit0 << 0
+
+def func_btn_parser_20(data_): # parse bits from data to obtain the state of the function buttons
+    bit0 = ((data_ >> 15 & 1) != 0)
+    bit1 = ((data_ >> 16 & 1) != 0)
+    bit2 = ((data_ >> 17 & 1) != 0)
+    bit3 = ((data_ >> 18 & 1) != 0)
+    return bit3 << 3 | bit2 << 2 | bit1 << 1 | bit0 << 0
+
+def func_btn_array_build_20(data_,func_btn_array_):    # Update and build the function button array from data
+    global semaphore, func_btn_array
+    semaphore = 1   # Prevent other functions from accessing func_btn_array while manipulating this variables
+    if addr_parser_20(data_) == dcc_address_number:
+        if func_grp_parser_20(data_) == 0b1000: # F1-F4
+            func_btn_array_ = func_btn_array_ & 0b1111111100001
+            func_btn_array_ = func_btn_array_ | func_btn_parser_20(data_) << 1
+        elif func_grp_parser_20(data_) == 0b1001: # F1-F4
+            func_btn_array_ = func_btn_array_ & 0b1111111100001
+            func_btn_array_ = func_btn_array_ | func_btn_parser_20(data_) << 1
+        elif func_grp_parser_20(data_) == 0b1011: # F5-F8
+            func_btn_array_ = func_btn_array_ & 0b1111000011111
+            func_btn_array_ = func_btn_array_ | func_btn_parser_20(data_) << 5
+        elif func_grp_parser_20(data_) == 0b1010: # F9-F12
+            func_btn_array_ = func_btn_array_ & 0b0000111111111
+            func_btn_array_ = func_btn_array_ | func_btn_parser_20(data_) << 9
+        func_btn_array = func_btn_array_
+    semaphore = 0 # Allow access of func_btn_array to other functions
+### End 20 MicroPython Parser Code
+
+### 24 Viper One Function Parser Code
+# The function button array address is read from a global instead of the 4th argument, so every parser takes two arguments
+@micropython.viper
+def parser_24(data_:int, func_btn_array_:int):
+    global semaphore
+    semaphore = 1
+    addr_bit0 = ((int(data_) >> 24 & 1) != 0)
+    addr_bit1 = ((int(data_) >> 25 & 1) != 0)
+    addr_bit2 = ((int(data_) >> 26 & 1) != 0)
+    addr_bit3 = ((int(data_) >> 27 & 1) != 0)
+    addr_bit4 = ((int(data_) >> 28 & 1) != 0)
+    addr_bit5 = ((int(data_) >> 29 & 1) != 0)
+    addr_bit6 = ((int(data_) >> 30 & 1) != 0)
+    address_ = int(addr_bit6) << 6 | int(addr_bit5) << 5 | int(addr_bit4) << 4 | int(addr_bit3) << 3 | int(addr_bit2) << 2 | int(addr_bit1) << 1 | int(addr_bit0) << 0
+    if address_ == int(dcc_address_number):
+        grp_bit0 = ((int(data_) >> 19 & 1) != 0)
+        grp_bit1 = ((int(data_) >> 20 & 1) != 0)
+        grp_bit2 = ((int(data_) >> 21 & 1) != 0)
+        grp_bit3 = ((int(data_) >> 22 & 1) != 0)
+        func_grp_ = int(grp_bit3) << 3 | int(grp_bit2) << 2 | int(grp_bit1) << 1 | int(grp_bit0) << 0
+        btn_bit0 = ((int(data_) >> 15 & 1) != 0)
+        btn_bit1 = ((int(data_) >> 16 & 1) != 0)
+        btn_bit2 = ((int(data_) >> 17 & 1) != 0)
+        btn_bit3 = ((int(data_) >> 18 & 1) != 0)
+        btn_bits = int(btn_bit3) << 3 | int(btn_bit2) << 2 | int(btn_bit1) << 1 | int(btn_bit0) << 0
+        if func_grp_ == 0b1000 or func_grp_ == 0b1001: # F1-F4
+            func_btn_array_ = int(func_btn_array_) & 0b1111111100001
+            func_btn_array_ = int(func_btn_array_) | btn_bits << 1
+        elif func_grp_ == 0b1011: # F5-F8
+            func_btn_array_ = int(func_btn_array_) & 0b1111000011111
+            func_btn_array_ = int(func_btn_array_) | btn_bits << 5
+        elif func_grp_ == 0b1010: # F9-F12
+            func_btn_array_ = int(func_btn_array_) & 0b0000111111111
+            func_btn_array_ = int(func_btn_array_) | btn_bits << 9
+        ptr32(func_btn_array_24_addr)[0] = int(func_btn_array_)
+    semaphore = 0
+### End 24 Viper One Function Parser Code
+
+### 25 Viper Four Functions Parser Code
+@micropython.viper
+def addr_parser_25(data_:int)->int: # parse bits from data to obtain the address
+    bit0 = ((int(data_) >> 24 & 1) != 0)
+    bit1 = ((int(data_) >> 25 & 1) != 0)
+    bit2 = ((int(data_) >> 26 & 1) != 0)
+    bit3 = ((int(data_) >> 27 & 1) != 0)
+    bit4 = ((int(data_) >> 28 & 1) != 0)
+    bit5 = ((int(data_) >> 29 & 1) != 0)
+    bit6 = ((int(data_) >> 30 & 1) != 0)
+    return int(bit6) << 6 | int(bit5) << 5 | int(bit4) << 4 | int(bit3) << 3 | int(bit2) << 2 | int(bit1) << 1 | int(bit0) << 0
+
+@micropython.viper
+def func_grp_parser_25(data_:int)->int: # parse bits from data to obtain the function group number
+    bit0 = ((int(data_) >> 19 & 1) != 0)
+    bit1 = ((int(data_) >> 20 & 1) != 0)
+    bit2 = ((int(data_) >> 21 & 1) != 0)
+    bit3 = ((int(data_) >> 22 & 1) != 0)
+    return int(bit3) << 3 | int(bit2) << 2 | int(bit1) << 1 | int(bit0) << 0
+
+@micropython.viper
+def func_btn_parser_25(data_:int)->int: # parse bits from data to obtain the state of the function buttons
+    bit0 = ((int(data_) >> 15 & 1) != 0)
+    bit1 = ((int(data_) >> 16 & 1) != 0)
+    bit2 = ((int(data_) >> 17 & 1) != 0)
+    bit3 = ((int(data_) >> 18 & 1) != 0)
+    return int(bit3) << 3 | int(bit2) << 2 | int(bit1) << 1 | int(bit0) << 0
+
+@micropython.viper
+def func_btn_array_build_25(data_:int,func_btn_array_:int):    # Update and build the function button array from data
+    global semaphore
+    semaphore = 1   # Prevent other functions from accessing func_btn_array while manipulating this variables
+    if int(addr_parser_25(data_)) == int(dcc_address_number):
+        func_grp_parser_ = int(func_grp_parser_25(data_))
+        if func_grp_parser_ == 0b1000: # F1-F4
+            func_btn_array_ = int(func_btn_array_) & int(0b1111111100001)
+            func_btn_array_ = int(func_btn_array_) | int(func_btn_parser_25(data_)) << 1
+        elif func_grp_parser_ == 0b1001: # F1-F4
+            func_btn_array_ = int(func_btn_array_) & 0b1111111100001
+            func_btn_array_ = int(func_btn_array_) | int(func_btn_parser_25(data_)) << 1
+        elif func_grp_parser_ == 0b1011: # F5-F8
+            func_btn_array_ = int(func_btn_array_) & 0b1111000011111
+            func_btn_array_ = int(func_btn_array_) | int(func_btn_parser_25(data_)) << 5
+        elif func_grp_parser_ == 0b1010: # F9-F12
+            func_btn_array_ = int(func_btn_array_) & 0b0000111111111
+            func_btn_array_ = int(func_btn_array_) | int(func_btn_parser_25(data_)) << 9
+        ptr32(func_btn_array_24_addr)[0] = int(func_btn_array_)
+    semaphore = 0 # Allow access of func_btn_array to other functions
+### End 25 Viper Four Functions Parser Code
+
+### 26 If/Elif Chain Parser Code
+@micropython.viper
+def addr_parser_26(data0:uint,dcc_address_number_:uint)->bool: # parse bits from data to obtain the address
+    if uint(dcc_address_number_) > uint(short_address):
+        if (uint(data0) >> 30) != 0b11:    # the first byte of a long address starts with 11
+            return False
+        data0addr_MSByte = (uint(data0) >> 24) & 0b00111111
+        data0addr_LSByte = (uint(data0) >> 16) & 0xFF
+        data0addr = (uint(data0addr_MSByte) << 8) + uint(data0addr_LSByte)	# parse long address
+        return uint(data0addr) == uint(dcc_address_number_)
+    else:
+        data0addr = uint(data0) >> 24		# parse short address, the first byte of a short address starts with 0
+        return uint(data0addr) == uint(dcc_address_number_)
+
+@micropython.viper
+def instr_parser_26(data0:uint)->uint: # parse bits from data to obtain the instruction byte, which follows the address
+    if uint(dcc_address_number) > uint(short_address):
+        return (uint(data0) >> 8) & 0xFF
+    else:
+        return (uint(data0) >> 16) & 0xFF
+
+@micropython.viper
+def _28_step_throttle_26(data0:uint):
+    global throttle_pos
+    instr = uint(instr_parser_26(data0))
+    speed = ((instr & 0b1111) << 1) | ((instr >> 4) & 1)    # instruction is 01DCSSSS, the speed is SSSSC
+    if speed > 3:   # speed 0 and 1 are stop, 2 and 3 are emergency stop
+        throttle_pos = speed - 3
+    else:
+        throttle_pos = 0
+
+@micropython.viper
+def _126_step_throttle_26(data0:uint):
+    global throttle_pos, throttle_dir
+    if uint(dcc_address_number) > uint(short_address):
+        speed = uint(data0) & 0xFF  # byte after the instruction is DSSSSSSS
+    else:
+        speed = (uint(data0) >> 8) & 0xFF
+    throttle_dir = int((speed >> 7) & 1)
+    throttle_pos = int(speed & 0b1111111)
+
+@micropython.viper
+def chain_build_26(data0:uint,data1:uint):    # Update and build the function button array from data
+    global semaphore, throttle_dir, func_btn_array
+    if not int(DCC.packet_check(data0,data1)):  # drop packets with a wrong length or error detection byte
+        return
+    semaphore = 1   # Prevent other functions from accessing func_btn_array while manipulating this variables
+    if int(addr_parser_26(data0,dcc_address_number)):
+        func_btn_array_ = int(func_btn_array)
+        func_grp_parser_ = int(instr_parser_26(data0)) >> 4
+        func_btn_parser_ = int(instr_parser_26(data0)) & 0b1111
+        if func_grp_parser_ == 0b1000 or func_grp_parser_ == 0b1001: # F0-F4
+            func_btn_array_ = (func_btn_array_ & 0b1111111100001) | func_btn_parser_ << 1
+        elif func_grp_parser_ == 0b1011: # F5-F8
+            func_btn_array_ = (func_btn_array_ & 0b1111000011111) | func_btn_parser_ << 5
+        elif func_grp_parser_ == 0b1010: # F9-F12
+            func_btn_array_ = (func_btn_array_ & 0b0000111111111) | func_btn_parser_ << 9
+        elif func_grp_parser_ == 0b0011: # 126 step speed
+            _126_step_throttle_26(data0)
+        elif func_grp_parser_ == 0b0100 or func_grp_parser_ == 0b0101: # 28 step reverse speed
+            throttle_dir = int(0)
+            _28_step_throttle_26(data0)
+        elif func_grp_parser_ == 0b0110 or func_grp_parser_ == 0b0111: # 28 step forward speed
+            throttle_dir = int(1)
+            _28_step_throttle_26(data0)
+        func_btn_array = int(func_btn_array_)
+    semaphore = 0 # Allow access of func_btn_array to other functions
+### End 26 If/Elif Chain Parser Code
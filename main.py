@@ -8,10 +8,14 @@ LED = Pin(25, Pin.OUT)
 # and enter the desired DCC address for this decoder.
 # Note: appropriate circuitry is needed between the Pico
 # and the railroad tracks to protect the Pico from damage.
-my_dcc_decoder = DCC.pin_addr(16,1) # (pin, addr)
+def led(addr, n, state):	# called as soon as function button 'n' changes, state is True or False
+    LED.value(state)
 
-while True:					# DCC.f_btn(n) returns True or False of button number 'n'
-    LED.value(DCC.f_btn(3))	# Works for function buttons 1 to 12
-    print("DCC", f"{DCC.func_btn_array[0]:013b}") # print the array of function buttons
+my_dcc_decoder = DCC.pin_addr(16,1,on_func={3: led}) # (pin, addr, function button 3 calls led())
+# Works for function buttons 0 to 68, DCC.f_btn(n) can also be used to read button number 'n' at any time
+
+while True:
+    speed, direction, funcs = DCC.snapshot()	# DCC.snapshot() returns the throttle and function buttons from the same packet
+    print("DCC", speed, direction, f"{funcs:013b}") # print the throttle and the array of function buttons
     time.sleep(0.5)
     